@@ -3,6 +3,7 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.utils import timezone
 from datetime import timedelta
+from .checkins import ensure_flushed
 from .models import Course, Student, Lecturer, Attendance, AttendanceToken
 
 def is_admin(user):
@@ -27,7 +28,7 @@ def admin_dashboard(request):
     active_sessions = Attendance.objects.filter(is_active=True).count()
     
     # Active tokens
-    active_tokens = AttendanceToken.objects.filter(is_active=True).count()
+    active_tokens = AttendanceToken.objects.filter(is_active=True, expires_at__gt=timezone.now()).count()
     
     # Recent activity (last 7 days)
     week_ago = timezone.now() - timedelta(days=7)
@@ -81,7 +82,8 @@ def admin_attendance_report(request):
     date_from = request.GET.get('date_from')
     date_to = request.GET.get('date_to')
     
-    attendances = Attendance.objects.all().select_related('course').prefetch_related('present_students')
+    ensure_flushed()
+    attendances = Attendance.objects.all().select_related('course')
     
     if course_id:
         attendances = attendances.filter(course_id=course_id)
@@ -90,12 +92,7 @@ def admin_attendance_report(request):
     if date_to:
         attendances = attendances.filter(date__lte=date_to)
     
-    # Calculate attendance rates
-    for attendance in attendances:
-        total_enrolled = attendance.course.students.count()
-        present_count = attendance.present_students.count()
-        attendance.attendance_rate = (present_count / total_enrolled * 100) if total_enrolled > 0 else 0
-    
+    # Rates come from the maintained present/enrolled counters
     context = {
         'courses': courses,
         'attendances': attendances.order_by('-date'),
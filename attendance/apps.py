@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class AttendanceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'attendance'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        from django.conf import settings
+        if settings.LOADTEST_DB_LATENCY_MS:
+            from .loadtest import add_query_latency
+            add_query_latency(settings.LOADTEST_DB_LATENCY_MS / 1000)
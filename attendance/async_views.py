@@ -0,0 +1,201 @@
+"""
+Async check-in endpoints for ASGI deployments.
+
+With DEPLOYMENT_MODE=asgi (the default of attendance_system/asgi.py) urls.py
+serves take_attendance, submit-location, lecturer-location and
+sync/attendance with these views instead of the DRF ones. They answer from
+the token, enrollment and auth caches on the event loop and use the async
+ORM for the writes, so one process keeps hundreds of check-ins in flight
+instead of one per worker thread. Requests, responses and errors match the
+DRF views; the endpoints are then missing from the Swagger schema.
+
+DRF views are sync-only, so async_api_view does the part of APIView these
+endpoints need: JSON or form bodies, HeaderSchemeAuthentication and DRF's
+401/404/405 payloads.
+"""
+import json
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.utils.encoders import JSONEncoder
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .authentication import HeaderSchemeAuthentication
+from .checkins import acheck_in
+from .enrollment import ais_enrolled
+from .roles import PROFILE_IDS_ATTRIBUTE, student_pk
+from .sync import IDEMPOTENCY_KEY_MAX_LENGTH, REPLAYED_HEADER, IdempotencyKeyReused, sync_upload
+from .token_cache import aresolve_active_token
+
+
+def _response(data, status=200, headers=None):
+    # DRF's encoder, so decimals and dates render as in the sync views.
+    return JsonResponse(data, status=status, headers=headers, encoder=JSONEncoder, safe=False)
+
+
+def _error(detail, status):
+    return _response(detail if isinstance(detail, dict) else {'detail': detail}, status)
+
+
+def _parse(request):
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    return request.POST
+
+
+async def _student_pk(user):
+    ids = getattr(user, PROFILE_IDS_ATTRIBUTE, None)
+    if ids is not None:
+        return ids[0]
+    return await sync_to_async(student_pk)(user)
+
+
+def async_api_view(view):
+    """Serve an async view(request, data) as an authenticated POST-only API endpoint"""
+    authentication = HeaderSchemeAuthentication()
+
+    @csrf_exempt
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            response = _error(f'Method "{request.method}" not allowed.', 405)
+            response['Allow'] = 'POST, OPTIONS'
+            return response
+
+        try:
+            user_auth = await authentication.aauthenticate(request)
+        except exceptions.AuthenticationFailed as exc:
+            user_auth, detail = None, exc.detail
+        else:
+            detail = exceptions.NotAuthenticated.default_detail
+        if user_auth is None:
+            response = _error(detail, 401)
+            response['WWW-Authenticate'] = authentication.authenticate_header(request)
+            return response
+        request.user, request.auth = user_auth
+
+        try:
+            data = _parse(request)
+        except ValueError as exc:
+            return _error(f'JSON parse error - {exc}', 400)
+        if not hasattr(data, 'get'):
+            return _error('Expected a JSON object.', 400)
+        return await view(request, data, *args, **kwargs)
+
+    return wrapper
+
+
+@async_api_view
+async def take_attendance(request, data):
+    token_value = data.get('token')
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+
+    if not token_value:
+        return _response({'error': 'Token is required.'}, 400)
+
+    attendance_token = await aresolve_active_token(token_value)
+    if attendance_token is None:
+        return _response({'error': 'Invalid or expired token.'}, 400)
+
+    student_id = await _student_pk(request.user)
+    if student_id is None:
+        return _error('No Student matches the given query.', 404)
+
+    if not await ais_enrolled(attendance_token.course_id, student_id):
+        return _response({'error': 'Student is not enrolled in this course.'}, 400)
+
+    is_valid, distance = attendance_token.validate_location(latitude, longitude)
+    if not is_valid:
+        if distance < 0:
+            return _response({'error': 'Location data required for this course.'}, 400)
+        return _response({
+            'error': f'You are outside the allowed radius. You are {distance:.2f}m away from the class location.'
+        }, 400)
+
+    await acheck_in(attendance_token.course_id, student_id, distance=distance, device_id=data.get('device_id'))
+    return _response({'message': 'Attendance recorded successfully.', 'distance': distance})
+
+
+@async_api_view
+async def submit_location(request, data):
+    token = await aresolve_active_token(data.get('attendance_token'))
+    if token is None:
+        return _response({'error': 'Invalid or expired token'}, 400)
+
+    is_valid, distance = token.validate_location(data.get('latitude'), data.get('longitude'))
+    if is_valid:
+        student_id = await _student_pk(request.user)
+        if student_id is not None and await ais_enrolled(token.course_id, student_id):
+            await acheck_in(token.course_id, student_id, distance=distance, device_id=data.get('device_id'))
+            return _response({'status': 'Attendance marked successfully'})
+        return _response({'error': 'Student not enrolled in this course'}, 400)
+
+    return _response({'error': 'Location is out of range'}, 400)
+
+
+@async_api_view
+async def lecturer_location(request, data):
+    token = await aresolve_active_token(data.get('token'))
+    if token is None:
+        return _response({'error': 'Invalid or expired token.'}, 400)
+
+    if token.lecturer_latitude is None or token.lecturer_longitude is None:
+        return _response({'error': 'Lecturer coordinates not set.'}, 400)
+
+    return _response({
+        'longitude': token.lecturer_longitude,
+        'latitude': token.lecturer_latitude,
+        'token': token.token,
+    })
+
+
+@async_api_view
+async def sync_attendance(request, data):
+    records = data.get('records', [])
+    if not records:
+        return _response({'error': 'No records provided'}, 400)
+
+    key = request.headers.get('Idempotency-Key')
+    if key and len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return _response({'error': 'Idempotency-Key is too long.'}, 400)
+    # One transaction of set-based queries; the async ORM cannot run
+    # transactions, so the batch is ingested in the request's sync thread.
+    try:
+        body, replayed = await sync_to_async(sync_upload)(request.user.pk, records, key)
+    except IdempotencyKeyReused as exc:
+        return _response({'error': str(exc)}, 422)
+    return _response(body, headers={REPLAYED_HEADER: 'true'} if replayed else None)
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise 6.7 is sync-only, and one sync middleware makes Django run every
+    request in a thread of its own. This serves static files the same way but
+    hands everything else on to async views without leaving the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self._acall(request)
+        return super().__call__(request)
+
+    async def _acall(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
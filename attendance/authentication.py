@@ -0,0 +1,277 @@
+"""
+API authentication.
+
+CachedTokenAuthentication keeps what a DRF token resolves to (user id, role
+and profile ids) in the shared cache, so an authenticated request costs no
+query until the view reads more of the user. Entries are revoked as soon as
+the token is deleted (logout) or its user changes or is deactivated, see
+signals.py.
+
+ClaimsJWTAuthentication does the same for JWTs without any cache entry of
+their own: issue_jwt() puts the role and profile ids in the token, and the
+only state checked per request is the user's AuthTokenVersion (cached), which
+revoke_user_jwts() bumps to invalidate every JWT issued before.
+
+HeaderSchemeAuthentication picks the authenticator from the Authorization
+header's scheme, so each request runs exactly one of them. Its
+aauthenticate() serves the async views: cache hits are answered on the event
+loop and only misses fall back to the sync path in a thread.
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from django.db.models import F
+from django.utils.module_loading import import_string
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .metrics import record_cache
+from .models import AuthTokenVersion
+from .roles import PROFILE_IDS_ATTRIBUTE, ROLE_ATTRIBUTE, lecturer_profile, student_profile, user_role
+
+AUTH_TOKEN_CACHE_PREFIX = 'auth-token'
+# Fields of the user loaded from the cache: those the profile serializers and
+# the admin checks read, in model order as Model.from_db() expects. The rest
+# are deferred and fetched on first access.
+CACHED_USER_FIELDS = ('id', 'is_superuser', 'username', 'first_name', 'last_name', 'email', 'is_staff', 'is_active')
+# Bumped whenever CACHED_USER_FIELDS changes, so entries of the old layout are
+# never read back.
+AUTH_TOKEN_ENTRY_VERSION = 2
+JWT_VERSION_CACHE_PREFIX = 'auth-jwt-version'
+TOKEN_VERSION_CLAIM = 'ver'
+# Fields of the user built from JWT claims. The username is left out so that
+# renaming a user does not have to revoke their tokens.
+JWT_USER_FIELDS = ('id', 'is_active')
+
+
+def _cache_key(key):
+    # Token keys are credentials; keep them out of the cache's key space.
+    return f"{AUTH_TOKEN_CACHE_PREFIX}:v{AUTH_TOKEN_ENTRY_VERSION}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def revoke_token(key):
+    cache.delete(_cache_key(key))
+
+
+def revoke_user_tokens(user_id):
+    keys = [_cache_key(key) for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True)]
+    if keys:
+        cache.delete_many(keys)
+
+
+def _entry(token):
+    user = token.user
+    student = student_profile(user)
+    lecturer = lecturer_profile(user)
+    return {
+        'user': [getattr(user, name) for name in CACHED_USER_FIELDS],
+        'role': user_role(user),
+        'student_id': student.pk if student is not None else None,
+        'lecturer_id': lecturer.pk if lecturer is not None else None,
+    }
+
+
+def _lazy_user(fields, values, role, student_id, lecturer_id):
+    UserModel = get_user_model()
+    user = UserModel.from_db(router.db_for_read(UserModel), fields, values)
+    setattr(user, ROLE_ATTRIBUTE, role)
+    setattr(user, PROFILE_IDS_ATTRIBUTE, (student_id, lecturer_id))
+    return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication backed by the shared cache for AUTH_TOKEN_CACHE_TIMEOUT seconds"""
+
+    def authenticate_credentials(self, key):
+        cache_key = _cache_key(key)
+        entry = cache.get(cache_key)
+        record_cache(AUTH_TOKEN_CACHE_PREFIX, entry is not None)
+        if entry is None:
+            try:
+                token = Token.objects.select_related('user__student', 'user__lecturer').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            entry = _entry(token)
+            cache.set(cache_key, entry, timeout=settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+        return self._from_entry(key, entry)
+
+    def _from_entry(self, key, entry):
+        user = _lazy_user(CACHED_USER_FIELDS, entry['user'], entry['role'], entry['student_id'], entry['lecturer_id'])
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        # Unsaved stand-in for the Token row; deleting it (logout) still works
+        # because the key is its primary key.
+        token = Token(key=key, user=user)
+        user.auth_token = token
+        return user, token
+
+    async def aauthenticate(self, request):
+        header = get_authorization_header(request).split()
+        if len(header) == 2 and header[0].lower() == self.keyword.lower().encode():
+            try:
+                key = header[1].decode()
+            except UnicodeError:
+                key = None
+            if key is not None:
+                entry = await cache.aget(_cache_key(key))
+                if entry is not None:
+                    record_cache(AUTH_TOKEN_CACHE_PREFIX, True)
+                    return self._from_entry(key, entry)
+        # Misses and malformed headers take the sync path, which raises the same errors.
+        return await sync_to_async(self.authenticate)(request)
+
+
+def _version_key(user_id):
+    return f"{JWT_VERSION_CACHE_PREFIX}:{user_id}"
+
+
+def token_version(user_id):
+    """The user's current JWT version, or None for users without one (e.g. deleted)"""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    record_cache(JWT_VERSION_CACHE_PREFIX, version is not None)
+    if version is None:
+        version = AuthTokenVersion.objects.filter(user_id=user_id).values_list('version', flat=True).first()
+        if version is not None:
+            cache.set(key, version, timeout=settings.AUTH_TOKEN_CACHE_TIMEOUT)
+    return version
+
+
+async def atoken_version(user_id):
+    """token_version() for async views"""
+    key = _version_key(user_id)
+    version = await cache.aget(key)
+    record_cache(JWT_VERSION_CACHE_PREFIX, version is not None)
+    if version is None:
+        version = await AuthTokenVersion.objects.filter(user_id=user_id).values_list('version', flat=True).afirst()
+        if version is not None:
+            await cache.aset(key, version, timeout=settings.AUTH_TOKEN_CACHE_TIMEOUT)
+    return version
+
+
+def revoke_user_jwts(user_id):
+    # Users without a row have never been issued a JWT by issue_jwt().
+    AuthTokenVersion.objects.filter(user_id=user_id).update(version=F('version') + 1)
+    forget_token_version(user_id)
+
+
+def forget_token_version(user_id):
+    cache.delete(_version_key(user_id))
+
+
+def issue_jwt(user):
+    """A RefreshToken for a user loaded by RoleAwareBackend; its access token inherits the claims"""
+    version, _ = AuthTokenVersion.objects.get_or_create(user=user)
+    cache.set(_version_key(user.pk), version.version, timeout=settings.AUTH_TOKEN_CACHE_TIMEOUT)
+    student = student_profile(user)
+    lecturer = lecturer_profile(user)
+    refresh = RefreshToken.for_user(user)
+    refresh['role'] = user_role(user)
+    refresh['student_pk'] = student.pk if student is not None else None
+    refresh['student_id'] = student.student_id if student is not None else None
+    refresh['lecturer_pk'] = lecturer.pk if lecturer is not None else None
+    refresh['staff_id'] = lecturer.staff_id if lecturer is not None else None
+    refresh[TOKEN_VERSION_CLAIM] = version.version
+    return refresh
+
+
+def _check_version(token, exception_class):
+    if token_version(token[jwt_settings.USER_ID_CLAIM]) != token[TOKEN_VERSION_CLAIM]:
+        raise exception_class('Token has been revoked.', code='token_revoked')
+
+
+def _claims_user(token):
+    return _lazy_user(
+        JWT_USER_FIELDS,
+        [token[jwt_settings.USER_ID_CLAIM], True],
+        token['role'],
+        token['student_pk'],
+        token['lecturer_pk'],
+    )
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that builds the user from the claims of issue_jwt() instead of loading it"""
+
+    def get_user(self, validated_token):
+        if TOKEN_VERSION_CLAIM not in validated_token:
+            # Issued before tokens carried claims; they expire on their own.
+            return super().get_user(validated_token)
+        _check_version(validated_token, exceptions.AuthenticationFailed)
+        return _claims_user(validated_token)
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        if TOKEN_VERSION_CLAIM not in validated_token:
+            return await sync_to_async(self.get_user)(validated_token), validated_token
+        user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        if await atoken_version(user_id) != validated_token[TOKEN_VERSION_CLAIM]:
+            raise exceptions.AuthenticationFailed('Token has been revoked.', code='token_revoked')
+        return _claims_user(validated_token), validated_token
+
+
+class VersionedTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refuse to refresh tokens revoked by revoke_user_jwts()"""
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if TOKEN_VERSION_CLAIM in refresh:
+            _check_version(refresh, InvalidToken)
+        return super().validate(attrs)
+
+
+class HeaderSchemeAuthentication(BaseAuthentication):
+    """
+    Dispatch on the Authorization scheme through AUTHENTICATION_SCHEMES
+    (e.g. Token -> CachedTokenAuthentication, Bearer -> JWTAuthentication).
+    Requests without a known scheme are anonymous.
+    """
+
+    def __init__(self):
+        self.authenticators = {
+            scheme.lower(): import_string(path)()
+            for scheme, path in settings.AUTHENTICATION_SCHEMES.items()
+        }
+        self.default_scheme = next(iter(settings.AUTHENTICATION_SCHEMES))
+
+    def authenticate(self, request):
+        header = get_authorization_header(request).split()
+        if not header:
+            return None
+        authenticator = self.authenticators.get(header[0].decode('latin-1').lower())
+        if authenticator is None:
+            return None
+        return authenticator.authenticate(request)
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views, on a plain Django request"""
+        header = get_authorization_header(request).split()
+        if not header:
+            return None
+        authenticator = self.authenticators.get(header[0].decode('latin-1').lower())
+        if authenticator is None:
+            return None
+        if hasattr(authenticator, 'aauthenticate'):
+            return await authenticator.aauthenticate(request)
+        return await sync_to_async(authenticator.authenticate)(request)
+
+    def authenticate_header(self, request):
+        return self.authenticators[self.default_scheme.lower()].authenticate_header(request)
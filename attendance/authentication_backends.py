@@ -1,24 +1,54 @@
+from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
-from attendance.models import Student, Lecturer
 
-class StudentBackend(ModelBackend):
-    def authenticate(self, request, username=None, password=None, student_id=None, **kwargs):
+from attendance.roles import lecturer_profile, student_profile, user_role
+
+# Reverse one-to-one relations a login or session needs, loaded with the user.
+ROLE_RELATIONS = ('student', 'lecturer', 'auth_token')
+
+
+class RoleAwareBackend(ModelBackend):
+    """
+    Username/password backend that loads the user together with its student
+    and lecturer profiles and API token in one query and hashes the password
+    exactly once. If student_id or staff_id is given it must match the
+    user's profile, like the former StudentBackend/StaffBackend required.
+    """
+
+    def authenticate(self, request, username=None, password=None, student_id=None, staff_id=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
         try:
-            student = Student.objects.get(user__username=username, student_id=student_id)
-        except Student.DoesNotExist:
+            user = UserModel._default_manager.select_related(*ROLE_RELATIONS).get(
+                **{UserModel.USERNAME_FIELD: username}
+            )
+        except UserModel.DoesNotExist:
+            # Run the hasher anyway so unknown usernames take as long as wrong passwords.
+            UserModel().set_password(password)
+            return None
+
+        if not (user.check_password(password) and self.user_can_authenticate(user)):
             return None
+        if student_id is not None:
+            student = student_profile(user)
+            if student is None or student.student_id != student_id:
+                return None
+        if staff_id is not None:
+            lecturer = lecturer_profile(user)
+            if lecturer is None or lecturer.staff_id != staff_id:
+                return None
 
-        if student.user.check_password(password):
-            return student.user
-        return None
+        user_role(user)
+        return user
 
-class StaffBackend(ModelBackend):
-    def authenticate(self, request, username=None, password=None, staff_id=None, **kwargs):
+    def get_user(self, user_id):
+        UserModel = get_user_model()
         try:
-            lecturer = Lecturer.objects.get(user__username=username, staff_id=staff_id)
-        except Lecturer.DoesNotExist:
+            user = UserModel._default_manager.select_related('student', 'lecturer').get(pk=user_id)
+        except UserModel.DoesNotExist:
             return None
-
-        if lecturer.user.check_password(password):
-            return lecturer.user
-        return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,223 @@
+"""
+Check-in writes, direct or write-behind.
+
+With ATTENDANCE_WRITE_BEHIND off a check-in is applied to its session at
+once. With it on, take_attendance only appends a CheckIn row and answers;
+the flush_checkins worker merges the log into present_students in batches,
+so a lecture-start burst does not serialise on the session and course rows.
+Reads of attendance data call ensure_flushed() first, which applies what is
+still in the log, so they always see every acknowledged check-in.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .conditional import COURSE_NAMESPACE, invalidate, invalidate_course_lecturers
+from .counters import (
+    enrolled_count_expression,
+    present_count_expression,
+    refresh_enrolled_counts,
+    refresh_present_counts,
+)
+from .models import Attendance, CheckIn, Course
+from .sync import PresentStudent, mark_present
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def write_behind_enabled():
+    return getattr(settings, 'ATTENDANCE_WRITE_BEHIND', False)
+
+
+def check_in(course_id, student_pk, distance=None, device_id=None):
+    """Record that a validated student is present in the open session of a course"""
+    if write_behind_enabled():
+        CheckIn.objects.create(
+            course_id=course_id,
+            student_id=student_pk,
+            date=timezone.now().date(),
+            distance=distance,
+            device_id=device_id,
+        )
+        return
+
+    # One short transaction: the session read (or upsert), the link insert
+    # and the counter refresh.
+    with transaction.atomic():
+        attendance_id = open_session_ids([course_id])[course_id]
+        add_present(attendance_id, course_id, student_pk)
+
+
+async def acheck_in(course_id, student_pk, distance=None, device_id=None):
+    """check_in() for async views"""
+    if write_behind_enabled():
+        await CheckIn.objects.acreate(
+            course_id=course_id,
+            student_id=student_pk,
+            date=timezone.now().date(),
+            distance=distance,
+            device_id=device_id,
+        )
+        return
+
+    # The async ORM cannot run transactions.
+    await sync_to_async(check_in)(course_id, student_pk, distance=distance, device_id=device_id)
+
+
+def add_present(attendance_id, course_id, student_pk):
+    """Link a student to a session with INSERT ... ON CONFLICT DO NOTHING and refresh its count"""
+    PresentStudent.objects.bulk_create(
+        [PresentStudent(attendance_id=attendance_id, student_id=student_pk)],
+        ignore_conflicts=True,
+    )
+    # bulk_create sends no m2m_changed, see signals.present_students_changed.
+    refresh_present_counts([attendance_id])
+    invalidate(COURSE_NAMESPACE, [course_id])
+
+
+def _upsert_sql():
+    opts = Attendance._meta
+    quote = connection.ops.quote_name
+    column = {name: quote(opts.get_field(name).column) for name in (
+        'id', 'course', 'date', 'is_active', 'present_count', 'enrolled_count', 'created_at', 'updated_at',
+    )}
+    # The conflict target repeats attendance_open_session_unique, condition included.
+    return (
+        f"INSERT INTO {quote(opts.db_table)} "
+        f"({column['course']}, {column['date']}, {column['is_active']}, {column['present_count']}, "
+        f"{column['enrolled_count']}, {column['created_at']}, {column['updated_at']}) "
+        f"VALUES (%s, %s, %s, 0, 0, %s, %s) "
+        f"ON CONFLICT ({column['course']}) WHERE {column['is_active']} "
+        f"DO UPDATE SET {column['course']} = EXCLUDED.{column['course']} "
+        f"RETURNING {column['id']}"
+    )
+
+
+def _upsert_open_session(course_id, day, now):
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        # No ON CONFLICT with a partial target: insert, or read the winner.
+        try:
+            with transaction.atomic():
+                return Attendance.objects.create(course_id=course_id, date=day).pk
+        except IntegrityError:
+            return Attendance.objects.get(course_id=course_id, is_active=True).pk
+
+    def prep(name, value):
+        return Attendance._meta.get_field(name).get_db_prep_value(value, connection)
+
+    with connection.cursor() as cursor:
+        cursor.execute(_upsert_sql(), [
+            course_id, prep('date', day), prep('is_active', True), prep('created_at', now), prep('updated_at', now),
+        ])
+        return cursor.fetchone()[0]
+
+
+def _open_sessions(course_ids):
+    return {
+        course_id: (attendance_id, day)
+        for course_id, attendance_id, day in Attendance.objects.filter(
+            course_id__in=course_ids, is_active=True,
+        ).values_list('course_id', 'id', 'date')
+    }
+
+
+def _end_stale_sessions(attendance_ids, now):
+    # What end_attendance does, counters frozen in the same UPDATE. The
+    # is_active filter makes it a no-op for sessions another writer ended.
+    Attendance.objects.filter(pk__in=attendance_ids, is_active=True).update(
+        is_active=False,
+        ended_at=now,
+        updated_at=now,
+        present_count=present_count_expression(),
+        enrolled_count=enrolled_count_expression(),
+    )
+
+
+def open_session_ids(course_ids, day=None):
+    """
+    Map course ids to the ids of their open sessions, opening one dated `day`
+    (today by default) for courses without. A session left open from before
+    `day` is ended first, so a lecturer who forgot end_attendance does not
+    get later days' check-ins in it. Open sessions cost one read of the
+    partial unique index and take no locks. A missing one is opened with a
+    single INSERT ... ON CONFLICT (course_id) WHERE is_active DO UPDATE ...
+    RETURNING, so writers racing to open a course's session all get the row
+    that won.
+    """
+    now = timezone.now()
+    day = day or now.date()
+    course_ids = set(course_ids)
+    sessions = {}
+    stale = []
+    for course_id, (attendance_id, opened_on) in _open_sessions(course_ids).items():
+        if opened_on < day:
+            stale.append(attendance_id)
+        else:
+            sessions[course_id] = attendance_id
+    if stale:
+        _end_stale_sessions(stale, now)
+    missing = course_ids - sessions.keys()
+    if missing:
+        for course_id in missing:
+            sessions[course_id] = _upsert_open_session(course_id, day, now)
+        _sessions_opened([sessions[course_id] for course_id in missing], missing)
+    return sessions
+
+
+def _sessions_opened(attendance_ids, course_ids):
+    # What Attendance.save() and its post_save signal do for a new session.
+    # Every step is idempotent, so sessions another writer opened are harmless.
+    refresh_enrolled_counts(attendance_ids=attendance_ids)
+    if Course.objects.filter(pk__in=course_ids, is_active=False).update(is_active=True):
+        # No post_save either; the lecturers' course lists show is_active.
+        invalidate_course_lecturers(course_ids)
+    invalidate(COURSE_NAMESPACE, course_ids)
+
+
+def _unflushed(course_id=None):
+    pending = CheckIn.objects.filter(flushed_at__isnull=True)
+    if course_id is not None:
+        pending = pending.filter(course_id=course_id)
+    return pending
+
+
+def flush_checkins(batch_size=DEFAULT_BATCH_SIZE, course_id=None, up_to=None, wait=False):
+    """
+    Merge up to batch_size logged check-ins into their sessions and return
+    how many were flushed. Rows another flusher holds are skipped unless
+    wait is set, in which case their commit is waited for.
+    """
+    with transaction.atomic():
+        pending = _unflushed(course_id)
+        if up_to is not None:
+            pending = pending.filter(id__lte=up_to)
+        rows = list(
+            pending.select_for_update(skip_locked=not wait)
+            .order_by('id')
+            .values_list('id', 'course_id', 'date', 'student_id')[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        # Oldest day first, so a session still open from a logged day takes
+        # that day's check-ins before a later day's ends it.
+        links = []
+        for day in sorted({row_date for _, _, row_date, _ in rows}):
+            day_rows = [row for row in rows if row[2] == day]
+            sessions = open_session_ids({row_course for _, row_course, _, _ in day_rows}, day)
+            links.extend((sessions[row_course], student_pk) for _, row_course, _, student_pk in day_rows)
+        mark_present(links)
+        CheckIn.objects.filter(pk__in=[pk for pk, _, _, _ in rows]).update(flushed_at=timezone.now())
+    return len(rows)
+
+
+def ensure_flushed(course_id=None):
+    """Apply the check-ins (of one course, or all) acknowledged so far before attendance is read"""
+    if not write_behind_enabled():
+        return
+    last = _unflushed(course_id).order_by('-id').values_list('id', flat=True).first()
+    if last is None:
+        return
+    while flush_checkins(course_id=course_id, up_to=last, wait=True):
+        pass
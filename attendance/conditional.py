@@ -0,0 +1,125 @@
+"""
+Conditional GET from entity version counters.
+
+Every user, student, lecturer and course has a version counter in the shared
+cache (see versioning.py) that signals.py bumps whenever something visible
+through that entity's endpoints is written: the user or their profile, a
+student's enrollments, a lecturer's courses, a course's sessions, roster,
+check-ins and tokens. A response's ETag is a digest of the versions it was
+built from, so a poll with a current If-None-Match is answered with 304 from
+the cache alone, before the view queries anything or serializes.
+"""
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Attendance, Course, CourseEnrollment
+from .versioning import bump_version, get_version, version_tag
+
+USER_NAMESPACE = 'user'
+STUDENT_NAMESPACE = 'student'
+LECTURER_NAMESPACE = 'lecturer'
+COURSE_NAMESPACE = 'course'
+# Derived lists and payloads are keyed by version, so this only bounds how
+# long unused ones linger.
+VERSIONED_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def invalidate(namespace, pks):
+    for pk in set(pks):
+        bump_version(namespace, pk)
+        # Bump again once the change is visible to other connections, so data
+        # rebuilt from pre-commit rows in the meantime is not reused.
+        transaction.on_commit(lambda pk=pk: bump_version(namespace, pk))
+
+
+def invalidate_course_lecturers(course_ids):
+    """Bump the lecturers of courses changed in bulk, e.g. activated by a new session"""
+    course_ids = set(course_ids)
+    if course_ids:
+        invalidate(
+            LECTURER_NAMESPACE,
+            Course.objects.filter(pk__in=course_ids).values_list('lecturer_id', flat=True),
+        )
+
+
+def invalidate_sessions(attendance_ids):
+    """Bump the courses of sessions changed in bulk, e.g. by mark_present()"""
+    attendance_ids = set(attendance_ids)
+    if attendance_ids:
+        invalidate(
+            COURSE_NAMESPACE,
+            Attendance.objects.filter(pk__in=attendance_ids).values_list('course_id', flat=True),
+        )
+
+
+def _cached_ids(key, build):
+    ids = cache.get(key)
+    if ids is None:
+        ids = sorted(build())
+        cache.set(key, ids, timeout=VERSIONED_CACHE_TIMEOUT)
+    return ids
+
+
+def student_course_ids(student_id):
+    """Ids of the courses a student is enrolled in or attended, cached per student version"""
+    def build():
+        enrolled = CourseEnrollment.objects.filter(student_id=student_id).values_list('course_id')
+        attended = (
+            Attendance.present_students.through.objects
+            .filter(student_id=student_id)
+            .values_list('attendance__course_id')
+        )
+        return {course_id for course_id, in enrolled.union(attended)}
+
+    version = get_version(STUDENT_NAMESPACE, student_id)
+    return _cached_ids(f"student-courses:{student_id}:{version}", build)
+
+
+def lecturer_course_ids(lecturer_id):
+    """Ids of a lecturer's courses, cached per lecturer version"""
+    def build():
+        return Course.objects.filter(lecturer_id=lecturer_id).values_list('pk', flat=True)
+
+    version = get_version(LECTURER_NAMESPACE, lecturer_id)
+    return _cached_ids(f"lecturer-courses:{lecturer_id}:{version}", build)
+
+
+def course_pairs(course_ids):
+    return [(COURSE_NAMESPACE, course_id) for course_id in course_ids]
+
+
+def etag_for(pairs, *parts):
+    """Quoted ETag over the current versions of (namespace, pk) pairs and extra parts"""
+    return f'"{version_tag(pairs, *parts)}"'
+
+
+def etag_matches(request, etag):
+    return etag in request.headers.get('If-None-Match', '').replace(' ', '').split(',')
+
+
+def conditional_get(versions):
+    """
+    Decorate a GET handler of an API view. versions(view, request) returns the
+    (namespace, pk) pairs the response is built from, or None to skip the
+    check. The ETag also covers the user, the full path (query parameters
+    such as ?expand=) and the renderer, and is only set on 200 responses.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            pairs = versions(view, request)
+            if pairs is None:
+                return handler(view, request, *args, **kwargs)
+            etag = etag_for(pairs, request.user.pk, request.get_full_path(), request.accepted_renderer.format)
+            if etag_matches(request, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            response = handler(view, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,72 @@
+"""
+Maintenance of the denormalised Attendance.present_count and
+Attendance.enrolled_count columns.
+
+Counts are always recomputed from the link tables with a single UPDATE ...
+SET col = (SELECT COUNT(*) ...) statement, so they stay exact however many
+writers touch a session concurrently and run inside the caller's transaction.
+"""
+from django.db.models import Case, Count, FloatField, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+from django.utils import timezone
+
+from .models import Attendance, CourseEnrollment
+
+PresentStudent = Attendance.present_students.through
+
+
+def _count(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset.order_by().values(field).annotate(total=Count('pk')).values('total')[:1],
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def present_count_expression():
+    return _count(PresentStudent.objects.filter(attendance_id=OuterRef('pk')), 'attendance_id')
+
+
+def enrolled_count_expression():
+    return _count(CourseEnrollment.objects.filter(course_id=OuterRef('course_id')), 'course_id')
+
+
+def rate_expression(present, total):
+    """Percentage of present over total rounded to 2 places, 0 when total is 0, like Attendance.attendance_rate"""
+    return Round(
+        Case(
+            When(**{total: 0}, then=Value(0.0)),
+            default=Cast(present, FloatField()) * 100 / Cast(total, FloatField()),
+            output_field=FloatField(),
+        ),
+        2,
+    )
+
+
+def refresh_present_counts(attendance_ids):
+    attendance_ids = set(attendance_ids)
+    if attendance_ids:
+        # updated_at marks the session as changed for incremental history reads.
+        Attendance.objects.filter(pk__in=attendance_ids).update(
+            present_count=present_count_expression(), updated_at=timezone.now(),
+        )
+
+
+def refresh_enrolled_counts(course_id=None, attendance_ids=None):
+    """Update enrolled_count of active sessions (a course's, or the given ones)"""
+    sessions = Attendance.objects.filter(is_active=True)
+    if course_id is not None:
+        sessions = sessions.filter(course_id=course_id)
+    if attendance_ids is not None:
+        sessions = sessions.filter(pk__in=attendance_ids)
+    sessions.update(enrolled_count=enrolled_count_expression())
+
+
+def snapshot_counts(attendance):
+    """Freeze both counters on a session that is being closed"""
+    Attendance.objects.filter(pk=attendance.pk).update(
+        present_count=present_count_expression(),
+        enrolled_count=enrolled_count_expression(),
+    )
@@ -0,0 +1,130 @@
+"""
+Lecturer dashboard.
+
+Per course and session the dashboard shows the present and enrolled counts
+kept by attendance.counters, the rate, start and end time and the state of
+the course's attendance token. Sessions are read in one query over the
+requested date range and course totals in one GROUP BY query, so the cost
+follows the range, not the lecturer's whole history.
+
+The result is cached under the lecturer's version (courses added, moved or
+removed) and the versions of their courses, which sessions, check-ins and
+tokens bump (see conditional.py).
+"""
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .conditional import LECTURER_NAMESPACE, VERSIONED_CACHE_TIMEOUT, course_pairs, etag_for, lecturer_course_ids
+from .counters import rate_expression
+from .metrics import record_cache
+from .models import Attendance, AttendanceToken, Course
+
+DEFAULT_RANGE_DAYS = 30
+MAX_RANGE_DAYS = 366
+
+TOKEN_ACTIVE = 'active'
+TOKEN_EXPIRED = 'expired'
+TOKEN_INACTIVE = 'inactive'
+
+
+def dashboard_range(date_from=None, date_to=None):
+    """Fill in the default range and check its length; raises ValueError for invalid ranges"""
+    date_to = date_to or timezone.localdate()
+    date_from = date_from or date_to - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    if date_from > date_to:
+        raise ValueError('from must not be after to.')
+    if (date_to - date_from).days >= MAX_RANGE_DAYS:
+        raise ValueError(f'The date range is limited to {MAX_RANGE_DAYS} days.')
+    return date_from, date_to
+
+
+def dashboard_etag(lecturer_id, date_from, date_to, course_id=None):
+    course_ids = lecturer_course_ids(lecturer_id)
+    if course_id is not None:
+        course_ids = [pk for pk in course_ids if pk == course_id]
+    pairs = [(LECTURER_NAMESPACE, lecturer_id)] + course_pairs(course_ids)
+    return etag_for(pairs, lecturer_id, date_from.isoformat(), date_to.isoformat(), course_id)
+
+
+def _latest_token(field):
+    return Subquery(
+        AttendanceToken.objects.filter(course_id=OuterRef('pk')).order_by('-generated_at', '-pk').values(field)[:1]
+    )
+
+
+def build_dashboard(lecturer_id, date_from, date_to, course_id=None):
+    in_range = Q(attendance__date__gte=date_from, attendance__date__lte=date_to)
+    courses = Course.objects.filter(lecturer_id=lecturer_id)
+    sessions = Attendance.objects.filter(course__lecturer_id=lecturer_id, date__gte=date_from, date__lte=date_to)
+    if course_id is not None:
+        courses = courses.filter(pk=course_id)
+        sessions = sessions.filter(course_id=course_id)
+
+    totals = (
+        courses
+        .annotate(
+            session_count=Count('attendance', filter=in_range),
+            present_total=Coalesce(Sum('attendance__present_count', filter=in_range), 0),
+            enrolled_total=Coalesce(Sum('attendance__enrolled_count', filter=in_range), 0),
+            token=_latest_token('token'),
+            token_expires_at=_latest_token('expires_at'),
+            token_is_active=_latest_token('is_active'),
+        )
+        .annotate(attendance_rate=rate_expression('present_total', 'enrolled_total'))
+        .order_by('course_code')
+        .values(
+            'id', 'course_code', 'name', 'session_count', 'present_total', 'enrolled_total', 'attendance_rate',
+            'token', 'token_expires_at', 'token_is_active',
+        )
+    )
+    result = {row['id']: dict(row, sessions=[]) for row in totals}
+
+    rows = (
+        sessions
+        .annotate(attendance_rate=rate_expression('present_count', 'enrolled_count'), started_at=F('created_at'))
+        .order_by('-date', '-id')
+        .values(
+            'id', 'course_id', 'date', 'is_active', 'started_at', 'ended_at',
+            'present_count', 'enrolled_count', 'attendance_rate',
+        )
+    )
+    for row in rows:
+        result[row.pop('course_id')]['sessions'].append(row)
+    return list(result.values())
+
+
+def _token_status(course, now):
+    if course['token'] is None:
+        return None
+    if not course['token_is_active']:
+        status = TOKEN_INACTIVE
+    elif course['token_expires_at'] is not None and course['token_expires_at'] <= now:
+        status = TOKEN_EXPIRED
+    else:
+        status = TOKEN_ACTIVE
+    return {'token': course['token'], 'expires_at': course['token_expires_at'], 'status': status}
+
+
+def lecturer_dashboard(lecturer_id, date_from, date_to, course_id=None):
+    """Return (courses, etag), from the cache when nothing changed"""
+    etag = dashboard_etag(lecturer_id, date_from, date_to, course_id)
+    key = f"dashboard:{lecturer_id}:{etag[1:-1]}"
+    courses = cache.get(key)
+    record_cache('lecturer-dashboard', courses is not None)
+    if courses is None:
+        courses = build_dashboard(lecturer_id, date_from, date_to, course_id)
+        cache.set(key, courses, timeout=VERSIONED_CACHE_TIMEOUT)
+
+    # Tokens expire without a write, so their status is worked out per response.
+    now = timezone.now()
+    return [
+        {
+            **{name: value for name, value in course.items() if not name.startswith('token')},
+            'token': _token_status(course, now),
+        }
+        for course in courses
+    ], etag
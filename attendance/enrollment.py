@@ -0,0 +1,98 @@
+"""
+Per-course enrollment membership index.
+
+The set of enrolled student ids is built once per enrollment version and kept
+both in the shared cache and in a small per-process table, so a check-in only
+reads the course's version counter and does a set lookup.
+"""
+from collections import OrderedDict
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .metrics import record_cache
+from .versioning import aget_version, bump_version, get_version
+
+ENROLLMENT_NAMESPACE = 'course-enrollment'
+ENROLLMENT_CACHE_TIMEOUT = 60 * 60 * 24
+LOCAL_INDEX_SIZE = 256
+
+_local_index = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def _cache_key(course_id, version):
+    return f"enrollment:{course_id}:{version}"
+
+
+def _remember(course_id, version, student_ids):
+    with _local_lock:
+        _local_index[course_id] = (version, student_ids)
+        _local_index.move_to_end(course_id)
+        while len(_local_index) > LOCAL_INDEX_SIZE:
+            _local_index.popitem(last=False)
+
+
+def _local(course_id, version):
+    local = _local_index.get(course_id)
+    if local is not None and local[0] == version:
+        record_cache(ENROLLMENT_NAMESPACE, True)
+        return local[1]
+    return None
+
+
+def _enrolled_ids(course_id):
+    from .models import CourseEnrollment
+    return CourseEnrollment.objects.filter(course_id=course_id).values_list('student_id', flat=True)
+
+
+def course_student_ids(course_id):
+    """Return a frozenset with the ids of every student enrolled in the course"""
+    version = get_version(ENROLLMENT_NAMESPACE, course_id)
+    student_ids = _local(course_id, version)
+    if student_ids is not None:
+        return student_ids
+
+    key = _cache_key(course_id, version)
+    student_ids = cache.get(key)
+    record_cache(ENROLLMENT_NAMESPACE, student_ids is not None)
+    if student_ids is None:
+        student_ids = frozenset(_enrolled_ids(course_id))
+        cache.set(key, student_ids, timeout=ENROLLMENT_CACHE_TIMEOUT)
+
+    _remember(course_id, version, student_ids)
+    return student_ids
+
+
+async def acourse_student_ids(course_id):
+    """course_student_ids() for async views"""
+    version = await aget_version(ENROLLMENT_NAMESPACE, course_id)
+    student_ids = _local(course_id, version)
+    if student_ids is not None:
+        return student_ids
+
+    key = _cache_key(course_id, version)
+    student_ids = await cache.aget(key)
+    record_cache(ENROLLMENT_NAMESPACE, student_ids is not None)
+    if student_ids is None:
+        student_ids = frozenset([student_id async for student_id in _enrolled_ids(course_id)])
+        await cache.aset(key, student_ids, timeout=ENROLLMENT_CACHE_TIMEOUT)
+
+    _remember(course_id, version, student_ids)
+    return student_ids
+
+
+def is_enrolled(course_id, student_id):
+    return student_id in course_student_ids(course_id)
+
+
+async def ais_enrolled(course_id, student_id):
+    return student_id in await acourse_student_ids(course_id)
+
+
+def invalidate_enrollment(course_id):
+    bump_version(ENROLLMENT_NAMESPACE, course_id)
+    # Bump again once the change is visible to other connections, so an index
+    # rebuilt from pre-commit rows in the meantime is not reused.
+    transaction.on_commit(lambda: bump_version(ENROLLMENT_NAMESPACE, course_id))
@@ -0,0 +1,165 @@
+"""
+Sparse fieldsets and opt-in expansion for the API serializers.
+
+    ?fields=id,name,lecturer.name   only render these fields
+    ?expand=lecturer,students.user  render these relations as nested objects
+
+Relations render as primary keys unless expanded. The select_related /
+prefetch_related / only() plan of a queryset is derived from the serializer
+that will render it, so the number of queries depends on the requested
+shape and never on the number of rows.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_field_tree(value):
+    """Turn 'a,b.c,b.d' into {'a': {}, 'b': {'c': {}, 'd': {}}}"""
+    tree = {}
+    for path in (value or '').split(','):
+        node = tree
+        for part in path.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def requested_shape(request):
+    """Serializer kwargs for the ?fields= and ?expand= query parameters of a request"""
+    if request is None:
+        return {}
+    params = request.query_params
+    return {
+        'fields': parse_field_tree(params['fields']) if params.get('fields') else None,
+        'expand': parse_field_tree(params.get('expand')),
+    }
+
+
+class ExpandableFieldsMixin:
+    """
+    Serializer mixin. Meta.expandable_fields maps a field name to the dotted
+    path of the serializer used when that field is expanded and whether it
+    is a to-many relation.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = dict(expand or {})
+        if fields is not None:
+            # A nested path in ?fields= implies expanding that relation.
+            for name, subfields in fields.items():
+                if subfields:
+                    expand.setdefault(name, {})
+
+        for name, (serializer_path, many) in getattr(self.Meta, 'expandable_fields', {}).items():
+            if name not in expand or name not in self.fields:
+                continue
+            if fields is not None and name not in fields:
+                continue
+            serializer_class = import_string(serializer_path)
+            self.fields[name] = serializer_class(
+                many=many,
+                read_only=True,
+                fields=(fields or {}).get(name) or None,
+                expand=expand[name],
+            )
+
+        if fields is not None:
+            for name in list(self.fields):
+                if name not in fields:
+                    self.fields.pop(name)
+
+
+def _nested_serializer(field):
+    if isinstance(field, serializers.ListSerializer):
+        return field.child
+    if isinstance(field, serializers.BaseSerializer):
+        return field
+    return None
+
+
+def _plan(serializer, model, prefix=''):
+    """Return (only, select_related, prefetch_related) lists for a serializer over a model"""
+    only = [prefix + model._meta.pk.name]
+    select = []
+    prefetch = []
+
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        attr = field.field_name if field.source == '*' else field.source_attrs[0]
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            continue
+        if field.source == '*' and model_field.is_relation:
+            continue
+
+        nested = _nested_serializer(field)
+        path = prefix + attr
+        if model_field.many_to_many or model_field.one_to_many:
+            related_model = model_field.related_model
+            if nested is not None:
+                queryset = plan_queryset(related_model._default_manager.all(), nested)
+            else:
+                columns = ['pk']
+                if model_field.one_to_many:
+                    # Prefetching a reverse foreign key reads the key on each row.
+                    columns.append(model_field.field.attname)
+                queryset = related_model._default_manager.only(*columns)
+            prefetch.append(Prefetch(path, queryset=queryset))
+        elif model_field.is_relation and nested is not None:
+            nested_only, nested_select, nested_prefetch = _plan(nested, model_field.related_model, path + '__')
+            only.append(path)
+            only.extend(nested_only)
+            select.append(path)
+            select.extend(nested_select)
+            prefetch.extend(nested_prefetch)
+        else:
+            only.append(path)
+
+    return only, select, prefetch
+
+
+def plan_queryset(queryset, serializer, extra_fields=()):
+    """
+    Apply the query plan needed to render queryset with serializer. Columns
+    in extra_fields are loaded too, e.g. the ones a paginator orders on.
+    """
+    serializer = _nested_serializer(serializer) or serializer
+    only, select, prefetch = _plan(serializer, queryset.model)
+    only.extend(extra_fields)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset.only(*only)
+
+
+class ExpandableViewSetMixin:
+    """
+    View mixin that passes ?fields= / ?expand= to the serializer and plans
+    list/retrieve querysets for the requested shape.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        for key, value in requested_shape(self.request).items():
+            kwargs.setdefault(key, value)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request is not None and self.request.method in SAFE_METHODS:
+            ordering = [name.lstrip('-') for name in getattr(self, 'ordering', None) or ()]
+            queryset = plan_queryset(queryset, self.get_serializer(), ordering)
+        return queryset
+
+    def expanded(self, serializer_class, queryset, many=True):
+        """Serializer for a custom action's queryset, with the request's shape and a query plan"""
+        shape = requested_shape(self.request)
+        context = self.get_serializer_context()
+        probe = serializer_class(context=context, **shape)
+        return serializer_class(plan_queryset(queryset, probe), many=many, context=context, **shape)
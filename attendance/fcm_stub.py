@@ -0,0 +1,88 @@
+"""
+A local stand-in for the FCM multicast endpoint, for tests and benchmarks.
+
+Tokens starting with 'invalid' are answered with NotRegistered, tokens
+starting with 'flaky' with Unavailable the first time they are seen, and the
+first `fail_requests` requests get a 503. Everything else is delivered.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+INVALID_PREFIX = 'invalid'
+FLAKY_PREFIX = 'flaky'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        stub = self.server.stub
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        if stub.latency:
+            time.sleep(stub.latency)
+        with stub.lock:
+            stub.requests += 1
+            fail = stub.requests <= stub.fail_requests
+        if fail:
+            self._reply(503, {}, {'Retry-After': '0'})
+            return
+        if self.headers.get('Authorization') != f'key={stub.server_key}':
+            self._reply(401, {})
+            return
+
+        results = []
+        for token in payload.get('registration_ids', ()):
+            with stub.lock:
+                first_time = token not in stub.seen
+                stub.seen.add(token)
+                if token.startswith(INVALID_PREFIX):
+                    results.append({'error': 'NotRegistered'})
+                elif token.startswith(FLAKY_PREFIX) and first_time:
+                    results.append({'error': 'Unavailable'})
+                else:
+                    stub.delivered.append(token)
+                    results.append({'message_id': f'0:{len(stub.delivered)}'})
+        failure = sum(1 for result in results if 'error' in result)
+        self._reply(200, {'success': len(results) - failure, 'failure': failure, 'results': results})
+
+    def _reply(self, code, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubFCMServer:
+    """Run with `with StubFCMServer() as stub:` and send to stub.url with stub.server_key"""
+
+    def __init__(self, server_key='stub-key', fail_requests=0, latency=0.0):
+        self.server_key = server_key
+        self.fail_requests = fail_requests
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.seen = set()
+        self.delivered = []
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f'http://{host}:{port}/fcm/send'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,217 @@
+"""
+Geofence validation.
+
+Geofence radii are tens to hundreds of metres, where a local ellipsoidal
+(equirectangular) approximation agrees with the WGS84 geodesic to well under a
+millimetre. The fast engine skips far points with a bounding box, measures
+the rest with that approximation, and only runs geopy's geodesic for points
+whose distance lands right on the radius. The engine is selected with the GEOFENCE_ENGINE setting.
+"""
+import math
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils.module_loading import import_string
+from geopy.distance import geodesic
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is in requirements.txt
+    np = None
+
+DEFAULT_GEOFENCE_ENGINE = 'attendance.geofence.FastGeofenceEngine'
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_E2 = 6.69437999014e-3
+MEAN_EARTH_RADIUS = 6371008.8
+# Shortest length of one degree of latitude (at the equator), so the box never
+# rejects a point that is really inside the radius.
+MIN_METERS_PER_DEGREE = 110574.0
+
+# Beyond this many metres past the radius the local approximation starts to
+# drift; such points are far outside any geofence and haversine is plenty to
+# report how far away they are.
+FAR_DISTANCE = 2000.0
+
+# Points whose approximate distance is within this band of the radius are
+# re-checked with the geodesic so decisions match it exactly.
+EDGE_RELATIVE_TOLERANCE = 1e-4
+EDGE_ABSOLUTE_TOLERANCE = 0.05
+
+
+def _local_distance(lat1, lon1, lat2, lon2):
+    """Distance in metres using the ellipsoid's radii of curvature at the mean latitude"""
+    phi = math.radians((lat1 + lat2) / 2)
+    sin_phi = math.sin(phi)
+    w = math.sqrt(1 - WGS84_E2 * sin_phi * sin_phi)
+    meridional = WGS84_A * (1 - WGS84_E2) / (w * w * w)
+    normal = WGS84_A / w
+    dy = math.radians(lat2 - lat1) * meridional
+    dlon = (lon2 - lon1 + 180) % 360 - 180
+    dx = math.radians(dlon) * normal * math.cos(phi)
+    return math.hypot(dx, dy)
+
+
+def _haversine_distance(lat1, lon1, lat2, lon2):
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * MEAN_EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _check_coordinates(*values):
+    # geopy rejected these while building its Points; keep the same errors.
+    for latitude, longitude in zip(values[::2], values[1::2]):
+        if not -90 <= latitude <= 90:
+            raise ValueError(f"Latitude must be in the [-90; 90] range, got {latitude}")
+        if not math.isfinite(longitude):
+            raise ValueError(f"Longitude must be finite, got {longitude}")
+
+
+def _edge_band(radius):
+    return radius * EDGE_RELATIVE_TOLERANCE + EDGE_ABSOLUTE_TOLERANCE
+
+
+class GeodesicGeofenceEngine:
+    """Karney's geodesic for every point (the original behaviour)"""
+
+    def distance(self, center_latitude, center_longitude, latitude, longitude, radius):
+        return geodesic((center_latitude, center_longitude), (latitude, longitude)).meters
+
+    def validate(self, center_latitude, center_longitude, radius, latitude, longitude):
+        distance = self.distance(center_latitude, center_longitude, latitude, longitude, radius)
+        return (distance <= radius, round(distance, 2))
+
+    def validate_batch(self, center_latitudes, center_longitudes, radii, latitudes, longitudes):
+        results = [
+            self.validate(*row)
+            for row in zip(center_latitudes, center_longitudes, radii, latitudes, longitudes)
+        ]
+        return [valid for valid, _ in results], [distance for _, distance in results]
+
+
+class FastGeofenceEngine(GeodesicGeofenceEngine):
+    """Bounding box, then local approximation, then geodesic near the radius"""
+
+    def _outside_box(self, center_latitude, center_longitude, latitude, longitude, limit):
+        if abs(latitude - center_latitude) * MIN_METERS_PER_DEGREE > limit:
+            return True
+        cos_lat = math.cos(math.radians(max(abs(center_latitude), abs(latitude))))
+        dlon = abs((longitude - center_longitude + 180) % 360 - 180)
+        return dlon * MIN_METERS_PER_DEGREE * cos_lat > limit
+
+    def distance(self, center_latitude, center_longitude, latitude, longitude, radius):
+        limit = radius + _edge_band(radius) + FAR_DISTANCE
+        if self._outside_box(center_latitude, center_longitude, latitude, longitude, limit):
+            return _haversine_distance(center_latitude, center_longitude, latitude, longitude)
+
+        distance = _local_distance(center_latitude, center_longitude, latitude, longitude)
+        if abs(distance - radius) <= _edge_band(radius):
+            distance = geodesic((center_latitude, center_longitude), (latitude, longitude)).meters
+        return distance
+
+    def validate_batch(self, center_latitudes, center_longitudes, radii, latitudes, longitudes):
+        if np is None:
+            return super().validate_batch(center_latitudes, center_longitudes, radii, latitudes, longitudes)
+
+        lat1 = np.asarray(center_latitudes, dtype=float)
+        lon1 = np.asarray(center_longitudes, dtype=float)
+        radius = np.asarray(radii, dtype=float)
+        lat2 = np.asarray(latitudes, dtype=float)
+        lon2 = np.asarray(longitudes, dtype=float)
+
+        band = radius * EDGE_RELATIVE_TOLERANCE + EDGE_ABSOLUTE_TOLERANCE
+        limit = radius + band + FAR_DISTANCE
+        dlon = (lon2 - lon1 + 180) % 360 - 180
+        cos_lat = np.cos(np.radians(np.maximum(np.abs(lat1), np.abs(lat2))))
+        outside = ((np.abs(lat2 - lat1) * MIN_METERS_PER_DEGREE > limit)
+                   | (np.abs(dlon) * MIN_METERS_PER_DEGREE * cos_lat > limit))
+
+        phi = np.radians((lat1 + lat2) / 2)
+        sin_phi = np.sin(phi)
+        w = np.sqrt(1 - WGS84_E2 * sin_phi * sin_phi)
+        dy = np.radians(lat2 - lat1) * (WGS84_A * (1 - WGS84_E2) / (w ** 3))
+        dx = np.radians(dlon) * (WGS84_A / w) * np.cos(phi)
+        distance = np.hypot(dx, dy)
+
+        if outside.any():
+            p1, p2 = np.radians(lat1[outside]), np.radians(lat2[outside])
+            a = (np.sin((p2 - p1) / 2) ** 2
+                 + np.cos(p1) * np.cos(p2) * np.sin(np.radians(lon2[outside] - lon1[outside]) / 2) ** 2)
+            distance[outside] = 2 * MEAN_EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+        for i in np.flatnonzero(~outside & (np.abs(distance - radius) <= band)):
+            distance[i] = geodesic((lat1[i], lon1[i]), (lat2[i], lon2[i])).meters
+
+        return (distance <= radius).tolist(), np.round(distance, 2).tolist()
+
+
+_engine = None
+_engine_path = None
+
+
+def get_engine():
+    global _engine, _engine_path
+    path = getattr(settings, 'GEOFENCE_ENGINE', DEFAULT_GEOFENCE_ENGINE)
+    if _engine is None or path != _engine_path:
+        _engine = import_string(path)()
+        _engine_path = path
+    return _engine
+
+
+def validate_geofence(center_latitude, center_longitude, radius_meters, student_latitude, student_longitude):
+    """
+    Validate a point against a geofence centre and radius
+    Returns (is_valid, distance_meters) tuple
+    """
+    if center_latitude is None or center_longitude is None:
+        return (True, 0.0)  # No geofence, allow all
+
+    if student_latitude is None or student_longitude is None:
+        return (False, -1.0)  # Student location not provided
+
+    try:
+        center_latitude, center_longitude = float(center_latitude), float(center_longitude)
+        student_latitude, student_longitude = float(student_latitude), float(student_longitude)
+        _check_coordinates(center_latitude, center_longitude, student_latitude, student_longitude)
+        return get_engine().validate(
+            center_latitude,
+            center_longitude,
+            float(radius_meters),
+            student_latitude,
+            student_longitude,
+        )
+    except Exception as e:
+        raise ValidationError(f"Location validation error: {str(e)}")
+
+
+def validate_geofence_batch(rows):
+    """
+    Validate many (center_latitude, center_longitude, radius_meters,
+    student_latitude, student_longitude) rows in one vectorised call.
+    Returns a list of (is_valid, distance_meters) tuples in input order.
+    """
+    results = [None] * len(rows)
+    pending = []
+    for i, (center_latitude, center_longitude, radius, latitude, longitude) in enumerate(rows):
+        if center_latitude is None or center_longitude is None:
+            results[i] = (True, 0.0)
+        elif latitude is None or longitude is None:
+            results[i] = (False, -1.0)
+        else:
+            pending.append(i)
+
+    if pending:
+        try:
+            columns = [[float(rows[i][column]) for i in pending] for column in range(5)]
+            for i in range(len(pending)):
+                _check_coordinates(columns[0][i], columns[1][i], columns[3][i], columns[4][i])
+            valid, distances = get_engine().validate_batch(*columns)
+        except Exception as e:
+            raise ValidationError(f"Location validation error: {str(e)}")
+        for i, is_valid, distance in zip(pending, valid, distances):
+            results[i] = (bool(is_valid), float(distance))
+    return results
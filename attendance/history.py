@@ -0,0 +1,113 @@
+"""
+Student attendance history.
+
+The history of a student is every session they were present at plus, as
+absences, every ended session of their enrolled courses since they enrolled.
+Both the entries and the per-course rates come from SQL over one annotated
+queryset, and the result is cached under the student's version and those of
+their courses (see conditional.py), which also make up the ETag.
+
+Check-ins bump the course version once per write (or flushed batch) rather
+than the version of every student present, so a lecture-start burst costs one
+cache increment per batch.
+"""
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .conditional import (
+    STUDENT_NAMESPACE,
+    VERSIONED_CACHE_TIMEOUT,
+    course_pairs,
+    etag_for,
+    student_course_ids,
+)
+from .counters import rate_expression
+from .metrics import record_cache
+from .models import Attendance, CourseEnrollment
+
+# Rows may commit a little after the timestamp they were written with, so
+# `since` reads reach back this far; clients merge entries by id.
+SINCE_OVERLAP = timedelta(minutes=1)
+
+PresentStudent = Attendance.present_students.through
+
+
+def history_etag(student_id, since=None):
+    """Quoted ETag of a student's history (from `since`), derived from cache versions only"""
+    pairs = [(STUDENT_NAMESPACE, student_id)] + course_pairs(student_course_ids(student_id))
+    return etag_for(pairs, student_id, since.isoformat() if since else '')
+
+
+def history_queryset(student_id):
+    """Sessions in the student's history, annotated with `present` and `enrolled_at`"""
+    enrolled_at = CourseEnrollment.objects.filter(
+        student_id=student_id, course_id=OuterRef('course_id'),
+    ).values('enrolled_at')[:1]
+    return (
+        Attendance.objects
+        .filter(
+            Q(pk__in=PresentStudent.objects.filter(student_id=student_id).values('attendance_id'))
+            | Q(course_id__in=CourseEnrollment.objects.filter(student_id=student_id).values('course_id'))
+        )
+        .annotate(
+            present=Exists(PresentStudent.objects.filter(attendance_id=OuterRef('pk'), student_id=student_id)),
+            enrolled_at=Subquery(enrolled_at),
+        )
+        .filter(
+            Q(present=True)
+            | Q(is_active=False, enrolled_at__isnull=False, date__gte=TruncDate('enrolled_at'))
+        )
+    )
+
+
+def course_rates(queryset):
+    """Per-course session count, present count and attendance rate, aggregated in SQL"""
+    return (
+        queryset
+        .order_by()
+        .values('course_id', course_code=F('course__course_code'))
+        .annotate(
+            session_count=Count('pk'),
+            present_count=Count('pk', filter=Q(present=True)),
+        )
+        .annotate(attendance_rate=rate_expression('present_count', 'session_count'))
+        .order_by('course_code')
+    )
+
+
+def build_history(student_id, since=None):
+    """
+    Return (courses, cursor). Each course has its rates over the whole
+    history and, with `since`, only the entries changed after it.
+    """
+    cursor = timezone.now()
+    sessions = history_queryset(student_id)
+    changed = sessions
+    if since is not None:
+        since = since - SINCE_OVERLAP
+        changed = changed.filter(Q(updated_at__gt=since) | Q(enrolled_at__gt=since))
+
+    courses = {}
+    for row in course_rates(sessions):
+        courses[row['course_id']] = dict(row, attendances=[], absences=[])
+    for row in changed.order_by('-date', '-id').values('id', 'course_id', 'date', 'present'):
+        entry = {'id': row['id'], 'date': row['date'].strftime('%Y-%m-%d')}
+        courses[row['course_id']]['attendances' if row['present'] else 'absences'].append(entry)
+    return list(courses.values()), cursor
+
+
+def student_history(student_id, since=None):
+    """Return (courses, cursor, etag), from the cache when nothing changed"""
+    etag = history_etag(student_id, since)
+    key = f"history:{student_id}:{etag[1:-1]}"
+    cached = cache.get(key)
+    record_cache('student-history', cached is not None)
+    if cached is None:
+        cached = build_history(student_id, since)
+        cache.set(key, cached, timeout=VERSIONED_CACHE_TIMEOUT)
+    courses, cursor = cached
+    return courses, cursor, etag
@@ -0,0 +1,419 @@
+"""
+Lecture-start surge load testing.
+
+seed_course() creates a large course with synthetic students, and the
+scenarios in SCENARIOS describe the traffic each student sends once the
+lecturer opens attendance. run_phase() fires that traffic from a thread pool
+through a Transport, either the in-process Django test client or HTTP
+against a running server (e.g. a local gunicorn), and collects latency,
+status and database query counts per endpoint. local_server() starts
+gunicorn (WSGI) or uvicorn (ASGI, async check-in views) for a side by side
+comparison. The loadtest_surge command ties it together.
+"""
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+from .checkins import open_session_ids
+from .counters import refresh_enrolled_counts
+from .enrollment import invalidate_enrollment
+from .metrics import QueryCounter
+from .models import AttendanceToken, Course, CourseEnrollment, Lecturer, PendingAttendance, Student
+
+PASSWORD = 'LoadTest123!'
+QUERY_COUNT_HEADER = 'X-Query-Count'
+CENTER = (5.6037, -0.1870)
+RADIUS_METERS = 100
+SEED_BATCH_SIZE = 1000
+SERVER_START_TIMEOUT = 30
+SERVER_COMMANDS = {
+    'wsgi': ['-m', 'gunicorn', 'attendance_system.wsgi', '--bind', '127.0.0.1:{port}',
+             '--workers', '{workers}', '--threads', '{threads}'],
+    'asgi': ['-m', 'uvicorn', 'attendance_system.asgi:application', '--host', '127.0.0.1', '--port', '{port}',
+             '--workers', '{workers}', '--log-level', 'warning', '--no-access-log'],
+}
+
+
+class QueryCountMiddleware:
+    """Report the number of database queries of each request in a response header"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self._acall(request)
+        with QueryCounter() as queries:
+            response = self.get_response(request)
+        response[QUERY_COUNT_HEADER] = str(queries.count)
+        return response
+
+    async def _acall(self, request):
+        async with QueryCounter() as queries:
+            response = await self.get_response(request)
+        response[QUERY_COUNT_HEADER] = str(queries.count)
+        return response
+
+
+@dataclass
+class LoadFixture:
+    prefix: str
+    lecturer: Lecturer
+    course: Course
+    token: str
+    students: list
+    # student pk -> auth token key, filled in by the login phase
+    auth_tokens: dict = field(default_factory=dict)
+
+    def inside_geofence(self, rng):
+        """A point a student inside the lecture hall could report"""
+        # ~1e-5 degrees is about a metre at the equator.
+        spread = RADIUS_METERS * 0.5e-5
+        return CENTER[0] + rng.uniform(-spread, spread), CENTER[1] + rng.uniform(-spread, spread)
+
+
+def seed_course(students=600, prefix=None):
+    """Create a lecturer, a geofenced course with an active token and enrolled students"""
+    prefix = prefix or f'lt{uuid.uuid4().hex[:3]}'
+    if len(f'{prefix}{students - 1}') > 10:
+        raise ValueError('Prefix and student count do not fit the 10 character student_id.')
+    # Hashing is the slow part of creating users, and every synthetic
+    # student shares the password, so it is hashed once.
+    password = make_password(PASSWORD)
+
+    lecturer_user = User.objects.create(username=f'{prefix}_lecturer', password=password)
+    lecturer = Lecturer.objects.create(user=lecturer_user, staff_id=f'{prefix}L', name=f'Load test {prefix}')
+    course = Course.objects.create(
+        name=f'Load test {prefix}',
+        course_code=f'{prefix}C',
+        lecturer=lecturer,
+        latitude=CENTER[0],
+        longitude=CENTER[1],
+        radius_meters=RADIUS_METERS,
+    )
+
+    usernames = [f'{prefix}_s{i}' for i in range(students)]
+    User.objects.bulk_create(
+        [User(username=username, password=password) for username in usernames],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+    Student.objects.bulk_create(
+        [
+            Student(user_id=user_ids[username], student_id=f'{prefix}{i}', name=f'Student {i}')
+            for i, username in enumerate(usernames)
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    seeded = list(Student.objects.filter(user__username__startswith=f'{prefix}_s').select_related('user'))
+    CourseEnrollment.objects.bulk_create(
+        [CourseEnrollment(course=course, student=student) for student in seeded],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    # bulk_create bypasses the signals that keep these up to date.
+    invalidate_enrollment(course.pk)
+    refresh_enrolled_counts(course_id=course.pk)
+
+    token = uuid.uuid4().hex[:6].upper()
+    AttendanceToken.objects.create(course=course, token=token)
+    return LoadFixture(prefix=prefix, lecturer=lecturer, course=course, token=token, students=seeded)
+
+
+def cleanup(fixture):
+    """Delete everything seed_course created, including the traffic it received"""
+    PendingAttendance.objects.filter(course_id=fixture.course.pk).delete()
+    User.objects.filter(username__startswith=f'{fixture.prefix}_').delete()
+
+
+class TestClientTransport:
+    """In-process requests through django.test.Client, with exact query counts"""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def post(self, path, data, auth_token=None, remote_addr='127.0.0.1'):
+        from django.test import Client
+
+        if not hasattr(self.local, 'client'):
+            # Server errors come back as 500 responses, as they would from gunicorn.
+            self.local.client = Client(SERVER_NAME='localhost', raise_request_exception=False)
+        headers = {'HTTP_AUTHORIZATION': f'Token {auth_token}'} if auth_token else {}
+        with QueryCounter() as queries:
+            start = time.perf_counter()
+            response = self.local.client.post(
+                path, data, content_type='application/json', REMOTE_ADDR=remote_addr, **headers,
+            )
+            elapsed = time.perf_counter() - start
+        return response.status_code, elapsed, queries.count, _json(response)
+
+    def close(self):
+        connections.close_all()
+
+
+class HttpTransport:
+    """Requests against a running server. Query counts need the server to run with QUERY_COUNT_HEADER=True."""
+
+    def __init__(self, base_url):
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.requests = requests
+        self.local = threading.local()
+
+    def post(self, path, data, auth_token=None, remote_addr=None):
+        if not hasattr(self.local, 'session'):
+            self.local.session = self.requests.Session()
+        headers = {'Authorization': f'Token {auth_token}'} if auth_token else {}
+        start = time.perf_counter()
+        response = self.local.session.post(self.base_url + path, json=data, headers=headers, timeout=60)
+        elapsed = time.perf_counter() - start
+        queries = response.headers.get(QUERY_COUNT_HEADER)
+        return response.status_code, elapsed, int(queries) if queries is not None else None, _json(response)
+
+    def close(self):
+        connections.close_all()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(process, port, log):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise RuntimeError(f'Server exited with {process.returncode}: {log.read().decode(errors="replace")[-2000:]}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server did not listen on port {port} within {SERVER_START_TIMEOUT}s.')
+
+
+def add_query_latency(seconds):
+    """Delay every query on connections opened from now on, like a database across the network"""
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        # Fired again whenever a thread's connection reconnects, possibly while
+        # QueryCounter wrappers are installed; they are removed with pop(), so
+        # this one goes first.
+        if delay not in connection.execute_wrappers:
+            connection.execute_wrappers.insert(0, delay)
+
+    connection_created.connect(install, weak=False)
+
+
+@contextmanager
+def local_server(mode, workers=1, threads=1, db_latency_ms=0):
+    """
+    Run gunicorn ('wsgi') or uvicorn ('asgi', DEPLOYMENT_MODE=asgi) on a free
+    local port against this database and yield its base URL. Login rate
+    limits are off, query counts are reported in a header and every query
+    the server runs can be delayed by db_latency_ms.
+    """
+    port = _free_port()
+    command = [sys.executable] + [
+        part.format(port=port, workers=workers, threads=threads) for part in SERVER_COMMANDS[mode]
+    ]
+    env = dict(
+        os.environ,
+        DEPLOYMENT_MODE=mode,
+        RATELIMIT_ENABLE='False',
+        QUERY_COUNT_HEADER='True',
+        LOADTEST_DB_LATENCY_MS=str(db_latency_ms),
+    )
+    with tempfile.TemporaryFile() as log:
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env, stdout=log, stderr=log)
+        try:
+            _wait_for_port(process, port, log)
+            yield f'http://127.0.0.1:{port}'
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+def _json(response):
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+def _student_addr(student):
+    # One address per phone, like on a campus network.
+    return f'10.{(student.pk >> 16) & 255}.{(student.pk >> 8) & 255}.{student.pk & 255}'
+
+
+def login_requests(fixture, student, rng):
+    return [('login', '/api/auth/login/', {
+        'username': student.user.username,
+        'password': PASSWORD,
+        'student_id': student.student_id,
+    })]
+
+
+def take_attendance_requests(fixture, student, rng):
+    latitude, longitude = fixture.inside_geofence(rng)
+    return [('take_attendance', '/api/courses/take_attendance/', {
+        'token': fixture.token, 'latitude': latitude, 'longitude': longitude,
+    })]
+
+
+def submit_location_requests(fixture, student, rng):
+    latitude, longitude = fixture.inside_geofence(rng)
+    return [('submit_location', '/api/submit-location/', {
+        'attendance_token': fixture.token, 'latitude': latitude, 'longitude': longitude,
+    })]
+
+
+def sync_requests(fixture, student, rng):
+    latitude, longitude = fixture.inside_geofence(rng)
+    return [('sync_attendance', '/api/sync/attendance/', {'records': [{
+        'student_id': student.student_id,
+        'course_id': fixture.course.pk,
+        'token': fixture.token,
+        'latitude': round(latitude, 6),
+        'longitude': round(longitude, 6),
+        'timestamp': timezone.now().isoformat(),
+        'device_id': f'device-{student.pk}',
+    }]})]
+
+
+def surge_requests(fixture, student, rng):
+    """Most phones check in online, some retry via submit-location, some were offline"""
+    roll = rng.random()
+    if roll < 0.8:
+        return take_attendance_requests(fixture, student, rng)
+    if roll < 0.9:
+        return take_attendance_requests(fixture, student, rng) + submit_location_requests(fixture, student, rng)
+    return sync_requests(fixture, student, rng)
+
+
+def open_session(fixture):
+    # Joins a session that is already open rather than colliding with it.
+    open_session_ids([fixture.course.pk])
+
+
+@dataclass(frozen=True)
+class Scenario:
+    description: str
+    requests: object
+    # Run before the traffic starts, e.g. to open the session beforehand
+    prepare: object = None
+
+
+SCENARIOS = {
+    'take_attendance': Scenario('Every student checks in with take_attendance.', take_attendance_requests),
+    'submit_location': Scenario(
+        'Every student submits its location to an already open session.', submit_location_requests, open_session,
+    ),
+    'sync': Scenario('Every student uploads an offline record through sync/attendance.', sync_requests),
+    'surge': Scenario(
+        'Mixed lecture start: 80% take_attendance, 10% also submit-location, 10% offline sync.', surge_requests,
+    ),
+}
+
+
+@dataclass
+class EndpointStats:
+    latencies: list = field(default_factory=list)
+    statuses: dict = field(default_factory=lambda: defaultdict(int))
+    queries: list = field(default_factory=list)
+    exceptions: int = 0
+
+    @property
+    def count(self):
+        return len(self.latencies) + self.exceptions
+
+    @property
+    def errors(self):
+        return self.exceptions + sum(n for code, n in self.statuses.items() if code >= 400)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def run_phase(fixture, transport, request_factory, concurrency, seed=0):
+    """
+    Send every student's requests from `concurrency` threads, each student's
+    requests in order. Returns ({endpoint: EndpointStats}, wall_seconds).
+    """
+    stats = defaultdict(EndpointStats)
+    lock = threading.Lock()
+    rng = random.Random(seed)
+    plans = [(student, request_factory(fixture, student, rng)) for student in fixture.students]
+
+    def run(student, requests):
+        for endpoint, path, payload in requests:
+            try:
+                status, elapsed, queries, body = transport.post(
+                    path, payload, fixture.auth_tokens.get(student.pk), _student_addr(student),
+                )
+            except Exception:
+                with lock:
+                    stats[endpoint].exceptions += 1
+                continue
+            with lock:
+                endpoint_stats = stats[endpoint]
+                endpoint_stats.latencies.append(elapsed)
+                endpoint_stats.statuses[status] += 1
+                if queries is not None:
+                    endpoint_stats.queries.append(queries)
+            if endpoint == 'login' and status == 200:
+                fixture.auth_tokens[student.pk] = body['token']
+
+    def worker(chunk):
+        try:
+            for student, requests in chunk:
+                run(student, requests)
+        finally:
+            # Pool threads open their own database connections.
+            transport.close()
+
+    start = time.perf_counter()
+    if concurrency <= 1:
+        for student, requests in plans:
+            run(student, requests)
+    else:
+        chunks = [plans[i::concurrency] for i in range(concurrency)]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(worker, chunks))
+    return dict(stats), time.perf_counter() - start
@@ -0,0 +1,29 @@
+"""
+Per-process cache for deployments without REDIS_URL.
+
+The token, enrollment and auth caches and the version counters behind ETags
+are invalidated by whichever process handles the change. With a memory cache
+of its own in every process, the others keep serving what they cached, so
+ProcessLocalCache caps every entry at MAX_TIMEOUT seconds (timeouts of None
+included): a change reaches all processes within that time instead of after
+the hours the shared-cache timeouts allow.
+"""
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+DEFAULT_MAX_TIMEOUT = 5
+
+
+class ProcessLocalCache(LocMemCache):
+    """LocMemCache that keeps no entry longer than MAX_TIMEOUT seconds"""
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self.max_timeout = params.get('MAX_TIMEOUT', DEFAULT_MAX_TIMEOUT)
+
+    def get_backend_timeout(self, timeout=DEFAULT_TIMEOUT):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None or timeout > self.max_timeout:
+            timeout = self.max_timeout
+        return super().get_backend_timeout(timeout)
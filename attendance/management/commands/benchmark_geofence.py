@@ -0,0 +1,72 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from geopy.distance import geodesic
+
+from attendance.geofence import FastGeofenceEngine, GeodesicGeofenceEngine
+
+
+class Command(BaseCommand):
+    help = "Compare geofence engines on random check-ins around a course location."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--points", type=int, default=20000)
+        parser.add_argument("--radius", type=float, default=100.0)
+        parser.add_argument("--latitude", type=float, default=5.6037)
+        parser.add_argument("--longitude", type=float, default=-0.1870)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        radius = options["radius"]
+        center = (options["latitude"], options["longitude"])
+
+        # Most students stand inside the room, some just outside it and a
+        # few are far away, which is roughly what a lecture start looks like.
+        points = []
+        for _ in range(options["points"]):
+            distance = random.choice([
+                random.uniform(0, radius),
+                random.uniform(radius * 0.9, radius * 1.1),
+                random.uniform(radius, radius * 50),
+            ])
+            destination = geodesic(meters=distance).destination(center, random.uniform(0, 360))
+            points.append((destination.latitude, destination.longitude))
+
+        legacy = GeodesicGeofenceEngine()
+        fast = FastGeofenceEngine()
+
+        legacy_results, legacy_seconds = self._time(
+            lambda: [legacy.validate(center[0], center[1], radius, lat, lon) for lat, lon in points]
+        )
+        fast_results, fast_seconds = self._time(
+            lambda: [fast.validate(center[0], center[1], radius, lat, lon) for lat, lon in points]
+        )
+        count = len(points)
+        batch_results, batch_seconds = self._time(
+            lambda: fast.validate_batch(
+                [center[0]] * count, [center[1]] * count, [radius] * count,
+                [lat for lat, _ in points], [lon for _, lon in points],
+            )
+        )
+
+        fast_mismatches = sum(a[0] != b[0] for a, b in zip(legacy_results, fast_results))
+        batch_mismatches = sum(a[0] != b for a, b in zip(legacy_results, batch_results[0]))
+
+        self.stdout.write(f"{count} points, radius {radius:.0f} m")
+        for name, seconds in (
+            ("geodesic (legacy)", legacy_seconds),
+            ("fast engine", fast_seconds),
+            ("fast engine, batch", batch_seconds),
+        ):
+            self.stdout.write(
+                f"{name:<20} {seconds * 1000:10.1f} ms  {count / seconds:12.0f} checks/s  "
+                f"x{legacy_seconds / seconds:.1f}"
+            )
+        self.stdout.write(f"Decision mismatches: fast={fast_mismatches}, batch={batch_mismatches}")
+
+    def _time(self, func):
+        start = time.perf_counter()
+        result = func()
+        return result, time.perf_counter() - start
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from attendance.query_plans import check_plans, seed_tables
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed the large tables inside a transaction, EXPLAIN every hot query and fail if any reads a "
+        "large table with a sequential scan. Nothing is left in the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000, help="Rows to seed per large table.")
+        parser.add_argument("--verbose-plans", action="store_true", help="Print every plan, not only failures.")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                results = check_plans(seed_tables(options["rows"]))
+                raise _Rollback
+        except _Rollback:
+            pass
+        except NotImplementedError as exc:
+            raise CommandError(str(exc))
+
+        failed = []
+        for name, (plan, scans) in results.items():
+            status = f"SEQ SCAN {', '.join(scans)}" if scans else "ok"
+            self.stdout.write(f"{name}: {status}")
+            if scans or options["verbose_plans"]:
+                self.stdout.write("    " + plan.replace("\n", "\n    "))
+            if scans:
+                failed.append(name)
+
+        if failed:
+            raise CommandError(f"Sequential scans in {len(failed)} hot queries: {', '.join(failed)}")
+        self.stdout.write(f"All {len(results)} hot queries use indexes")
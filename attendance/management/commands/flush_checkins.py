@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from attendance.checkins import flush_checkins
+
+
+class Command(BaseCommand):
+    help = "Merge write-behind check-ins into attendance sessions. Safe to run several workers at once."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.CHECKIN_FLUSH_BATCH_SIZE)
+        parser.add_argument(
+            "--interval-ms",
+            type=int,
+            default=settings.CHECKIN_FLUSH_INTERVAL_MS,
+            help="Milliseconds between flushes with --loop, unless a full batch is waiting.",
+        )
+        parser.add_argument("--loop", action="store_true", help="Keep running and flush as check-ins arrive.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        if not options["loop"]:
+            total = 0
+            while True:
+                flushed = flush_checkins(batch_size)
+                total += flushed
+                if flushed < batch_size:
+                    break
+            self.stdout.write(f"Flushed {total} check-ins")
+            return
+
+        self.stdout.write("Flushing check-ins...")
+        while True:
+            # A full batch means more are waiting: flush again straight away.
+            if flush_checkins(batch_size) < batch_size:
+                time.sleep(options["interval_ms"] / 1000)
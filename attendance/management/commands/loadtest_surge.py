@@ -0,0 +1,130 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from attendance.loadtest import (
+    SCENARIOS,
+    HttpTransport,
+    TestClientTransport,
+    cleanup,
+    local_server,
+    login_requests,
+    run_phase,
+    seed_course,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate a lecture start: seed a large course, log its students in and fire concurrent "
+        "check-in traffic, then report throughput, latency percentiles, errors and queries per endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=600)
+        parser.add_argument("--concurrency", type=int, default=50, help="Number of simultaneous clients.")
+        parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="surge")
+        parser.add_argument(
+            "--url",
+            help=(
+                "Base URL of a running server, e.g. http://127.0.0.1:8000, sharing this database. "
+                "Without it requests go through the in-process test client."
+            ),
+        )
+        parser.add_argument(
+            "--serve",
+            choices=["wsgi", "asgi", "both"],
+            help=(
+                "Start a local gunicorn (wsgi) or uvicorn (asgi, async check-in views) on this database and "
+                "test it; 'both' runs the scenario against each and compares throughput."
+            ),
+        )
+        parser.add_argument("--workers", type=int, default=1, help="Server processes with --serve.")
+        parser.add_argument("--threads", type=int, default=1, help="Threads per gunicorn worker with --serve.")
+        parser.add_argument(
+            "--db-latency-ms",
+            type=float,
+            default=0.0,
+            help="With --serve: delay every query of the server, as a database across the network would.",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for locations and scenario mix.")
+        parser.add_argument("--keep", action="store_true", help="Keep the seeded course and its traffic.")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and os.getenv("ALLOW_LOAD_TEST", "false").lower() != "true":
+            raise CommandError("Load tests write to the configured database. Set ALLOW_LOAD_TEST=true to run one.")
+
+        if options["url"] and options["serve"]:
+            raise CommandError("--url and --serve are mutually exclusive.")
+
+        if not options["serve"]:
+            target = options["url"] or "in-process test client"
+            self._run(options, HttpTransport(options["url"]) if options["url"] else TestClientTransport(), target)
+            return
+
+        modes = ["wsgi", "asgi"] if options["serve"] == "both" else [options["serve"]]
+        throughput = {}
+        for mode in modes:
+            with local_server(mode, options["workers"], options["threads"], options["db_latency_ms"]) as url:
+                throughput[mode] = self._run(options, HttpTransport(url), f"local {mode} server at {url}")
+        if len(throughput) > 1:
+            self.stdout.write("")
+            self.stdout.write(
+                f"Lecture start with {options['workers']} worker(s), {options['db_latency_ms']}ms per query: wsgi {throughput['wsgi']:.1f} req/s "
+                f"({options['threads']} thread(s) per worker), asgi {throughput['asgi']:.1f} req/s, "
+                f"{throughput['asgi'] / throughput['wsgi']:.2f}x"
+            )
+
+    def _run(self, options, transport, target):
+        """Seed, log in and run the scenario against one target; returns the lecture start req/s"""
+        scenario = SCENARIOS[options["scenario"]]
+        concurrency = max(options["concurrency"], 1)
+
+        self.stdout.write(
+            f"Database: {connection.vendor}. Target: {target}. "
+            f"Scenario: {options['scenario']} - {scenario.description}"
+        )
+        self.stdout.write(f"Seeding {options['students']} students...")
+        fixture = seed_course(options["students"])
+        try:
+            stats, seconds = run_phase(fixture, transport, login_requests, concurrency, options["seed"])
+            self._report("Login", stats, seconds)
+
+            if scenario.prepare is not None:
+                scenario.prepare(fixture)
+            stats, seconds = run_phase(fixture, transport, scenario.requests, concurrency, options["seed"])
+            self._report("Lecture start", stats, seconds)
+            return sum(endpoint.count for endpoint in stats.values()) / seconds
+        finally:
+            if options["keep"]:
+                self.stdout.write(f"Kept seeded data with prefix {fixture.prefix}")
+            else:
+                cleanup(fixture)
+
+    def _report(self, title, stats, seconds):
+        total = sum(endpoint.count for endpoint in stats.values())
+        self.stdout.write("")
+        self.stdout.write(f"{title}: {total} requests in {seconds:.2f}s ({total / seconds:.1f} req/s)")
+        self.stdout.write(
+            f"{'endpoint':<18}{'requests':>9}{'req/s':>9}{'errors':>8}{'err %':>7}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'max q':>7}"
+        )
+        for name, endpoint in sorted(stats.items()):
+            p50, p95, p99 = (endpoint.percentile(p) for p in (50, 95, 99))
+            queries = endpoint.queries
+            self.stdout.write(
+                f"{name:<18}{endpoint.count:>9}{endpoint.count / seconds:>9.1f}{endpoint.errors:>8}"
+                f"{endpoint.errors / endpoint.count * 100:>7.1f}"
+                f"{self._ms(p50):>9}{self._ms(p95):>9}{self._ms(p99):>9}"
+                f"{(f'{sum(queries) / len(queries):.1f}' if queries else '-'):>9}"
+                f"{(max(queries) if queries else '-'):>7}"
+            )
+            statuses = ", ".join(f"{code}: {count}" for code, count in sorted(endpoint.statuses.items()))
+            if endpoint.exceptions:
+                statuses += f", failed requests: {endpoint.exceptions}"
+            self.stdout.write(f"{'':<18}status {statuses}")
+
+    def _ms(self, seconds):
+        return "-" if seconds is None else f"{seconds * 1000:.1f}"
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from attendance.pending import DEFAULT_CHUNK_SIZE, active_run, drain_run, enqueue_run
+
+
+class Command(BaseCommand):
+    help = "Process pending offline attendance records in chunks. Safe to run several workers at once."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running and drain runs queued through the API as they appear.",
+        )
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds between polls with --loop.")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+
+        if not options["loop"]:
+            self._drain(enqueue_run(), chunk_size)
+            return
+
+        self.stdout.write("Waiting for pending attendance runs...")
+        while True:
+            run = active_run()
+            if run is None:
+                time.sleep(options["interval"])
+                continue
+            self._drain(run, chunk_size)
+
+    def _drain(self, run, chunk_size):
+        run = drain_run(run, chunk_size)
+        self.stdout.write(
+            f"Run {run.pk}: processed={run.processed} failed={run.failed} total={run.total}"
+        )
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from attendance.counters import enrolled_count_expression, present_count_expression
+from attendance.models import Attendance
+
+
+class Command(BaseCommand):
+    help = "Rebuild the present/enrolled counters on attendance sessions in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--course", type=int, help="Only recount sessions of this course id.")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument(
+            "--all-enrolled",
+            action="store_true",
+            help=(
+                "Also recompute enrolled_count of ended sessions from today's roster. "
+                "By default ended sessions keep the snapshot taken when they closed."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        sessions = Attendance.objects.all()
+        if options["course"]:
+            sessions = sessions.filter(course_id=options["course"])
+
+        enrolled_filter = Q() if options["all_enrolled"] else Q(is_active=True) | Q(enrolled_count=0)
+        chunk_size = options["chunk_size"]
+        last_id = 0
+        updated = 0
+        while True:
+            ids = list(
+                sessions.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                chunk = Attendance.objects.filter(pk__in=ids)
+                updated += chunk.update(present_count=present_count_expression())
+                chunk.filter(enrolled_filter).update(enrolled_count=enrolled_count_expression())
+            last_id = ids[-1]
+
+        self.stdout.write(f"Recounted {updated} attendance sessions.")
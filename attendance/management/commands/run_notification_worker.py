@@ -0,0 +1,50 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from attendance.notifications import FCMDispatcher, notifications_enabled
+from attendance.outbox import drain_outbox
+
+IDLE_SECONDS = 3600
+
+
+class Command(BaseCommand):
+    help = "Send queued push notifications from the outbox. Safe to run several workers at once."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.NOTIFICATION_OUTBOX_BATCH_SIZE)
+        parser.add_argument(
+            "--interval-ms",
+            type=int,
+            default=settings.NOTIFICATION_WORKER_INTERVAL_MS,
+            help="Milliseconds between polls with --loop, unless a full batch was just sent.",
+        )
+        parser.add_argument("--loop", action="store_true", help="Keep running and send notifications as they are queued.")
+
+    def handle(self, *args, **options):
+        if not notifications_enabled():
+            # Nothing is queued without FCM. Idle instead of exiting, so a
+            # process manager running the Procfile does not restart us in a loop.
+            self.stdout.write("FCM_SERVER_KEY is not set; notifications are disabled.")
+            while options["loop"]:
+                time.sleep(IDLE_SECONDS)
+            return
+        batch_size = options["batch_size"]
+        # One dispatcher keeps its pooled connections across batches.
+        dispatcher = FCMDispatcher()
+
+        if not options["loop"]:
+            total = 0
+            while True:
+                claimed = drain_outbox(batch_size, dispatcher)
+                total += claimed
+                if claimed < batch_size:
+                    break
+            self.stdout.write(f"Processed {total} queued notifications")
+            return
+
+        self.stdout.write("Sending queued notifications...")
+        while True:
+            if drain_outbox(batch_size, dispatcher) < batch_size:
+                time.sleep(options["interval_ms"] / 1000)
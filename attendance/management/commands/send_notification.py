@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.fcm_stub import FLAKY_PREFIX, INVALID_PREFIX, StubFCMServer
+from attendance.notifications import FCMDispatcher, dispatch_notification, notifications_enabled
+
+
+class Command(BaseCommand):
+    help = (
+        "Send a push notification to the subscribers of a course (or all subscribers) and report "
+        "sent, failed and pruned tokens and throughput. With --stub --devices N it benchmarks the "
+        "dispatcher against a local stub FCM server without touching the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--title", default="Test notification")
+        parser.add_argument("--body", default="Sent by manage.py send_notification")
+        parser.add_argument("--course", type=int, help="Only subscribers of this course id.")
+        parser.add_argument("--stub", action="store_true", help="Send to a local stub FCM server.")
+        parser.add_argument("--devices", type=int, help="With --stub: synthetic tokens to send to.")
+        parser.add_argument("--invalid", type=float, default=0.05, help="Share of synthetic tokens that are invalid.")
+        parser.add_argument("--flaky", type=float, default=0.05, help="Share of synthetic tokens that fail once.")
+        parser.add_argument("--latency-ms", type=float, default=20.0, help="Stub response time per request.")
+        parser.add_argument("--concurrency", type=int)
+        parser.add_argument("--batch-size", type=int)
+
+    def handle(self, *args, **options):
+        if options["devices"] and not options["stub"]:
+            raise CommandError("--devices only works with --stub.")
+        if not options["stub"] and not notifications_enabled():
+            raise CommandError("FCM_SERVER_KEY is not set.")
+
+        if not options["stub"]:
+            dispatcher = FCMDispatcher(concurrency=options["concurrency"], batch_size=options["batch_size"])
+            self._report(dispatch_notification(options["title"], options["body"], options["course"], dispatcher=dispatcher))
+            return
+
+        with StubFCMServer(latency=options["latency_ms"] / 1000) as stub:
+            dispatcher = FCMDispatcher(
+                url=stub.url,
+                server_key=stub.server_key,
+                concurrency=options["concurrency"],
+                batch_size=options["batch_size"],
+                backoff=0.01,
+            )
+            self.stdout.write(f"Stub FCM server at {stub.url}")
+            if options["devices"]:
+                result = dispatcher.send(
+                    self._tokens(options["devices"], options["invalid"], options["flaky"]),
+                    options["title"],
+                    options["body"],
+                )
+            else:
+                result = dispatch_notification(options["title"], options["body"], options["course"], dispatcher=dispatcher)
+        self._report(result)
+
+    def _tokens(self, count, invalid, flaky):
+        invalid_every = int(1 / invalid) if invalid else 0
+        flaky_every = int(1 / flaky) if flaky else 0
+        for i in range(count):
+            if invalid_every and i % invalid_every == 0:
+                yield f"{INVALID_PREFIX}-{i}"
+            elif flaky_every and i % flaky_every == 1:
+                yield f"{FLAKY_PREFIX}-{i}"
+            else:
+                yield f"device-{i}"
+
+    def _report(self, result):
+        stats = result.as_dict()
+        self.stdout.write(
+            f"Recipients: {stats['recipients']}  sent: {stats['sent']}  failed: {stats['failed']}  "
+            f"pruned: {stats['pruned']}  invalid: {len(result.invalid_tokens)}"
+        )
+        self.stdout.write(
+            f"Requests: {stats['requests']}  time: {stats['seconds']}s  throughput: {stats['throughput']} tokens/s"
+        )
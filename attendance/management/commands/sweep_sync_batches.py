@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from attendance.sync import sweep_sync_batches
+
+
+class Command(BaseCommand):
+    help = "Delete sync upload responses older than SYNC_BATCH_TTL_SECONDS in chunks. Safe to run alongside the in-process sweep."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=settings.TOKEN_SWEEP_CHUNK_SIZE)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.TOKEN_SWEEP_INTERVAL_SECONDS or 3600,
+            help="Seconds between sweeps with --loop.",
+        )
+        parser.add_argument("--loop", action="store_true", help="Keep running and sweep every --interval seconds.")
+
+    def handle(self, *args, **options):
+        if not options["loop"]:
+            swept = sweep_sync_batches(options["chunk_size"])
+            self.stdout.write(f"Deleted {swept} expired sync batches")
+            return
+
+        self.stdout.write("Sweeping expired sync batches...")
+        while True:
+            sweep_sync_batches(options["chunk_size"])
+            time.sleep(options["interval"])
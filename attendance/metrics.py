@@ -0,0 +1,164 @@
+"""
+Prometheus metrics.
+
+MetricsMiddleware records request counts, latency, in-flight requests and the
+number and duration of database queries per resolved URL name; the check-in
+caches report hits and misses through record_cache(). metrics_view serves
+everything in the Prometheus text format.
+
+Under gunicorn every worker is a separate process, so metrics are written to
+files in PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py) and metrics_view
+aggregates them, whichever worker answers the scrape.
+"""
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+UNRESOLVED_VIEW = '<unresolved>'
+
+REQUESTS = Counter(
+    'http_requests_total', 'HTTP requests by view, method and status.', ['view', 'method', 'status'],
+)
+LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by view.', ['view', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'Requests being handled.', multiprocess_mode='livesum',
+)
+DB_QUERIES = Histogram(
+    'db_queries_per_request', 'Database queries issued by one request, by view.', ['view'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250),
+)
+DB_TIME = Histogram(
+    'db_time_seconds', 'Time one request spent in database queries, by view.', ['view'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Lookups in the check-in caches by cache and result.', ['cache', 'result'],
+)
+
+
+class QueryCounter:
+    """Context manager counting and timing the queries run on this thread's connection"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+    def __enter__(self):
+        self.wrapper = connection.execute_wrapper(self)
+        self.wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.wrapper.__exit__(*exc_info)
+
+    # Async views run their queries in the request's sync thread, so the
+    # wrapper is installed on that thread's connection.
+    async def __aenter__(self):
+        await sync_to_async(self.__enter__)()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await sync_to_async(self.__exit__)(*exc_info)
+
+
+def record_cache(name, hit):
+    CACHE_REQUESTS.labels(name, 'hit' if hit else 'miss').inc()
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNRESOLVED_VIEW
+    return match.url_name or match.route or UNRESOLVED_VIEW
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self._acall(request)
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        status = 500
+        try:
+            with QueryCounter() as queries:
+                response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            self._observe(request, status, start, queries)
+
+    async def _acall(self, request):
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        status = 500
+        try:
+            async with QueryCounter() as queries:
+                response = await self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            self._observe(request, status, start, queries)
+
+    def _observe(self, request, status, start, queries):
+        elapsed = time.perf_counter() - start
+        IN_FLIGHT.dec()
+        view = _view_name(request)
+        REQUESTS.labels(view, request.method, str(status)).inc()
+        LATENCY.labels(view, request.method).observe(elapsed)
+        DB_QUERIES.labels(view).observe(queries.count)
+        DB_TIME.labels(view).observe(queries.seconds)
+
+
+def _registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Requires 'Authorization: Bearer <METRICS_TOKEN>';
+    without a token it is only served with DEBUG on.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token and not settings.DEBUG:
+        raise Http404
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(generate_latest(_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.7 on 2026-10-18 03:39
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Attendance = apps.get_model('attendance', 'Attendance')
+    CourseEnrollment = apps.get_model('attendance', 'CourseEnrollment')
+    PresentStudent = Attendance.present_students.through
+
+    def count(queryset, field):
+        return Coalesce(
+            Subquery(
+                queryset.order_by().values(field).annotate(total=Count('pk')).values('total')[:1],
+                output_field=IntegerField(),
+            ),
+            Value(0),
+        )
+
+    Attendance.objects.update(
+        present_count=count(PresentStudent.objects.filter(attendance_id=OuterRef('pk')), 'attendance_id'),
+        enrolled_count=count(CourseEnrollment.objects.filter(course_id=OuterRef('course_id')), 'course_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0015_pendingattendancerun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='enrolled_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='attendance',
+            name='present_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-18 03:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0016_attendance_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['date', 'id'], name='attendance_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pendingattendance',
+            index=models.Index(fields=['synced', 'timestamp', 'id'], name='pending_synced_ts_id_idx'),
+        ),
+    ]
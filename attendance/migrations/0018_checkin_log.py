@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-18 03:46
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0017_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckIn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('checked_in_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('distance', models.FloatField(blank=True, null=True)),
+                ('device_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('flushed_at', models.DateTimeField(blank=True, null=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='attendance.course')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='attendance.student')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('flushed_at__isnull', True)), fields=['id'], name='checkin_unflushed_idx')],
+            },
+        ),
+    ]
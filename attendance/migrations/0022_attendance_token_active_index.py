@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0021_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attendancetoken',
+            name='token',
+            field=models.CharField(max_length=6),
+        ),
+        migrations.AddIndex(
+            model_name='attendancetoken',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['expires_at'], name='attendance_token_expiry_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='attendancetoken',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('token',), name='attendance_token_active_unique'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0022_attendance_token_active_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='pendingattendance',
+            name='pending_synced_ts_id_idx',
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['course', 'date'], name='attendance_open_course_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['created_at'], name='attendance_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coursesubscription',
+            index=models.Index(fields=['course_id', 'user'], name='subscription_course_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pendingattendance',
+            index=models.Index(condition=models.Q(('synced', False)), fields=['timestamp', 'id'], name='pending_unsynced_ts_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pendingattendance',
+            index=models.Index(fields=['student_id', 'course_id', 'token'], name='pending_record_idx'),
+        ),
+    ]
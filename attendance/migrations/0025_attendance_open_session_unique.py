@@ -0,0 +1,41 @@
+# Generated by Django 5.0.7 on 2026-10-18 05:00
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+
+
+def end_duplicate_open_sessions(apps, schema_editor):
+    """Leave each course only its latest open session; older ones are ended"""
+    Attendance = apps.get_model('attendance', 'Attendance')
+    courses = (
+        Attendance.objects.filter(is_active=True)
+        .values('course_id').annotate(sessions=Count('pk')).filter(sessions__gt=1)
+        .values_list('course_id', flat=True)
+    )
+    for course_id in list(courses):
+        latest = Attendance.objects.filter(course_id=course_id, is_active=True).latest('date', 'pk')
+        Attendance.objects.filter(course_id=course_id, is_active=True).exclude(pk=latest.pk).update(
+            is_active=False, ended_at=timezone.now(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0024_sync_idempotency'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='attendance',
+            name='attendance_open_course_idx',
+        ),
+        migrations.RunPython(end_duplicate_open_sessions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('course',), name='attendance_open_session_unique'),
+        ),
+    ]
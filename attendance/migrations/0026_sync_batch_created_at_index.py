@@ -0,0 +1,19 @@
+# Generated by Django 5.0.7 on 2026-10-18 05:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0025_attendance_open_session_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='syncbatch',
+            index=models.Index(fields=['created_at'], name='sync_batch_created_at_idx'),
+        ),
+    ]
@@ -1,10 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from geopy.distance import geodesic
 from datetime import timedelta
 from django.utils import timezone
 
+from .geofence import validate_geofence
+
 class Lecturer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     staff_id = models.CharField(max_length=10, unique=True)
@@ -71,23 +72,14 @@ class Course(models.Model):
         Validate if student is within the geofence radius
         Returns (is_valid, distance_meters) tuple
         """
-        if not self.has_geofence():
-            return (True, 0.0)  # No geofence, allow all
-        
-        if student_latitude is None or student_longitude is None:
-            return (False, -1.0)  # Student location not provided
-        
-        try:
-            from decimal import Decimal
-            course_location = (float(self.latitude), float(self.longitude))
-            student_location = (float(student_latitude), float(student_longitude))
-            
-            distance = geodesic(course_location, student_location).meters
-            max_dist = max_distance_meters or float(self.radius_meters)
-            
-            return (distance <= max_dist, round(distance, 2))
-        except Exception as e:
-            raise ValidationError(f"Location validation error: {str(e)}")
+        return validate_geofence(
+            self.latitude,
+            self.longitude,
+            max_distance_meters or self.radius_meters,
+            student_latitude,
+            student_longitude,
+        )
+
 
 class CourseEnrollment(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
@@ -109,17 +101,53 @@ class Attendance(models.Model):
     updated_by = models.ForeignKey(User, related_name='updated_attendances', on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by attendance.counters; enrolled_count follows the course
+    # roster while the session is active and is frozen when it ends.
+    present_count = models.PositiveIntegerField(default=0)
+    enrolled_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination order of the attendance list
+            models.Index(fields=['date', 'id'], name='attendance_date_id_idx'),
+            # Date ranges of a course's sessions (lecturer dashboard)
+            models.Index(fields=['course', 'date'], name='attendance_course_date_idx'),
+            # Recent activity on the admin dashboard
+            models.Index(fields=['created_at'], name='attendance_created_at_idx'),
+        ]
+        constraints = [
+            # At most one open session per course, which check-ins, sync and
+            # end_attendance look up; see checkins.open_session_ids.
+            models.UniqueConstraint(
+                fields=['course'], condition=models.Q(is_active=True), name='attendance_open_session_unique',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.course.name} - {self.date} (Active: {self.is_active})"
 
+    @property
+    def attendance_rate(self):
+        return (self.present_count / self.enrolled_count * 100) if self.enrolled_count > 0 else 0
+
+    @property
+    def absent_count(self):
+        return max(self.enrolled_count - self.present_count, 0)
+
     def save(self, *args, **kwargs):
-        if self.is_active:
-            self.course.is_active = True
-            self.course.save()
         if self.ended_at is not None:
             self.is_active = False
         super().save(*args, **kwargs)
+        if self.is_active:
+            # Only the course's inactive -> active transition writes its row;
+            # saving a session of an already active course leaves it alone.
+            if Course.objects.filter(pk=self.course_id, is_active=False).update(is_active=True):
+                # A bulk update sends no post_save, so bump what course_saved
+                # would: the lecturer's course list shows is_active.
+                from .conditional import invalidate_course_lecturers
+                invalidate_course_lecturers([self.course_id])
+            if Attendance.course.is_cached(self):
+                self.course.is_active = True
 
 
     def is_open(self):
@@ -127,14 +155,37 @@ class Attendance(models.Model):
 
 class AttendanceToken(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
-    token = models.CharField(max_length=6, unique=True)
+    # Unique among active tokens only, so codes become free again once
+    # sweep_expired_tokens deactivates them.
+    token = models.CharField(max_length=6)
     generated_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     expires_at = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        constraints = [
+            # Also the index behind check-in lookups (token = ? AND is_active)
+            models.UniqueConstraint(
+                fields=['token'], condition=models.Q(is_active=True), name='attendance_token_active_unique',
+            ),
+        ]
+        indexes = [
+            # Expired active tokens, for the sweeper
+            models.Index(
+                fields=['expires_at'], condition=models.Q(is_active=True), name='attendance_token_expiry_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.course.name} - {self.token}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored code, so save() can also drop the cache entry of a renamed token.
+        instance._stored_token = instance.__dict__.get('token')
+        return instance
+
     def save(self, *args, **kwargs):
         if self.generated_at is None:
             self.generated_at = timezone.now()
@@ -147,6 +198,11 @@ class AttendanceToken(models.Model):
 
         super().save(*args, **kwargs)
 
+        from .token_cache import invalidate_tokens
+        stored = getattr(self, '_stored_token', None)
+        invalidate_tokens({self.token} if stored is None else {self.token, stored})
+        self._stored_token = self.token
+
 
 class BootstrapFlag(models.Model):
     key = models.CharField(max_length=64, unique=True)
@@ -165,14 +221,99 @@ class PendingAttendance(models.Model):
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     timestamp = models.DateTimeField()
     device_id = models.CharField(max_length=100, blank=True, null=True)
+    # sha256 of device_id and the client's record_id, or of the record's
+    # content; uploads skip records whose key is already stored.
+    record_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
     synced = models.BooleanField(default=False)
     synced_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination order of the unsynced backlog
+            models.Index(
+                fields=['timestamp', 'id'], condition=models.Q(synced=False), name='pending_unsynced_ts_id_idx',
+            ),
+            # Duplicate checks of uploaded records
+            models.Index(fields=['student_id', 'course_id', 'token'], name='pending_record_idx'),
+        ]
+
     def __str__(self):
         return f"Pending: Student {self.student_id} - Course {self.course_id}"
 
 
+class PendingAttendanceRun(models.Model):
+    """A request to process the pending attendance backlog, drained by process_pending_attendance"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_FINISHED = 'finished'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_FINISHED, 'Finished'),
+    ]
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Pending run {self.pk} ({self.status})"
+
+
+class SyncBatch(models.Model):
+    """The stored response to an offline sync upload sent with an Idempotency-Key header"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # sha256 of the uploaded records, to refuse a key reused for another upload
+    request_hash = models.CharField(max_length=64)
+    response = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='sync_batch_user_key_unique'),
+        ]
+        indexes = [
+            # TTL sweep, see sync.sweep_sync_batches
+            models.Index(fields=['created_at'], name='sync_batch_created_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"Sync batch {self.key} ({self.user_id})"
+
+
+class CheckIn(models.Model):
+    """
+    Append-only log of accepted check-ins, written instead of the session in
+    write-behind mode and merged into Attendance.present_students by
+    attendance.checkins.flush_checkins.
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    date = models.DateField()
+    checked_in_at = models.DateTimeField(default=timezone.now)
+    distance = models.FloatField(null=True, blank=True)
+    device_id = models.CharField(max_length=100, blank=True, null=True)
+    flushed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(flushed_at__isnull=True), name='checkin_unflushed_idx'),
+        ]
+
+    def __str__(self):
+        return f"Check-in: Student {self.student_id} - Course {self.course_id}"
+
+
 class DeviceToken(models.Model):
     """Store FCM device tokens for push notifications"""
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -196,6 +337,54 @@ class CourseSubscription(models.Model):
 
     class Meta:
         unique_together = ('user', 'course_id')
+        indexes = [
+            # Subscribers of a course, for notification fan-out
+            models.Index(fields=['course_id', 'user'], name='subscription_course_user_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - Course {self.course_id}"
+
+
+class AuthTokenVersion(models.Model):
+    """Per-user counter carried in JWTs; bumping it revokes every JWT issued before"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='token_version')
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} - v{self.version}"
+
+
+class NotificationOutbox(models.Model):
+    """
+    A push notification waiting to be sent, written in the transaction of the
+    change it announces and drained by run_notification_worker.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    course_id = models.IntegerField(null=True, blank=True)
+    title = models.CharField(max_length=255)
+    body = models.TextField()
+    data = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(status='queued'), name='outbox_queued_idx'),
+        ]
+
+    def __str__(self):
+        return f"Notification {self.pk} ({self.status})"
@@ -0,0 +1,215 @@
+"""
+Push notification dispatch through FCM.
+
+dispatch_notification() streams the device tokens of a course's subscribers
+(or of every subscriber) from the database in chunks and hands them to a
+FCMDispatcher, which posts them in provider-sized multicast batches over one
+pooled HTTP session from a bounded thread pool. Failed batches and tokens the
+provider reports as temporarily unavailable are retried with exponential
+backoff; tokens it reports as unregistered are deleted in bulk afterwards.
+
+The endpoint is FCM_URL, so the dispatcher can be pointed at a local stub
+(see fcm_stub.py and the send_notification command).
+"""
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .models import CourseSubscription, DeviceToken
+
+# FCM accepts at most this many registration ids per multicast request.
+FCM_BATCH_SIZE = 1000
+TOKEN_CHUNK_SIZE = 2000
+PRUNE_BATCH_SIZE = 1000
+# Per-token errors meaning the token will never work again
+INVALID_TOKEN_ERRORS = frozenset({'NotRegistered', 'InvalidRegistration', 'MismatchSenderId'})
+# Per-token errors worth another attempt
+RETRYABLE_TOKEN_ERRORS = frozenset({'Unavailable', 'InternalServerError', 'DeviceMessageRateExceeded'})
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def notifications_enabled():
+    return bool(getattr(settings, 'FCM_SERVER_KEY', ''))
+
+
+@dataclass
+class DispatchResult:
+    sent: int = 0
+    failed: int = 0
+    pruned: int = 0
+    requests: int = 0
+    seconds: float = 0.0
+    invalid_tokens: list = field(default_factory=list)
+
+    @property
+    def recipients(self):
+        return self.sent + self.failed
+
+    @property
+    def throughput(self):
+        """Tokens handled per second"""
+        return self.recipients / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'recipients': self.recipients,
+            'sent': self.sent,
+            'failed': self.failed,
+            'pruned': self.pruned,
+            'requests': self.requests,
+            'seconds': round(self.seconds, 3),
+            'throughput': round(self.throughput, 1),
+        }
+
+
+def _batches(tokens, size):
+    batch = []
+    for token in tokens:
+        batch.append(token)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class FCMDispatcher:
+    """Send one message to many tokens with pooled connections, bounded concurrency and retries"""
+
+    def __init__(self, url=None, server_key=None, batch_size=None, concurrency=None, max_retries=None,
+                 backoff=None, timeout=10, session=None):
+        self.url = url or settings.FCM_URL
+        self.server_key = server_key if server_key is not None else settings.FCM_SERVER_KEY
+        self.batch_size = min(batch_size or settings.FCM_BATCH_SIZE, FCM_BATCH_SIZE)
+        self.concurrency = max(concurrency or settings.FCM_CONCURRENCY, 1)
+        self.max_retries = settings.FCM_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.FCM_BACKOFF_SECONDS if backoff is None else backoff
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            # One connection per worker thread, kept alive across batches.
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.lock = threading.Lock()
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Full jitter keeps concurrent batches from retrying in lockstep.
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def _post(self, payload, tokens):
+        return self.session.post(
+            self.url,
+            json=dict(payload, registration_ids=tokens),
+            headers={'Authorization': f'key={self.server_key}'},
+            timeout=self.timeout,
+        )
+
+    def send_batch(self, tokens, payload, result):
+        """Deliver one batch, retrying what failed temporarily; tallies into result"""
+        pending = list(tokens)
+        retry_after = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self._delay(attempt - 1, retry_after))
+            retry_after = None
+            with self.lock:
+                result.requests += 1
+            try:
+                response = self._post(payload, pending)
+            except requests.RequestException:
+                continue
+            if response.status_code in RETRYABLE_STATUSES:
+                retry_after = response.headers.get('Retry-After')
+                continue
+            if response.status_code != 200:
+                # Bad key or malformed request; retrying will not help.
+                break
+
+            try:
+                outcomes = response.json().get('results', ())
+            except ValueError:
+                continue
+            retry, sent, invalid = [], 0, []
+            for token, outcome in zip(pending, outcomes):
+                error = outcome.get('error')
+                if error is None:
+                    sent += 1
+                elif error in RETRYABLE_TOKEN_ERRORS:
+                    retry.append(token)
+                elif error in INVALID_TOKEN_ERRORS:
+                    invalid.append(token)
+            with self.lock:
+                result.sent += sent
+                result.failed += len(pending) - sent - len(retry)
+                result.invalid_tokens.extend(invalid)
+            pending = retry
+            if not pending:
+                return
+            retry_after = response.headers.get('Retry-After')
+        with self.lock:
+            result.failed += len(pending)
+
+    def send(self, tokens, title, body, data=None):
+        """Send to every token of an iterable, at most `concurrency` requests in flight"""
+        payload = {'notification': {'title': title, 'body': body}}
+        if data:
+            payload['data'] = data
+        result = DispatchResult()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            in_flight = set()
+            for batch in _batches(tokens, self.batch_size):
+                if len(in_flight) >= self.concurrency:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                in_flight.add(pool.submit(self.send_batch, batch, payload, result))
+            for future in in_flight:
+                future.result()
+        result.seconds = time.perf_counter() - start
+        return result
+
+
+def recipient_tokens(course_id=None):
+    """Stream the distinct device tokens of a course's subscribers, or of all subscribers"""
+    subscriptions = CourseSubscription.objects.all()
+    if course_id is not None:
+        subscriptions = subscriptions.filter(course_id=course_id)
+    return (
+        DeviceToken.objects
+        .filter(user_id__in=subscriptions.values('user_id'))
+        .order_by()
+        .values_list('token', flat=True)
+        .distinct()
+        .iterator(chunk_size=TOKEN_CHUNK_SIZE)
+    )
+
+
+def prune_tokens(tokens):
+    """Delete device tokens in bulk and return how many were deleted"""
+    tokens = list(tokens)
+    deleted = 0
+    for start in range(0, len(tokens), PRUNE_BATCH_SIZE):
+        deleted += DeviceToken.objects.filter(token__in=tokens[start:start + PRUNE_BATCH_SIZE]).delete()[0]
+    return deleted
+
+
+def dispatch_notification(title, body, course_id=None, data=None, dispatcher=None):
+    """Notify the subscribers of a course (or everyone subscribed) and prune dead tokens"""
+    dispatcher = dispatcher or FCMDispatcher()
+    result = dispatcher.send(recipient_tokens(course_id), title, body, data)
+    result.pruned = prune_tokens(result.invalid_tokens)
+    return result
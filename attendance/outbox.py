@@ -0,0 +1,126 @@
+"""
+Transactional outbox for push notifications.
+
+The API and session events only insert a NotificationOutbox row, in the same
+transaction as the change they announce, so a notification is queued exactly
+when that change commits and the request never waits on the fan-out. The
+run_notification_worker command claims queued rows in batches with SELECT
+... FOR UPDATE SKIP LOCKED, sends identical messages for the same audience
+once, and records the outcome. Claims are leases: rows a dead worker claimed
+are picked up again after CLAIM_TIMEOUT. A send that errors or reaches none
+of its recipients is retried, and marked failed after MAX_ATTEMPTS.
+"""
+import json
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import NotificationOutbox
+from .notifications import FCMDispatcher, dispatch_notification, notifications_enabled
+
+DEFAULT_BATCH_SIZE = 100
+CLAIM_TIMEOUT = timedelta(minutes=5)
+MAX_ATTEMPTS = 5
+
+EVENT_ATTENDANCE_STARTED = 'attendance_started'
+EVENT_ATTENDANCE_ENDED = 'attendance_ended'
+
+
+def enqueue_notification(title, body, course_id=None, data=None):
+    """Queue a notification for the subscribers of a course, or for everyone subscribed"""
+    return NotificationOutbox.objects.create(title=title, body=body, course_id=course_id, data=data or {})
+
+
+def _enqueue_event(event, course, title, body):
+    if not notifications_enabled():
+        return None
+    # FCM data payload values must be strings.
+    data = {'event': event, 'course_id': str(course.pk)}
+    return enqueue_notification(title, body, course_id=course.pk, data=data)
+
+
+def notify_attendance_started(token):
+    course = token.course
+    return _enqueue_event(
+        EVENT_ATTENDANCE_STARTED,
+        course,
+        f'{course.course_code}: attendance is open',
+        f'Check in to {course.name} before {timezone.localtime(token.expires_at):%H:%M}.',
+    )
+
+
+def notify_attendance_ended(attendance):
+    course = attendance.course
+    return _enqueue_event(
+        EVENT_ATTENDANCE_ENDED,
+        course,
+        f'{course.course_code}: attendance closed',
+        f'Attendance for {course.name} on {attendance.date} has closed.',
+    )
+
+
+def claim_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """Lease up to batch_size queued rows to this worker, skipping rows other workers are claiming"""
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            NotificationOutbox.objects
+            .filter(status=NotificationOutbox.STATUS_QUEUED)
+            .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - CLAIM_TIMEOUT))
+            .select_for_update(skip_locked=True)
+            .order_by('id')[:batch_size]
+        )
+        NotificationOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(
+            claimed_at=now,
+            attempts=F('attempts') + 1,
+        )
+    return rows
+
+
+def _message_key(row):
+    return row.course_id, row.title, row.body, json.dumps(row.data, sort_keys=True)
+
+
+def drain_outbox(batch_size=DEFAULT_BATCH_SIZE, dispatcher=None):
+    """
+    Claim and send one batch; returns how many rows it claimed. Rows with the
+    same audience and content are sent once and all marked with the result.
+    """
+    rows = claim_batch(batch_size)
+    if not rows:
+        return 0
+
+    messages = {}
+    for row in rows:
+        messages.setdefault(_message_key(row), []).append(row)
+
+    dispatcher = dispatcher or FCMDispatcher()
+    for duplicates in messages.values():
+        message = duplicates[0]
+        pks = [row.pk for row in duplicates]
+        try:
+            result = dispatch_notification(
+                message.title, message.body, course_id=message.course_id, data=message.data, dispatcher=dispatcher,
+            )
+        except Exception as exc:
+            _retry_later(pks, str(exc))
+            continue
+        if result.failed and not result.sent:
+            _retry_later(pks, f'Delivery failed for all {result.failed} recipients.', result.as_dict())
+            continue
+        NotificationOutbox.objects.filter(pk__in=pks).update(
+            status=NotificationOutbox.STATUS_SENT,
+            sent_at=timezone.now(),
+            result=dict(result.as_dict(), coalesced=len(pks)),
+        )
+    return len(rows)
+
+
+def _retry_later(pks, error, result=None):
+    # Release the lease so the next pass retries, until attempts run out.
+    NotificationOutbox.objects.filter(pk__in=pks).update(claimed_at=None, last_error=error, result=result)
+    NotificationOutbox.objects.filter(pk__in=pks, attempts__gte=MAX_ATTEMPTS).update(
+        status=NotificationOutbox.STATUS_FAILED,
+    )
@@ -0,0 +1,146 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are ordered on an indexed column tuple, e.g. (date, id), and the cursor
+holds the ordering values of the row a page starts after. A page is fetched
+with WHERE (date, id) < (cursor) ORDER BY date DESC, id DESC LIMIT n, so a
+deep page costs the same as the first one and rows inserted meanwhile never
+shift the pages already handed out.
+"""
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        # isoformat keeps microseconds; DjangoJSONEncoder would drop them.
+        return value.isoformat()
+    return value
+
+
+def _reverse_ordering(ordering):
+    return tuple(name[1:] if name.startswith('-') else '-' + name for name in ordering)
+
+
+def keyset_filter(ordering, values):
+    """Q for the rows that come after values in ordering"""
+    after = None
+    for name, value in reversed(list(zip(ordering, values))):
+        field = name.lstrip('-')
+        strictly = Q(**{f"{field}__{'lt' if name.startswith('-') else 'gt'}": value})
+        after = strictly if after is None else strictly | (Q(**{field: value}) & after)
+
+    # Repeat the bound on the leading column alone so the index scan starts
+    # at the cursor instead of evaluating the OR for every row.
+    leading = ordering[0]
+    field = leading.lstrip('-')
+    return Q(**{f"{field}__{'lte' if leading.startswith('-') else 'gte'}": values[0]}) & after
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a composite ordering. Views set `ordering` to a
+    tuple of non-null columns that ends in a unique one, e.g. ('-date', '-id').
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('id',)
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'ordering', None) or self.ordering)
+
+    def get_page_size(self, request):
+        page_size = api_settings.PAGE_SIZE
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        if requested > 0:
+            page_size = min(requested, settings.API_MAX_PAGE_SIZE)
+        return page_size
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            values = [
+                model._meta.get_field(name.lstrip('-')).to_python(value)
+                for name, value in zip(self.ordering, values)
+            ]
+            return values, bool(payload.get('r'))
+        except (binascii.Error, KeyError, TypeError, ValueError, UnicodeEncodeError, ValidationError):
+            raise NotFound('Invalid cursor')
+
+    def encode_cursor(self, row, reverse=False):
+        payload = {'p': [_encode_value(getattr(row, name.lstrip('-'))) for name in self.ordering]}
+        if reverse:
+            payload['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(payload).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = self.get_ordering(view)
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request, queryset.model)
+
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(keyset_filter(ordering, values))
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = values is not None, has_more
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
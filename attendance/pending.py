@@ -0,0 +1,129 @@
+"""
+Background processing of PendingAttendance.
+
+A PendingAttendanceRun is queued by the API and drained by the
+process_pending_attendance command. Workers claim chunks of unsynced rows
+with SELECT ... FOR UPDATE SKIP LOCKED, so several of them can drain one run
+in parallel, and every chunk commits its results together with the run's
+progress. A worker that dies mid-chunk rolls back and its rows are claimed
+again by the next worker.
+"""
+import time
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import PendingAttendance, PendingAttendanceRun
+from .sync import BatchResolver, mark_present
+
+DEFAULT_CHUNK_SIZE = 200
+LOCKED_ROWS_POLL_SECONDS = 0.5
+
+
+def active_run():
+    return (
+        PendingAttendanceRun.objects
+        .exclude(status=PendingAttendanceRun.STATUS_FINISHED)
+        .order_by('created_at')
+        .first()
+    )
+
+
+def enqueue_run(requested_by=None):
+    """Return the run in progress, or queue a new one"""
+    run = active_run()
+    if run is not None:
+        return run
+    return PendingAttendanceRun.objects.create(
+        requested_by=requested_by,
+        total=PendingAttendance.objects.filter(synced=False).count(),
+    )
+
+
+def _claimable(run):
+    # Rows attempted since the run was queued already failed in this run.
+    return PendingAttendance.objects.filter(synced=False).filter(
+        Q(last_attempt_at__isnull=True) | Q(last_attempt_at__lt=run.created_at)
+    )
+
+
+def process_chunk(run, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Claim and resolve one chunk of the run. Returns (processed, failed), or
+    None once nothing is left to claim.
+    """
+    with transaction.atomic():
+        rows = list(
+            _claimable(run)
+            .select_for_update(skip_locked=True)
+            .order_by('id')[:chunk_size]
+        )
+        if not rows:
+            return None
+
+        resolver = BatchResolver((row.student_id, row.course_id, row.token) for row in rows)
+        now = timezone.now()
+        present = []
+        processed = 0
+        failed = 0
+        for row in rows:
+            row.attempts += 1
+            row.last_attempt_at = now
+            try:
+                present.append(resolver.resolve(row.student_id, row.course_id, row.token))
+            except Exception:
+                failed += 1
+                continue
+            row.synced = True
+            row.synced_at = now
+            processed += 1
+
+        mark_present(present)
+        PendingAttendance.objects.bulk_update(rows, ['synced', 'synced_at', 'attempts', 'last_attempt_at'])
+        PendingAttendanceRun.objects.filter(pk=run.pk).update(
+            processed=F('processed') + processed,
+            failed=F('failed') + failed,
+            updated_at=now,
+        )
+    return processed, failed
+
+
+def drain_run(run, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Process chunks until the run has nothing left, then mark it finished"""
+    now = timezone.now()
+    PendingAttendanceRun.objects.filter(pk=run.pk, status=PendingAttendanceRun.STATUS_QUEUED).update(
+        status=PendingAttendanceRun.STATUS_RUNNING,
+        started_at=now,
+        updated_at=now,
+    )
+    while True:
+        if process_chunk(run, chunk_size) is not None:
+            continue
+        if not _claimable(run).exists():
+            break
+        # Other workers still hold the remaining rows; wait for them to commit
+        # or, if they died, for their locks to be released.
+        time.sleep(LOCKED_ROWS_POLL_SECONDS)
+
+    now = timezone.now()
+    PendingAttendanceRun.objects.filter(pk=run.pk).exclude(status=PendingAttendanceRun.STATUS_FINISHED).update(
+        status=PendingAttendanceRun.STATUS_FINISHED,
+        finished_at=now,
+        updated_at=now,
+    )
+    run.refresh_from_db()
+    return run
+
+
+def run_progress(run):
+    return {
+        'run_id': run.pk,
+        'status': run.status,
+        'total': run.total,
+        'processed': run.processed,
+        'failed': run.failed,
+        'created_at': run.created_at,
+        'started_at': run.started_at,
+        'finished_at': run.finished_at,
+    }
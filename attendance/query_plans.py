@@ -0,0 +1,299 @@
+"""
+Query-plan regression check for the hot queries.
+
+seed_tables() fills the large tables with synthetic history spread over many
+courses, so the planner has realistic statistics to work with. hot_queries()
+builds each query the request paths run, and check_plans() runs EXPLAIN on
+every one and reports those that read a large table with a sequential scan
+instead of an index. The check_query_plans command seeds a database inside a
+transaction it rolls back, runs the check and fails when any plan regressed.
+"""
+import re
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import DateTimeField, Q
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import (
+    Attendance,
+    AttendanceToken,
+    CheckIn,
+    Course,
+    CourseEnrollment,
+    CourseSubscription,
+    DeviceToken,
+    Lecturer,
+    NotificationOutbox,
+    PendingAttendance,
+    Student,
+    SyncBatch,
+)
+
+SEED_BATCH_SIZE = 1000
+ROWS_PER_COURSE = 50
+STUDENTS = 200
+
+# Tables that grow with usage; a sequential scan of any of them is a regression.
+LARGE_MODELS = (
+    Attendance,
+    Attendance.present_students.through,
+    AttendanceToken,
+    CheckIn,
+    CourseEnrollment,
+    CourseSubscription,
+    DeviceToken,
+    NotificationOutbox,
+    PendingAttendance,
+    SyncBatch,
+)
+
+
+@dataclass
+class SeededData:
+    course_id: int
+    student_id: int
+    student_code: str
+    user_id: int
+    token: str
+    date: object
+
+
+def seed_tables(rows=5000, prefix=None):
+    """
+    Create about `rows` rows in each large table, spread over rows / 50
+    courses, and return sample values for the hot queries to filter on.
+    """
+    prefix = prefix or f'qp{uuid.uuid4().hex[:3]}'
+    now = timezone.now()
+    today = timezone.localdate()
+    course_count = max(rows // ROWS_PER_COURSE, 10)
+
+    lecturer_user = User.objects.create(username=f'{prefix}_lecturer')
+    lecturer = Lecturer.objects.create(user=lecturer_user, staff_id=f'{prefix}L', name=f'Query plans {prefix}')
+    Course.objects.bulk_create(
+        [
+            Course(name=f'Query plans {i}', course_code=f'{prefix}{i}', lecturer=lecturer)
+            for i in range(course_count)
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    course_ids = list(Course.objects.filter(lecturer=lecturer).order_by('pk').values_list('pk', flat=True))
+
+    usernames = [f'{prefix}_s{i}' for i in range(STUDENTS)]
+    User.objects.bulk_create([User(username=username) for username in usernames], batch_size=SEED_BATCH_SIZE)
+    user_ids = list(User.objects.filter(username__in=usernames).order_by('pk').values_list('pk', flat=True))
+    Student.objects.bulk_create(
+        [Student(user_id=user_id, student_id=f'{prefix}{i}', name=f'Student {i}') for i, user_id in enumerate(user_ids)],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    students = list(Student.objects.filter(user_id__in=user_ids).order_by('pk').values_list('pk', 'student_id'))
+
+    def student(i):
+        return students[i % len(students)]
+
+    def course(i):
+        return course_ids[i % course_count]
+
+    # Each course has a slice of the students, and each student a few courses.
+    per_course = min(max(rows // course_count, 1), len(students))
+    CourseEnrollment.objects.bulk_create(
+        [
+            CourseEnrollment(course_id=course_id, student_id=student(c * 7 + j)[0])
+            for c, course_id in enumerate(course_ids)
+            for j in range(per_course)
+        ],
+        batch_size=SEED_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+    # A session per course and day going back in time; today's are open.
+    Attendance.objects.bulk_create(
+        [
+            Attendance(course_id=course(i), date=today - timedelta(days=i // course_count), is_active=i < course_count)
+            for i in range(rows)
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    sessions = Attendance.objects.filter(course_id__in=course_ids)
+    # auto_now_add stamped every session with now; spread them like real ones.
+    sessions.update(created_at=Cast('date', DateTimeField()), updated_at=Cast('date', DateTimeField()))
+    Attendance.present_students.through.objects.bulk_create(
+        [
+            Attendance.present_students.through(attendance_id=attendance_id, student_id=student(i)[0])
+            for i, attendance_id in enumerate(sessions.values_list('pk', flat=True))
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+
+    # Expired tokens of past sessions, plus one active token per course.
+    AttendanceToken.objects.bulk_create(
+        [
+            AttendanceToken(
+                course_id=course(i),
+                token=f'{i:06X}'[-6:],
+                generated_at=now - timedelta(days=i // course_count + 1),
+                expires_at=now - timedelta(days=i // course_count + 1) + timedelta(hours=4),
+                is_active=False,
+            )
+            for i in range(rows)
+        ]
+        + [
+            AttendanceToken(course_id=course_id, token=f'{prefix[-2:]}{c:04X}'.upper()[-6:],
+                            generated_at=now, expires_at=now + timedelta(hours=4))
+            for c, course_id in enumerate(course_ids)
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    token = AttendanceToken.objects.filter(course_id=course_ids[0], is_active=True).values_list('token', flat=True)[0]
+
+    # Mostly synced offline records and flushed check-ins, a few outstanding.
+    PendingAttendance.objects.bulk_create(
+        [
+            PendingAttendance(
+                student_id=student(i)[1],
+                course_id=course(i),
+                token=f'{i:06X}'[-6:],
+                timestamp=now - timedelta(minutes=i),
+                record_key=f'{prefix}-record-{i}',
+                synced=i % 100 != 0,
+            )
+            for i in range(rows)
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    CheckIn.objects.bulk_create(
+        [
+            CheckIn(
+                course_id=course(i),
+                student_id=student(i)[0],
+                date=today - timedelta(days=i // course_count),
+                flushed_at=now if i % 100 else None,
+            )
+            for i in range(rows)
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+
+    subscriptions = min(rows // len(user_ids), course_count)
+    CourseSubscription.objects.bulk_create(
+        [
+            CourseSubscription(user_id=user_id, course_id=course(u + j))
+            for u, user_id in enumerate(user_ids)
+            for j in range(subscriptions)
+        ],
+        batch_size=SEED_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    DeviceToken.objects.bulk_create(
+        [DeviceToken(user_id=user_ids[i % len(user_ids)], token=f'{prefix}-device-{i}') for i in range(rows)],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    SyncBatch.objects.bulk_create(
+        [
+            SyncBatch(user_id=user_ids[i % len(user_ids)], key=f'{prefix}-upload-{i}', request_hash='', response={})
+            for i in range(rows)
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    NotificationOutbox.objects.bulk_create(
+        [
+            NotificationOutbox(
+                course_id=course(i),
+                title='Query plans',
+                body='Seeded',
+                status=NotificationOutbox.STATUS_QUEUED if i % 100 == 0 else NotificationOutbox.STATUS_SENT,
+            )
+            for i in range(rows)
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    student_pk, student_code = students[0]
+    return SeededData(
+        course_id=course_ids[0],
+        student_id=student_pk,
+        student_code=student_code,
+        user_id=user_ids[0],
+        token=token,
+        date=today,
+    )
+
+
+def hot_queries(data):
+    """The hot queries by name, filtering on the seeded sample values"""
+    now = timezone.now()
+    return {
+        # take_attendance, submit-location, lecturer dashboard
+        'session_of_the_day': Attendance.objects.filter(course_id=data.course_id, date=data.date),
+        # end_attendance, sync
+        'open_session': Attendance.objects.filter(course_id=data.course_id, is_active=True).order_by('-date')[:1],
+        'open_sessions_of_courses': Attendance.objects.filter(course_id__in=[data.course_id], is_active=True),
+        # admin dashboard
+        'sessions_today': Attendance.objects.filter(date=data.date),
+        'recent_sessions': Attendance.objects.filter(created_at__gte=now - timedelta(days=7)),
+        'course_sessions_in_range': Attendance.objects.filter(
+            course_id=data.course_id, date__gte=data.date - timedelta(days=30), date__lte=data.date,
+        ),
+        'present_students': Attendance.present_students.through.objects.filter(
+            attendance_id__in=Attendance.objects.filter(course_id=data.course_id, date=data.date).values('pk'),
+        ),
+        # check-in token resolution, offline sync
+        'active_token': AttendanceToken.objects.filter(token=data.token, is_active=True, expires_at__gt=now),
+        'expired_tokens': AttendanceToken.objects.filter(is_active=True).filter(
+            Q(expires_at__lte=now) | Q(expires_at__isnull=True)
+        ),
+        'enrollment': CourseEnrollment.objects.filter(course_id=data.course_id, student_id=data.student_id),
+        'course_roster': CourseEnrollment.objects.filter(course_id=data.course_id).values_list('student_id'),
+        'student_courses': CourseEnrollment.objects.filter(student_id=data.student_id).values_list('course_id'),
+        # offline sync
+        'pending_backlog': PendingAttendance.objects.filter(synced=False).order_by('-timestamp', '-id')[:50],
+        'pending_claim': PendingAttendance.objects.filter(synced=False).filter(
+            Q(last_attempt_at__isnull=True) | Q(last_attempt_at__lt=now)
+        ).order_by('id')[:500],
+        'pending_of_student': PendingAttendance.objects.filter(
+            student_id=data.student_code, course_id=data.course_id, token=data.token,
+        ),
+        'retried_records': PendingAttendance.objects.filter(record_key__in=['retried-1', 'retried-2']),
+        'replayed_upload': SyncBatch.objects.filter(user_id=data.user_id, key='retried-upload'),
+        'expired_sync_batches': SyncBatch.objects.filter(
+            created_at__lte=now - timedelta(days=7),
+        ).order_by('created_at', 'id')[:1000],
+        # write-behind check-ins
+        'unflushed_checkins': CheckIn.objects.filter(flushed_at__isnull=True).order_by('id')[:500],
+        # notifications
+        'course_subscribers': CourseSubscription.objects.filter(course_id=data.course_id).values_list('user_id'),
+        'device_tokens': DeviceToken.objects.filter(user_id=data.user_id).values_list('token'),
+        'queued_notifications': NotificationOutbox.objects.filter(
+            status=NotificationOutbox.STATUS_QUEUED,
+        ).order_by('id')[:100],
+    }
+
+
+def sequential_scans(plan, tables):
+    """The tables out of `tables` that an EXPLAIN plan reads sequentially"""
+    if connection.vendor == 'postgresql':
+        scanned = re.findall(r'Seq Scan on (\w+)', plan)
+    elif connection.vendor == 'sqlite':
+        # "SCAN table" without "USING ... INDEX" reads the whole table.
+        scanned = re.findall(r'\bSCAN (\w+)(?! USING)', plan)
+    else:
+        raise NotImplementedError(f'Query plans cannot be checked on {connection.vendor}.')
+    return sorted({table for table in scanned if table in tables})
+
+
+def check_plans(data):
+    """Return {name: (plan, sequentially scanned large tables)} for every hot query"""
+    tables = {model._meta.db_table for model in LARGE_MODELS}
+    results = {}
+    for name, queryset in hot_queries(data).items():
+        plan = queryset.explain()
+        results[name] = (plan, sequential_scans(plan, tables))
+    return results
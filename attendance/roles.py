@@ -0,0 +1,74 @@
+"""
+Role lookups on a user.
+
+RoleAwareBackend loads the student and lecturer profiles and the API token
+together with the user, so these helpers answer from the loaded relations
+without further queries, and the role is remembered on the user object for
+the rest of the request.
+"""
+from django.core.exceptions import ObjectDoesNotExist
+from rest_framework.authtoken.models import Token
+
+ROLE_STUDENT = 'student'
+ROLE_LECTURER = 'lecturer'
+ROLE_ATTRIBUTE = '_attendance_role'
+# (student pk, lecturer pk) set by authenticators that know them without a query
+PROFILE_IDS_ATTRIBUTE = '_attendance_profile_ids'
+
+
+def _related(user, name):
+    try:
+        return getattr(user, name)
+    except ObjectDoesNotExist:
+        return None
+
+
+def student_profile(user):
+    return _related(user, 'student')
+
+
+def lecturer_profile(user):
+    return _related(user, 'lecturer')
+
+
+def student_pk(user):
+    """Primary key of the user's Student, or None; no query for users from the token cache"""
+    ids = getattr(user, PROFILE_IDS_ATTRIBUTE, None)
+    if ids is not None:
+        return ids[0]
+    student = student_profile(user)
+    return student.pk if student is not None else None
+
+
+def lecturer_pk(user):
+    ids = getattr(user, PROFILE_IDS_ATTRIBUTE, None)
+    if ids is not None:
+        return ids[1]
+    lecturer = lecturer_profile(user)
+    return lecturer.pk if lecturer is not None else None
+
+
+def user_role(user):
+    """
+    ROLE_LECTURER, ROLE_STUDENT or None for other users (e.g. admins). A user
+    with both profiles is a lecturer, as /api/auth/token/ has always reported;
+    endpoints that put students first check student_pk() themselves.
+    """
+    if not hasattr(user, ROLE_ATTRIBUTE):
+        if lecturer_profile(user) is not None:
+            role = ROLE_LECTURER
+        elif student_profile(user) is not None:
+            role = ROLE_STUDENT
+        else:
+            role = None
+        setattr(user, ROLE_ATTRIBUTE, role)
+    return getattr(user, ROLE_ATTRIBUTE)
+
+
+def auth_token_for(user):
+    """The user's API token, created on first login"""
+    token = _related(user, 'auth_token')
+    if token is None:
+        token, _ = Token.objects.get_or_create(user=user)
+        user.auth_token = token
+    return token
@@ -1,22 +1,27 @@
 from rest_framework import serializers
+from .expansion import ExpandableFieldsMixin
 from .models import Lecturer, Student, Course, CourseEnrollment, Attendance, AttendanceToken
 from django.contrib.auth.models import User
 
 # User serializer
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
 
 # Lecturer serializer
-class LecturerSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+class LecturerSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
     courses = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     profile_picture = serializers.SerializerMethodField()  # Use SerializerMethodField
 
     class Meta:
         model = Lecturer
         fields = ['id', 'user', 'staff_id', 'name', 'profile_picture', 'courses', 'department', 'phone_number', 'latitude', 'longitude']
+        expandable_fields = {
+            'user': ('attendance.serializers.UserSerializer', False),
+            'courses': ('attendance.serializers.CourseSerializer', True),
+        }
 
     def get_profile_picture(self, obj):
         request = self.context.get('request')
@@ -25,14 +30,18 @@ class LecturerSerializer(serializers.ModelSerializer):
         return None
 
 # Student serializer
-class StudentSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+class StudentSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
     courses = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     profile_picture = serializers.SerializerMethodField()  # Use SerializerMethodField
 
     class Meta:
         model = Student
         fields = ['id', 'user', 'student_id', 'name', 'courses', 'profile_picture', 'programme_of_study', 'year', 'phone_number']
+        expandable_fields = {
+            'user': ('attendance.serializers.UserSerializer', False),
+            'courses': ('attendance.serializers.CourseSerializer', True),
+        }
 
     def get_profile_picture(self, obj):
         request = self.context.get('request')
@@ -41,13 +50,17 @@ class StudentSerializer(serializers.ModelSerializer):
         return None
 
 # Course serializer
-class CourseSerializer(serializers.ModelSerializer):
-    lecturer = LecturerSerializer(read_only=True)  # Use nested LecturerSerializer
-    students = StudentSerializer(many=True, read_only=True)  # Use nested StudentSerializer
+class CourseSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    lecturer = serializers.PrimaryKeyRelatedField(read_only=True)  # ?expand=lecturer for the full object
+    students = serializers.PrimaryKeyRelatedField(many=True, read_only=True)  # ?expand=students
 
     class Meta:
         model = Course
         fields = ['id', 'name', 'course_code', 'lecturer', 'students']
+        expandable_fields = {
+            'lecturer': ('attendance.serializers.LecturerSerializer', False),
+            'students': ('attendance.serializers.StudentSerializer', True),
+        }
 
 # Course Enrollment serializer
 class CourseEnrollmentSerializer(serializers.ModelSerializer):
@@ -59,21 +72,50 @@ class CourseEnrollmentSerializer(serializers.ModelSerializer):
         fields = ['course', 'student', 'enrolled_at']
 
 # Attendance serializer
-class AttendanceSerializer(serializers.ModelSerializer):
-    course = CourseSerializer(read_only=True)
-    present_students = StudentSerializer(many=True, read_only=True)
+class AttendanceSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    OPEN_SESSION_EXISTS = 'This course already has an open attendance session.'
+
+    course = serializers.PrimaryKeyRelatedField(queryset=Course.objects.only('pk'))
+    present_students = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
 
     class Meta:
         model = Attendance
-        fields = ['id', 'course', 'date', 'present_students', 'lecturer_latitude', 'lecturer_longitude', 'is_active', 'ended_at']
+        fields = ['id', 'course', 'date', 'present_students', 'present_count', 'enrolled_count', 'lecturer_latitude', 'lecturer_longitude', 'is_active', 'ended_at']
+        read_only_fields = ['present_count', 'enrolled_count']
+        expandable_fields = {
+            'course': ('attendance.serializers.CourseSerializer', False),
+            'present_students': ('attendance.serializers.StudentSerializer', True),
+        }
+
+    def validate(self, attrs):
+        instance = self.instance
+        course = attrs.get('course')
+        if instance is not None and course is not None and course.pk != instance.course_id:
+            raise serializers.ValidationError({'course': 'A session cannot be moved to another course.'})
+        course_id = course.pk if course is not None else instance.course_id
+        # Attendance.save() closes a session that has ended_at.
+        is_active = attrs.get('is_active', instance.is_active if instance is not None else True)
+        ended_at = attrs.get('ended_at', instance.ended_at if instance is not None else None)
+        if is_active and ended_at is None:
+            # attendance_open_session_unique allows one per course; the view
+            # answers the same when a concurrent request wins the race.
+            others = Attendance.objects.filter(course_id=course_id, is_active=True)
+            if instance is not None:
+                others = others.exclude(pk=instance.pk)
+            if others.exists():
+                raise serializers.ValidationError({'course': self.OPEN_SESSION_EXISTS})
+        return attrs
 
 # Attendance token serializer
-class AttendanceTokenSerializer(serializers.ModelSerializer):
-    course = CourseSerializer(read_only=True)
+class AttendanceTokenSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    course = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
         model = AttendanceToken
         fields = ['id', 'course', 'token', 'generated_at', 'expires_at', 'is_active']
+        expandable_fields = {
+            'course': ('attendance.serializers.CourseSerializer', False),
+        }
 
 # Logout serializer
 class LogoutSerializer(serializers.Serializer):
@@ -164,3 +206,47 @@ class AttendanceHistoryItemSerializer(serializers.Serializer):
 class AttendanceHistoryByCourseSerializer(serializers.Serializer):
     course_code = serializers.CharField()
     attendances = AttendanceHistoryItemSerializer(many=True)
+
+
+class StudentHistoryEntrySerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    date = serializers.CharField()
+
+
+class StudentHistoryByCourseSerializer(serializers.Serializer):
+    course_id = serializers.IntegerField()
+    course_code = serializers.CharField()
+    session_count = serializers.IntegerField()
+    present_count = serializers.IntegerField()
+    attendance_rate = serializers.FloatField()
+    attendances = StudentHistoryEntrySerializer(many=True)
+    absences = StudentHistoryEntrySerializer(many=True)
+
+
+class DashboardTokenSerializer(serializers.Serializer):
+    token = serializers.CharField()
+    expires_at = serializers.DateTimeField(allow_null=True)
+    status = serializers.ChoiceField(choices=['active', 'expired', 'inactive'])
+
+
+class DashboardSessionSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    date = serializers.DateField()
+    is_active = serializers.BooleanField()
+    started_at = serializers.DateTimeField()
+    ended_at = serializers.DateTimeField(allow_null=True)
+    present_count = serializers.IntegerField()
+    enrolled_count = serializers.IntegerField()
+    attendance_rate = serializers.FloatField()
+
+
+class LecturerDashboardCourseSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    course_code = serializers.CharField()
+    name = serializers.CharField()
+    session_count = serializers.IntegerField()
+    present_total = serializers.IntegerField()
+    enrolled_total = serializers.IntegerField()
+    attendance_rate = serializers.FloatField()
+    token = DashboardTokenSerializer(allow_null=True)
+    sessions = DashboardSessionSerializer(many=True)
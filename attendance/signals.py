@@ -0,0 +1,155 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget_token_version, revoke_token, revoke_user_jwts, revoke_user_tokens
+from .counters import refresh_enrolled_counts, refresh_present_counts
+from .conditional import COURSE_NAMESPACE, LECTURER_NAMESPACE, STUDENT_NAMESPACE, USER_NAMESPACE, invalidate
+from .enrollment import invalidate_enrollment
+from .models import Attendance, AttendanceToken, AuthTokenVersion, Course, CourseEnrollment, Lecturer, Student
+from .token_cache import invalidate_course_tokens, invalidate_token
+
+
+@receiver(post_delete, sender=AttendanceToken)
+def attendance_token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.token)
+    invalidate(COURSE_NAMESPACE, [instance.course_id])
+
+
+@receiver(post_save, sender=AttendanceToken)
+def attendance_token_saved(sender, instance, **kwargs):
+    # The lecturer dashboard shows the course's token state.
+    invalidate(COURSE_NAMESPACE, [instance.course_id])
+
+
+@receiver(post_save, sender=Course)
+def course_saved(sender, instance, created, **kwargs):
+    invalidate(LECTURER_NAMESPACE, [instance.lecturer_id])
+    if not created:
+        invalidate_course_tokens(course_id=instance.pk)
+        invalidate(COURSE_NAMESPACE, [instance.pk])
+
+
+@receiver(post_delete, sender=Course)
+def course_deleted(sender, instance, **kwargs):
+    invalidate(LECTURER_NAMESPACE, [instance.lecturer_id])
+
+
+@receiver(post_save, sender=Lecturer)
+def lecturer_saved(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_course_tokens(lecturer_id=instance.pk)
+
+
+def _course_roster_changed(course_id):
+    invalidate_enrollment(course_id)
+    refresh_enrolled_counts(course_id=course_id)
+    # Enrolled counts of the course's open sessions just changed.
+    invalidate(COURSE_NAMESPACE, [course_id])
+
+
+@receiver(post_save, sender=CourseEnrollment)
+@receiver(post_delete, sender=CourseEnrollment)
+def enrollment_changed(sender, instance, **kwargs):
+    _course_roster_changed(instance.course_id)
+    invalidate(STUDENT_NAMESPACE, [instance.student_id])
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def course_students_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # course.students.add()/remove()/clear() bulk-write CourseEnrollment rows
+    # without post_save, so the index is invalidated from here as well.
+    if action == 'pre_clear' and reverse:
+        instance._cleared_course_ids = list(
+            CourseEnrollment.objects.filter(student=instance).values_list('course_id', flat=True)
+        )
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        _course_roster_changed(instance.pk)
+        # Students cleared from a course are not known here; the course's
+        # version, bumped above, covers them.
+        invalidate(STUDENT_NAMESPACE, pk_set or ())
+        return
+    invalidate(STUDENT_NAMESPACE, [instance.pk])
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_course_ids', ())
+    for course_id in pk_set or ():
+        _course_roster_changed(course_id)
+
+
+@receiver(post_save, sender=Attendance)
+def attendance_saved(sender, instance, created, **kwargs):
+    if created:
+        refresh_enrolled_counts(attendance_ids=[instance.pk])
+    invalidate(COURSE_NAMESPACE, [instance.course_id])
+
+
+@receiver(post_delete, sender=Attendance)
+def attendance_deleted(sender, instance, **kwargs):
+    invalidate(COURSE_NAMESPACE, [instance.course_id])
+
+
+@receiver(m2m_changed, sender=Attendance.present_students.through)
+def present_students_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._cleared_attendance_ids = list(instance.attended_classes.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        refresh_present_counts([instance.pk])
+        invalidate(COURSE_NAMESPACE, [instance.course_id])
+        return
+    invalidate(STUDENT_NAMESPACE, [instance.pk])
+    if action == 'post_clear':
+        refresh_present_counts(getattr(instance, '_cleared_attendance_ids', ()))
+    else:
+        refresh_present_counts(pk_set or ())
+
+
+@receiver(post_delete, sender=Token)
+def auth_token_deleted(sender, instance, **kwargs):
+    revoke_token(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Covers deactivation as well as any change to what the cache holds.
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    invalidate(USER_NAMESPACE, [instance.pk])
+    revoke_user_tokens(instance.pk)
+    # JWTs only carry the id; they are revoked when the account is disabled
+    # or its password changes (set_password() leaves _password set until
+    # after post_save).
+    if not instance.is_active or getattr(instance, '_password', None) is not None:
+        revoke_user_jwts(instance.pk)
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_save, sender=Lecturer)
+@receiver(post_delete, sender=Student)
+@receiver(post_delete, sender=Lecturer)
+def profile_changed(sender, instance, created=True, **kwargs):
+    # Profiles show in me/profile/ and in courses expanded with them.
+    invalidate(USER_NAMESPACE, [instance.user_id])
+    if sender is Student:
+        invalidate(STUDENT_NAMESPACE, [instance.pk])
+        courses = CourseEnrollment.objects.filter(student_id=instance.pk).values_list('course_id', flat=True)
+    else:
+        invalidate(LECTURER_NAMESPACE, [instance.pk])
+        courses = Course.objects.filter(lecturer_id=instance.pk).values_list('pk', flat=True)
+    invalidate(COURSE_NAMESPACE, courses)
+    # Cached tokens and JWTs hold the user's role and profile id.
+    if created:
+        revoke_user_tokens(instance.user_id)
+        revoke_user_jwts(instance.user_id)
+
+
+@receiver(post_delete, sender=AuthTokenVersion)
+def token_version_deleted(sender, instance, **kwargs):
+    # Deleting a user cascades here; their JWTs must stop resolving at once.
+    forget_token_version(instance.user_id)
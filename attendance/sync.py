@@ -0,0 +1,314 @@
+"""
+Set-based processing of offline attendance records.
+
+A device upload can hold hundreds of records. Instead of a handful of
+queries per record, every token, student and open session referenced by the
+batch is looked up with one IN query each, present students are written with
+a single bulk insert into the attendance/student link table, and every record
+is bulk-inserted into PendingAttendance: synced for the students marked
+present, pending for the rest.
+
+Devices retry uploads on flaky networks. Each record carries an idempotency
+key (see record_key()) backed by a unique index, so a record is stored once
+however often it arrives, and an upload sent with an Idempotency-Key header
+is answered from its stored response when it is retried (sync_upload()).
+Stored responses are kept for SYNC_BATCH_TTL_SECONDS and then deleted by
+sweep_sync_batches(); a retry after that is processed again, and the record
+keys still keep it from storing anything twice.
+"""
+import hashlib
+import json
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models.query import MAX_GET_RESULTS
+from django.utils import timezone
+
+from .conditional import invalidate_sessions
+from .counters import refresh_present_counts
+from .models import Attendance, AttendanceToken, PendingAttendance, Student, SyncBatch
+
+PresentStudent = Attendance.present_students.through
+RECORD_KEY_FIELDS = ('student_id', 'course_id', 'token', 'latitude', 'longitude', 'timestamp', 'device_id')
+IDEMPOTENCY_KEY_MAX_LENGTH = SyncBatch._meta.get_field('key').max_length
+REPLAYED_HEADER = 'Idempotent-Replayed'
+DEFAULT_SWEEP_CHUNK_SIZE = 1000
+
+
+class IdempotencyKeyReused(Exception):
+    """An Idempotency-Key came with different records than the upload it was first used for"""
+
+
+def _course_pk(course_id):
+    # Same coercion (and error message) the ORM applies to course_id filters.
+    return PendingAttendance._meta.get_field('course_id').get_prep_value(course_id)
+
+
+def _text(value):
+    return str(value) if value is not None else None
+
+
+class BatchResolver:
+    """
+    Resolves (student_id, course_id, token) triples against active tokens,
+    students and open sessions with one query per table. resolve() raises
+    the same exceptions the equivalent per-row get() calls would.
+    """
+
+    def __init__(self, triples):
+        triples = [(student_id, course_id, token) for student_id, course_id, token in triples]
+        tokens = {token for _, _, token in triples if token is not None}
+        student_ids = {student_id for student_id, _, _ in triples if student_id is not None}
+        course_ids = {course_id for _, course_id, _ in triples if course_id is not None}
+
+        self.active_tokens = set(
+            AttendanceToken.objects.filter(
+                token__in=tokens, course_id__in=course_ids, is_active=True, expires_at__gt=timezone.now(),
+            )
+            .values_list('token', 'course_id')
+        )
+        self.students = dict(
+            Student.objects.filter(student_id__in=student_ids).values_list('student_id', 'id')
+        )
+        self.sessions = defaultdict(list)
+        open_courses = {course_id for _, course_id in self.active_tokens}
+        for course_id, attendance_id in (
+            Attendance.objects.filter(course_id__in=open_courses, is_active=True)
+            .values_list('course_id', 'id')
+        ):
+            self.sessions[course_id].append(attendance_id)
+
+    def resolve(self, student_id, course_id, token):
+        """Return (attendance_id, student_pk) for a record that can be marked present"""
+        if (token, course_id) not in self.active_tokens:
+            raise AttendanceToken.DoesNotExist('AttendanceToken matching query does not exist.')
+
+        student_pk = self.students.get(student_id)
+        if student_pk is None:
+            raise Student.DoesNotExist('Student matching query does not exist.')
+
+        sessions = self.sessions.get(course_id, [])
+        if not sessions:
+            raise Attendance.DoesNotExist('Attendance matching query does not exist.')
+        if len(sessions) > 1:
+            count = len(sessions)
+            raise Attendance.MultipleObjectsReturned(
+                "get() returned more than one Attendance -- it returned %s!"
+                % (count if count < MAX_GET_RESULTS else 'more than %s' % (MAX_GET_RESULTS - 1))
+            )
+        return sessions[0], student_pk
+
+
+def mark_present(pairs):
+    """Insert (attendance_id, student_pk) links in one statement, skipping existing ones"""
+    links = {(attendance_id, student_pk) for attendance_id, student_pk in pairs}
+    PresentStudent.objects.bulk_create(
+        [PresentStudent(attendance_id=attendance_id, student_id=student_pk) for attendance_id, student_pk in links],
+        ignore_conflicts=True,
+    )
+    attendance_ids = {attendance_id for attendance_id, _ in links}
+    refresh_present_counts(attendance_ids)
+    # bulk_create sends no m2m_changed, see signals.present_students_changed.
+    invalidate_sessions(attendance_ids)
+
+
+def record_key(record, fields):
+    """
+    Idempotency key of an uploaded record: device_id and the client's
+    record_id when the app sends both, otherwise the record's content.
+    """
+    client_id = record.get('record_id')
+    if fields['device_id'] and client_id not in (None, ''):
+        source = f"{fields['device_id']}\x1f{client_id}"
+    else:
+        source = json.dumps([fields[name] for name in RECORD_KEY_FIELDS], default=str)
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def ingest_records(records):
+    """
+    Process a batch of offline records. Returns (synced_count, pending_count,
+    duplicate_count, errors) with the same per-record outcome as handling them
+    one by one; every record is counted in exactly one of them.
+    """
+    synced_count = 0
+    pending_count = 0
+    duplicate_count = 0
+    errors = []
+    now = timezone.now()
+
+    parsed = []
+    for index, record in enumerate(records):
+        try:
+            fields = {
+                'student_id': _text(record.get('student_id')),
+                'course_id': _course_pk(record.get('course_id')),
+                'token': _text(record.get('token')),
+                'latitude': record.get('latitude'),
+                'longitude': record.get('longitude'),
+                'timestamp': record.get('timestamp'),
+                'device_id': record.get('device_id'),
+            }
+            fields['record_key'] = record_key(record, fields)
+            parsed.append((index, record, fields))
+        except Exception as e:
+            errors.append((index, {'record': record, 'error': str(e)}))
+
+    # Records a retried upload already stored, found through the unique
+    # index on record_key, and repeats within this upload are skipped.
+    keys = [fields['record_key'] for _, _, fields in parsed]
+    seen = set(PendingAttendance.objects.filter(record_key__in=keys).values_list('record_key', flat=True))
+    triples = [(fields['student_id'], fields['course_id'], fields['token']) for _, _, fields in parsed]
+
+    resolver = BatchResolver(triples)
+    rows = []
+    links = {}
+    for index, record, fields in parsed:
+        if fields['record_key'] in seen:
+            duplicate_count += 1
+            continue
+        seen.add(fields['record_key'])
+
+        # Records marked present keep a synced row too, so their key stops a
+        # retry from counting them again.
+        try:
+            links[index] = resolver.resolve(fields['student_id'], fields['course_id'], fields['token'])
+            rows.append((index, record, PendingAttendance(synced=True, synced_at=now, **fields)))
+        except (AttendanceToken.DoesNotExist, Student.DoesNotExist, Attendance.DoesNotExist):
+            rows.append((index, record, PendingAttendance(synced=False, **fields)))
+        except Exception as e:
+            errors.append((index, {'record': record, 'error': str(e)}))
+
+    present = []
+    with transaction.atomic():
+        inserted, unstored = _store_records(rows)
+        for index, record, row in rows:
+            if index in unstored and index in links:
+                # The student is marked present all the same; only the key
+                # could not be kept.
+                present.append(links[index])
+                synced_count += 1
+            elif index in unstored:
+                errors.append((index, {'record': record, 'error': unstored[index]}))
+            elif index not in inserted:
+                duplicate_count += 1
+            elif index in links:
+                present.append(links[index])
+                synced_count += 1
+            else:
+                pending_count += 1
+        if present:
+            mark_present(present)
+    errors.sort(key=lambda item: item[0])
+    return synced_count, pending_count, duplicate_count, [error for _, error in errors]
+
+
+def _insert_records(rows):
+    """Insert (index, row) pairs whose record_key is not stored yet; returns the inserted indexes"""
+    stored = set(
+        PendingAttendance.objects.filter(record_key__in=[row.record_key for _, row in rows])
+        .values_list('record_key', flat=True)
+    )
+    PendingAttendance.objects.bulk_create([row for _, row in rows], ignore_conflicts=True)
+    return {index for index, row in rows if row.record_key not in stored}
+
+
+def _store_records(rows):
+    """Store (index, record, row) rows; returns (inserted indexes, {index: error} for rows that failed)"""
+    if not rows:
+        return set(), {}
+    # ignore_conflicts: a concurrent retry of the same upload may have stored
+    # some of the keys since they were looked up. Those rows are not inserted
+    # and count as duplicates.
+    try:
+        with transaction.atomic():
+            return _insert_records([(index, row) for index, _, row in rows]), {}
+    except Exception:
+        pass
+
+    # Some row is invalid; store the rest one by one and report the bad ones.
+    inserted = set()
+    errors = {}
+    for index, record, row in rows:
+        try:
+            with transaction.atomic():
+                inserted |= _insert_records([(index, row)])
+        except Exception as e:
+            errors[index] = str(e)
+    return inserted, errors
+
+
+def _request_hash(records):
+    return hashlib.sha256(json.dumps(records, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def sync_upload(user_id, records, idempotency_key=None):
+    """
+    Ingest an upload and return (response data, replayed). With an
+    idempotency key the response is stored with the upload, and a retry with
+    the same key gets it back from the unique (user, key) index without any
+    record being processed again.
+    """
+    if not idempotency_key:
+        return _upload_response(records), False
+
+    request_hash = _request_hash(records)
+    batch = SyncBatch.objects.filter(user_id=user_id, key=idempotency_key).first()
+    if batch is None:
+        try:
+            with transaction.atomic():
+                response = _upload_response(records)
+                SyncBatch.objects.create(
+                    user_id=user_id, key=idempotency_key, request_hash=request_hash, response=response,
+                )
+            return response, False
+        except IntegrityError:
+            # A concurrent retry stored it first; this attempt was rolled back.
+            batch = SyncBatch.objects.get(user_id=user_id, key=idempotency_key)
+
+    if batch.request_hash != request_hash:
+        raise IdempotencyKeyReused('Idempotency-Key was already used for a different upload.')
+    return batch.response, True
+
+
+def _upload_response(records):
+    synced_count, pending_count, duplicate_count, errors = ingest_records(records)
+    return {
+        'synced': synced_count,
+        'pending': pending_count,
+        'duplicates': duplicate_count,
+        'total': len(records),
+        'errors': errors if errors else None,
+    }
+
+
+def expired_sync_batches(now=None):
+    """Stored upload responses older than SYNC_BATCH_TTL_SECONDS"""
+    now = now or timezone.now()
+    return SyncBatch.objects.filter(created_at__lte=now - timedelta(seconds=settings.SYNC_BATCH_TTL_SECONDS))
+
+
+def sweep_sync_batches(chunk_size=DEFAULT_SWEEP_CHUNK_SIZE):
+    """
+    Delete every expired upload response, chunk by chunk, skipping rows
+    another sweeper holds. Does nothing when SYNC_BATCH_TTL_SECONDS is 0.
+    """
+    if settings.SYNC_BATCH_TTL_SECONDS <= 0:
+        return 0
+    now = timezone.now()
+    total = 0
+    while True:
+        with transaction.atomic():
+            pks = list(
+                expired_sync_batches(now)
+                .select_for_update(skip_locked=True)
+                .order_by('created_at', 'id')
+                .values_list('id', flat=True)[:chunk_size]
+            )
+            if pks:
+                SyncBatch.objects.filter(pk__in=pks).delete()
+        total += len(pks)
+        if len(pks) < chunk_size:
+            return total
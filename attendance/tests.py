@@ -1,7 +1,66 @@
+import contextlib
+import csv
+import io
+import json
+import os
+import random
+import threading
+from unittest import mock
+
+from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from rest_framework.test import APITestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.test import AsyncRequestFactory, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from geopy.distance import geodesic
+from openpyxl import load_workbook
+from prometheus_client import REGISTRY
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase, APITransactionTestCase
 
-from attendance.models import Lecturer, Student
+from attendance.models import (
+	Attendance,
+	AttendanceToken,
+	CheckIn,
+	Course,
+	CourseEnrollment,
+	CourseSubscription,
+	DeviceToken,
+	Lecturer,
+	NotificationOutbox,
+	PendingAttendance,
+	PendingAttendanceRun,
+	Student,
+	SyncBatch,
+)
+from attendance import async_views
+from attendance.authentication import CachedTokenAuthentication, HeaderSchemeAuthentication
+from attendance.checkins import check_in
+from attendance.conditional import LECTURER_NAMESPACE
+from attendance.counters import snapshot_counts
+from attendance.exports import roster_rows
+from attendance.fcm_stub import StubFCMServer
+from attendance.local_cache import ProcessLocalCache
+from attendance.metrics import QueryCounter
+from attendance.notifications import FCMDispatcher, dispatch_notification
+from attendance.outbox import MAX_ATTEMPTS, drain_outbox
+from attendance.pending import drain_run, enqueue_run, process_chunk
+from attendance.query_plans import sequential_scans
+from attendance.sync import _store_records, ingest_records
+from attendance.enrollment import is_enrolled
+from attendance.geofence import (
+	FastGeofenceEngine,
+	GeodesicGeofenceEngine,
+	validate_geofence,
+	validate_geofence_batch,
+)
+from attendance.roles import student_pk, user_role
+from attendance.token_cache import resolve_active_token
+from attendance.versioning import get_version
 
 
 class HealthVersionTests(APITestCase):
@@ -56,3 +115,1259 @@ class MobileLoginTests(APITestCase):
 		body = response.json()
 		self.assertEqual(body.get('role'), 'staff')
 		self.assertIn('token', body)
+
+	def test_login_is_one_query_and_one_hash(self):
+		credentials = {'username': 'student_user_test', 'password': 'ChangeMe123!', 'student_id': 'S1001'}
+		first = self.client.post('/api/login/', credentials, format='json').json()
+		with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.verify', return_value=True) as verify:
+			with self.assertNumQueries(1):
+				response = self.client.post('/api/login/', credentials, format='json')
+		self.assertEqual(verify.call_count, 1)
+		self.assertEqual(response.json()['token'], first['token'])
+
+	def test_user_with_both_profiles_keeps_each_endpoints_role(self):
+		Student.objects.create(user=self.staff_user, student_id='S1002', name='Staff Student')
+		password = 'ChangeMe123!'
+		tokens = self.client.post('/api/auth/token/', {'username': 'staff_user_test', 'password': password}, format='json')
+		self.assertEqual(tokens.json()['role'], 'lecturer')
+
+		mobile = {'username': 'staff_user_test', 'password': password, 'student_id': 'S1002'}
+		self.assertEqual(self.client.post('/api/login/', mobile, format='json').json()['role'], 'student')
+		staff = {'username': 'staff_user_test', 'password': password, 'staff_id': 'L1001'}
+		self.assertEqual(self.client.post('/api/login/staff/', staff, format='json').json()['staff_id'], 'L1001')
+		student = {'username': 'staff_user_test', 'password': password, 'student_id': 'S1002'}
+		self.assertEqual(self.client.post('/api/login/student/', student, format='json').json()['student_id'], 'S1002')
+
+		self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens.json()['access']}")
+		self.assertEqual(self.client.get('/api/me/profile/').json()['role'], 'student')
+
+	def test_backend_checks_role_ids(self):
+		self.assertEqual(
+			authenticate(username='student_user_test', password='ChangeMe123!', student_id='S1001'), self.student_user,
+		)
+		self.assertIsNone(authenticate(username='student_user_test', password='ChangeMe123!', student_id='S9999'))
+		self.assertIsNone(authenticate(username='student_user_test', password='ChangeMe123!', staff_id='L1001'))
+		self.assertIsNone(authenticate(username='nobody', password='ChangeMe123!'))
+
+
+class TokenResolverTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		lecturer_user = User.objects.create(username='lecturer_cache_test')
+		self.lecturer = Lecturer.objects.create(user=lecturer_user, staff_id='L2001', name='Lecturer Cache')
+		self.course = Course.objects.create(
+			name='Caching', course_code='CSC201', lecturer=self.lecturer,
+			latitude=5.6037, longitude=-0.1870, radius_meters=100,
+		)
+		self.token = AttendanceToken.objects.create(course=self.course, token='ABC123')
+
+		student_user = User.objects.create(username='student_cache_test')
+		self.student = Student.objects.create(user=student_user, student_id='S2001', name='Student Cache')
+		CourseEnrollment.objects.create(course=self.course, student=self.student)
+		self.client.force_authenticate(student_user)
+
+	def test_cache_hit_needs_no_queries(self):
+		resolved = resolve_active_token('ABC123')
+		self.assertEqual(resolved.course_id, self.course.id)
+		with self.assertNumQueries(0):
+			self.assertEqual(resolve_active_token('ABC123'), resolved)
+
+	def test_invalidated_on_save_and_delete(self):
+		resolve_active_token('ABC123')
+		self.token.is_active = False
+		self.token.save()
+		self.assertIsNone(resolve_active_token('ABC123'))
+
+		other = AttendanceToken.objects.create(course=self.course, token='XYZ789')
+		self.assertIsNotNone(resolve_active_token('XYZ789'))
+		other.delete()
+		self.assertIsNone(resolve_active_token('XYZ789'))
+
+	def test_renamed_token_stops_resolving_its_old_code(self):
+		self.assertIsNotNone(resolve_active_token('ABC123'))
+		self.client.force_authenticate(self.lecturer.user)
+		response = self.client.patch(f'/api/attendance-tokens/{self.token.pk}/', {'token': 'NEW999'}, format='json')
+		self.assertEqual(response.status_code, 200)
+		self.assertIsNone(resolve_active_token('ABC123'))
+		self.assertEqual(resolve_active_token('NEW999').token_id, self.token.pk)
+
+	def test_invalidated_when_course_geofence_changes(self):
+		resolve_active_token('ABC123')
+		self.course.radius_meters = 250
+		self.course.save()
+		self.assertEqual(resolve_active_token('ABC123').radius_meters, 250)
+
+	def test_take_attendance_uses_resolved_token(self):
+		response = self.client.post('/api/courses/take_attendance/', {
+			'token': 'ABC123', 'latitude': 5.6037, 'longitude': -0.1870,
+		}, format='json')
+		self.assertEqual(response.status_code, 200)
+		attendance = Attendance.objects.get(course=self.course)
+		self.assertIn(self.student, attendance.present_students.all())
+
+		response = self.client.post('/api/courses/take_attendance/', {'token': 'NOPE00'}, format='json')
+		self.assertEqual(response.status_code, 400)
+
+	def test_expired_tokens_rejected_and_swept(self):
+		# A bulk update skips save(), which would deactivate the token itself.
+		AttendanceToken.objects.filter(pk=self.token.pk).update(expires_at=timezone.now() - timezone.timedelta(minutes=1))
+		cache.clear()
+		self.assertIsNone(resolve_active_token('ABC123'))
+		live = AttendanceToken.objects.create(course=self.course, token='LIVE01')
+
+		out = io.StringIO()
+		call_command('sweep_expired_tokens', chunk_size=1, stdout=out)
+		self.assertEqual(out.getvalue().strip(), 'Deactivated 1 expired tokens')
+		self.token.refresh_from_db()
+		live.refresh_from_db()
+		self.assertEqual((self.token.is_active, live.is_active), (False, True))
+
+		# Only active codes are unique, so a swept code can be issued again.
+		AttendanceToken.objects.create(course=self.course, token='ABC123')
+		self.assertIsNotNone(resolve_active_token('ABC123'))
+
+
+class EnrollmentIndexTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		lecturer_user = User.objects.create(username='lecturer_enrollment_test')
+		lecturer = Lecturer.objects.create(user=lecturer_user, staff_id='L2002', name='Lecturer Enrollment')
+		self.course = Course.objects.create(name='Rosters', course_code='CSC202', lecturer=lecturer)
+		self.student = Student.objects.create(
+			user=User.objects.create(username='student_enrollment_test'), student_id='S2002', name='Enrolled',
+		)
+		self.other = Student.objects.create(
+			user=User.objects.create(username='other_enrollment_test'), student_id='S2003', name='Other',
+		)
+		CourseEnrollment.objects.create(course=self.course, student=self.student)
+
+	def test_membership_is_cached(self):
+		self.assertTrue(is_enrolled(self.course.id, self.student.id))
+		with self.assertNumQueries(0):
+			self.assertTrue(is_enrolled(self.course.id, self.student.id))
+			self.assertFalse(is_enrolled(self.course.id, self.other.id))
+
+	def test_enrollment_changes_invalidate_index(self):
+		self.assertFalse(is_enrolled(self.course.id, self.other.id))
+		self.course.students.add(self.other)
+		self.assertTrue(is_enrolled(self.course.id, self.other.id))
+
+		CourseEnrollment.objects.filter(course=self.course, student=self.student).delete()
+		self.assertFalse(is_enrolled(self.course.id, self.student.id))
+
+		self.other.courses.clear()
+		self.assertFalse(is_enrolled(self.course.id, self.other.id))
+
+
+class ProcessLocalCacheTests(SimpleTestCase):
+	def test_entries_are_kept_at_most_max_timeout(self):
+		local = ProcessLocalCache('process-local-test', {'MAX_TIMEOUT': 5})
+		with mock.patch('time.time', return_value=1000):
+			self.assertEqual(local.get_backend_timeout(None), 1005)
+			self.assertEqual(local.get_backend_timeout(60 * 60 * 24), 1005)
+			self.assertEqual(local.get_backend_timeout(2), 1002)
+			self.assertEqual(local.get_backend_timeout(), 1005)
+
+
+class GeofenceEngineTests(SimpleTestCase):
+	center = (5.6037, -0.1870)
+
+	def _points_around_radius(self, radius, count=200):
+		rng = random.Random(7)
+		points = []
+		for _ in range(count):
+			distance = radius + rng.uniform(-0.5, 0.5)
+			destination = geodesic(meters=distance).destination(self.center, rng.uniform(0, 360))
+			points.append((destination.latitude, destination.longitude))
+		return points
+
+	def test_fast_engine_matches_geodesic_at_the_edge(self):
+		fast, legacy = FastGeofenceEngine(), GeodesicGeofenceEngine()
+		for lat, lon in self._points_around_radius(100.0):
+			self.assertEqual(
+				fast.validate(self.center[0], self.center[1], 100.0, lat, lon),
+				legacy.validate(self.center[0], self.center[1], 100.0, lat, lon),
+			)
+
+	def test_batch_matches_scalar(self):
+		points = self._points_around_radius(250.0) + [(5.7, -0.1), (5.6038, -0.1871)]
+		rows = [(self.center[0], self.center[1], 250, lat, lon) for lat, lon in points]
+		rows += [(None, None, 100, 5.6, -0.18), (self.center[0], self.center[1], 100, None, None)]
+		expected = [validate_geofence(*row) for row in rows]
+		self.assertEqual(validate_geofence_batch(rows), expected)
+		self.assertEqual(expected[-2:], [(True, 0.0), (False, -1.0)])
+
+	def test_invalid_coordinates_raise_validation_error(self):
+		with self.assertRaises(ValidationError):
+			validate_geofence(5.6, -0.18, 100, 95, 0)
+
+
+class SyncAttendanceTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		lecturer_user = User.objects.create(username='lecturer_sync_test')
+		lecturer = Lecturer.objects.create(user=lecturer_user, staff_id='L2004', name='Lecturer Sync')
+		self.course = Course.objects.create(name='Sync', course_code='CSC204', lecturer=lecturer)
+		AttendanceToken.objects.create(course=self.course, token='SYNC01')
+		self.attendance = Attendance.objects.create(course=self.course, date=timezone.now().date())
+		self.students = [
+			Student.objects.create(
+				user=User.objects.create(username=f'sync_student_{i}'), student_id=f'S3{i:03d}', name=f'Sync {i}',
+			)
+			for i in range(30)
+		]
+		self.client.force_authenticate(lecturer_user)
+
+	def _record(self, student, **overrides):
+		record = {
+			'student_id': student.student_id,
+			'course_id': self.course.id,
+			'token': 'SYNC01',
+			'timestamp': timezone.now().isoformat(),
+			'device_id': 'device-1',
+		}
+		record.update(overrides)
+		return record
+
+	def test_per_record_results(self):
+		retried = self._record(self.students[1], token='GONE00')
+		records = [
+			self._record(self.students[0]),
+			retried,
+			dict(retried),
+			self._record(self.students[2], course_id='abc'),
+			self._record(self.students[3], token='GONE01', timestamp='not-a-date'),
+		]
+		response = self.client.post('/api/sync/attendance/', {'records': records}, format='json')
+		self.assertEqual(response.status_code, 200)
+		body = response.json()
+		self.assertEqual((body['synced'], body['pending'], body['duplicates'], body['total']), (1, 1, 1, 5))
+		self.assertEqual([error['record'] for error in body['errors']], [records[3], records[4]])
+		self.assertIn(self.students[0], self.attendance.present_students.all())
+		self.assertEqual(PendingAttendance.objects.filter(token='GONE00').count(), 1)
+
+	def test_query_count_does_not_grow_with_batch_size(self):
+		small = [self._record(student) for student in self.students[:2]]
+		large = [self._record(student) for student in self.students[2:]]
+		with CaptureQueriesContext(connection) as small_queries:
+			self.client.post('/api/sync/attendance/', {'records': small}, format='json')
+		with CaptureQueriesContext(connection) as large_queries:
+			response = self.client.post('/api/sync/attendance/', {'records': large}, format='json')
+		self.assertEqual(response.json()['synced'], len(large))
+		self.assertEqual(len(large_queries), len(small_queries))
+		self.assertEqual(self.attendance.present_students.count(), len(self.students))
+
+	def test_retried_records_are_stored_once(self):
+		records = [
+			self._record(self.students[0], token='GONE00', record_id='r1'),
+			self._record(self.students[1], token='GONE00'),
+		]
+		self.client.post('/api/sync/attendance/', {'records': records}, format='json')
+		# Same device and record_id, even if the app re-stamped the record.
+		retry = [dict(records[0], timestamp=timezone.now().isoformat()), records[1]]
+		response = self.client.post('/api/sync/attendance/', {'records': retry}, format='json')
+		self.assertEqual((response.json()['synced'], response.json()['pending'], response.json()['duplicates']), (0, 0, 2))
+		self.assertEqual(PendingAttendance.objects.count(), 2)
+
+	def test_synced_records_resent_without_a_key_are_duplicates(self):
+		records = [self._record(self.students[0]), self._record(self.students[1], token='GONE00')]
+		self.client.post('/api/sync/attendance/', {'records': records}, format='json')
+		# The token has expired since; the retry must not turn into pending rows.
+		AttendanceToken.objects.filter(token='SYNC01').update(is_active=False)
+		response = self.client.post('/api/sync/attendance/', {'records': records}, format='json')
+		self.assertEqual((response.json()['synced'], response.json()['pending'], response.json()['duplicates']), (0, 0, 2))
+		self.assertEqual(PendingAttendance.objects.filter(synced=False).count(), 1)
+
+	def test_rows_stored_concurrently_count_as_duplicates(self):
+		def row(key):
+			return PendingAttendance(
+				student_id='S3001', course_id=self.course.id, token='GONE00', timestamp=timezone.now(), record_key=key,
+			)
+
+		# A concurrent retry stored 'k1' between the key lookup and the insert.
+		row('k1').save()
+		self.assertEqual(_store_records([(0, {}, row('k1')), (1, {}, row('k2'))]), ({1}, {}))
+		self.assertEqual(PendingAttendance.objects.count(), 2)
+
+	def test_idempotency_key_replays_the_stored_response(self):
+		records = [self._record(self.students[0]), self._record(self.students[1], token='GONE00')]
+		headers = {'Idempotency-Key': 'upload-1'}
+		first = self.client.post('/api/sync/attendance/', {'records': records}, format='json', headers=headers)
+		self.assertNotIn('Idempotent-Replayed', first)
+
+		with self.assertNumQueries(1):
+			replay = self.client.post('/api/sync/attendance/', {'records': records}, format='json', headers=headers)
+		self.assertEqual(replay.json(), first.json())
+		self.assertEqual(replay['Idempotent-Replayed'], 'true')
+
+		response = self.client.post('/api/sync/attendance/', {'records': records[:1]}, format='json', headers=headers)
+		self.assertEqual(response.status_code, 422)
+
+	def test_expired_upload_responses_are_swept(self):
+		headers = {'Idempotency-Key': 'upload-old'}
+		self.client.post('/api/sync/attendance/', {'records': [self._record(self.students[0])]}, format='json', headers=headers)
+		self.client.post('/api/sync/attendance/', {'records': [self._record(self.students[1])]}, format='json',
+						 headers={'Idempotency-Key': 'upload-new'})
+		SyncBatch.objects.filter(key='upload-old').update(created_at=timezone.now() - timezone.timedelta(days=8))
+
+		out = io.StringIO()
+		call_command('sweep_sync_batches', chunk_size=1, stdout=out)
+		self.assertEqual(out.getvalue().strip(), 'Deleted 1 expired sync batches')
+		self.assertEqual(list(SyncBatch.objects.values_list('key', flat=True)), ['upload-new'])
+
+		# The record keys still keep a late retry from storing anything twice.
+		retry = self.client.post('/api/sync/attendance/', {'records': [self._record(self.students[0])]}, format='json', headers=headers)
+		self.assertNotIn('Idempotent-Replayed', retry)
+
+
+class PendingAttendanceProcessingTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		lecturer_user = User.objects.create(username='lecturer_pending_test')
+		lecturer = Lecturer.objects.create(user=lecturer_user, staff_id='L2005', name='Lecturer Pending')
+		self.course = Course.objects.create(name='Pending', course_code='CSC205', lecturer=lecturer)
+		AttendanceToken.objects.create(course=self.course, token='PEND01')
+		self.attendance = Attendance.objects.create(course=self.course, date=timezone.now().date())
+		self.student = Student.objects.create(
+			user=User.objects.create(username='pending_student'), student_id='S4001', name='Pending Student',
+		)
+		for token in ('PEND01', 'PEND01', 'GONE00'):
+			PendingAttendance.objects.create(
+				student_id='S4001', course_id=self.course.id, token=token, timestamp=timezone.now(),
+			)
+		self.client.force_authenticate(lecturer_user)
+
+	def test_endpoint_only_queues_a_run(self):
+		response = self.client.post('/api/sync/pending/')
+		self.assertEqual(response.status_code, 202)
+		self.assertEqual(response.json()['status'], 'queued')
+		self.assertEqual(response.json()['total'], 3)
+		self.assertEqual(PendingAttendance.objects.filter(synced=False).count(), 3)
+
+	def test_command_drains_run_in_chunks(self):
+		self.client.post('/api/sync/pending/')
+		call_command('process_pending_attendance', chunk_size=2, stdout=io.StringIO())
+
+		run = PendingAttendanceRun.objects.get()
+		self.assertEqual((run.status, run.processed, run.failed), ('finished', 2, 1))
+		self.assertIn(self.student, self.attendance.present_students.all())
+		self.assertEqual(PendingAttendance.objects.filter(synced=False, attempts=1).count(), 1)
+
+		response = self.client.get('/api/sync/pending/')
+		self.assertEqual(response.json()['run']['processed'], 2)
+
+	def test_crashed_chunk_is_claimed_again(self):
+		run = enqueue_run()
+		with mock.patch('attendance.pending.mark_present', side_effect=RuntimeError('worker died')):
+			with self.assertRaises(RuntimeError):
+				process_chunk(run)
+		self.assertEqual(PendingAttendance.objects.filter(synced=False, attempts=0).count(), 3)
+
+		drain_run(run)
+		run.refresh_from_db()
+		self.assertEqual((run.processed, run.failed), (2, 1))
+
+
+class AttendanceExportTests(APITestCase):
+	def setUp(self):
+		lecturer_user = User.objects.create(username='lecturer_export_test')
+		lecturer = Lecturer.objects.create(user=lecturer_user, staff_id='L2006', name='Lecturer Export')
+		self.course = Course.objects.create(name='Export', course_code='CSC206', lecturer=lecturer)
+		self.attendance = Attendance.objects.create(course=self.course, date=timezone.now().date())
+		students = [
+			Student.objects.create(
+				user=User.objects.create(username=f'export_student_{i}'), student_id=f'S5{i:03d}', name=f'Export {i}',
+			)
+			for i in range(4)
+		]
+		for student in students:
+			CourseEnrollment.objects.create(course=self.course, student=student)
+		self.attendance.present_students.add(students[3], students[1])
+		self.client.force_authenticate(lecturer_user)
+
+	def test_csv_export_streams_present_then_absent(self):
+		with self.assertNumQueries(2):
+			response = self.client.get(
+				f'/api/attendances/generate_excel/?attendance_id={self.attendance.id}&file_format=csv'
+			)
+			content = b''.join(response.streaming_content).decode()
+		rows = list(csv.reader(io.StringIO(content)))
+		self.assertEqual(rows[0], ['Student ID', 'Student Name', 'Date of Attendance', 'Status'])
+		self.assertEqual(
+			[(row[0], row[3]) for row in rows[1:]],
+			[('S5001', 'Present'), ('S5003', 'Present'), ('S5000', 'Absent'), ('S5002', 'Absent')],
+		)
+
+	def test_roster_is_enrolled_or_present_students_only(self):
+		CourseEnrollment.objects.filter(course=self.course, student__student_id='S5001').delete()
+		Student.objects.create(user=User.objects.create(username='export_outsider'), student_id='S5999', name='Outsider')
+		rows = [(row[0], row[3]) for row in roster_rows(self.attendance)]
+		self.assertEqual(rows, [('S5001', 'Present'), ('S5003', 'Present'), ('S5000', 'Absent'), ('S5002', 'Absent')])
+
+	def test_xlsx_export(self):
+		response = self.client.get(f'/api/attendances/generate_excel/?attendance_id={self.attendance.id}')
+		self.assertEqual(response.status_code, 200)
+		workbook = load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+		rows = list(workbook['Attendance Report'].iter_rows(values_only=True))
+		self.assertEqual(len(rows), 5)
+		self.assertEqual(rows[1][3], 'Present')
+		self.assertEqual(rows[-1][3], 'Absent')
+
+
+class AttendanceCounterTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		lecturer_user = User.objects.create(username='lecturer_counter_test', is_staff=True)
+		lecturer = Lecturer.objects.create(user=lecturer_user, staff_id='L2007', name='Lecturer Counter')
+		self.course = Course.objects.create(name='Counters', course_code='CSC207', lecturer=lecturer)
+		self.students = [
+			Student.objects.create(
+				user=User.objects.create(username=f'counter_student_{i}'), student_id=f'S6{i:03d}', name=f'Counter {i}',
+			)
+			for i in range(3)
+		]
+		self.course.students.add(*self.students[:2])
+		self.attendance = Attendance.objects.create(course=self.course, date=timezone.now().date())
+		self.lecturer_user = lecturer_user
+
+	def test_counters_follow_check_ins_and_enrollment(self):
+		self.assertEqual((self.attendance_counts()), (0, 2))
+		self.attendance.present_students.add(self.students[0])
+		self.course.students.add(self.students[2])
+		self.assertEqual(self.attendance_counts(), (1, 3))
+
+		AttendanceToken.objects.create(course=self.course, token='CNT001')
+		ingest_records([{
+			'student_id': self.students[1].student_id, 'course_id': self.course.id,
+			'token': 'CNT001', 'timestamp': timezone.now().isoformat(),
+		}])
+		self.assertEqual(self.attendance_counts(), (2, 3))
+
+	def test_check_ins_through_the_view_are_counted(self):
+		AttendanceToken.objects.create(course=self.course, token='CNT002')
+		for student in self.students[:2]:
+			self.client.force_authenticate(student.user)
+			response = self.client.post('/api/courses/take_attendance/', {'token': 'CNT002'}, format='json')
+			self.assertEqual(response.status_code, 200)
+		self.assertEqual(self.attendance_counts(), (2, 2))
+
+		self.client.force_authenticate(self.lecturer_user)
+		self.client.post('/api/attendance/end_attendance/', {'course_id': self.course.id}, format='json')
+		self.assertEqual(self.attendance_counts(), (2, 2))
+
+	def test_check_in_after_the_session_ends_is_refused(self):
+		AttendanceToken.objects.create(course=self.course, token='CNT003')
+		self.client.force_authenticate(self.students[0].user)
+		self.assertEqual(self.client.post('/api/courses/take_attendance/', {'token': 'CNT003'}, format='json').status_code, 200)
+
+		self.client.force_authenticate(self.lecturer_user)
+		self.client.post('/api/attendance/end_attendance/', {'course_id': self.course.id}, format='json')
+		self.client.force_authenticate(self.students[1].user)
+		response = self.client.post('/api/courses/take_attendance/', {'token': 'CNT003'}, format='json')
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(Attendance.objects.filter(course=self.course).count(), 1)
+		self.assertFalse(Attendance.objects.filter(course=self.course, is_active=True).exists())
+
+	def test_enrolled_count_is_frozen_when_session_ends(self):
+		self.client.force_authenticate(self.lecturer_user)
+		self.client.post('/api/attendance/end_attendance/', {'course_id': self.course.id}, format='json')
+		self.course.students.add(self.students[2])
+		self.assertEqual(self.attendance_counts(), (0, 2))
+
+	def test_recount_and_report_without_per_row_queries(self):
+		Attendance.objects.update(present_count=0, enrolled_count=0)
+		self.attendance.present_students.through.objects.create(
+			attendance_id=self.attendance.id, student_id=self.students[0].id,
+		)
+		call_command('recount_attendance', stdout=io.StringIO())
+		self.assertEqual(self.attendance_counts(), (1, 2))
+
+		Attendance.objects.create(course=self.course, date=timezone.now().date(), is_active=False)
+		self.client.force_login(self.lecturer_user)
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get('/api/admin/reports/')
+		self.assertContains(response, '50.0%')
+		self.assertLess(len(queries), 10)
+
+	def attendance_counts(self):
+		self.attendance.refresh_from_db()
+		return self.attendance.present_count, self.attendance.enrolled_count
+
+
+class ExpandableSerializerTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		self.user = User.objects.create(username='lecturer_expand_test', is_staff=True)
+		self.lecturer = Lecturer.objects.create(user=self.user, staff_id='L2008', name='Lecturer Expand')
+		self.client.force_authenticate(self.user)
+
+	def add_sessions(self, count):
+		for i in range(count):
+			course = Course.objects.create(
+				name=f'Expand {i}', course_code=f'EXP{Course.objects.count():03d}', lecturer=self.lecturer,
+			)
+			students = [
+				Student.objects.create(
+					user=User.objects.create(username=f'expand_student_{course.id}_{j}'),
+					student_id=f'S8{course.id:03d}{j}', name=f'Expand {j}',
+				)
+				for j in range(3)
+			]
+			course.students.add(*students)
+			Attendance.objects.create(course=course, date=timezone.now().date()).present_students.add(students[0])
+
+	def query_count(self, url):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		return len(queries), response.json()
+
+	def test_relations_are_compact_ids_by_default(self):
+		self.add_sessions(1)
+		_, data = self.query_count('/api/attendances/')
+		session = data['results'][0]
+		self.assertIsInstance(session['course'], int)
+		self.assertEqual(len(session['present_students']), 1)
+		self.assertIsInstance(session['present_students'][0], int)
+
+	def test_sparse_fields_and_expansion(self):
+		self.add_sessions(1)
+		_, data = self.query_count(
+			'/api/attendances/?fields=id,course.course_code,course.lecturer.name,present_students&expand=present_students.user'
+		)
+		session = data['results'][0]
+		self.assertEqual(set(session), {'id', 'course', 'present_students'})
+		self.assertEqual(session['course'], {'course_code': 'EXP000', 'lecturer': {'name': 'Lecturer Expand'}})
+		self.assertEqual(session['present_students'][0]['user']['username'], f"expand_student_{Course.objects.get().id}_0")
+
+	def test_query_count_does_not_grow_with_results(self):
+		url = '/api/attendances/?expand=course.lecturer.user,course.students,present_students.user'
+		self.add_sessions(2)
+		small, _ = self.query_count(url)
+		self.add_sessions(4)
+		large, data = self.query_count(url)
+		self.assertEqual(len(data['results']), 6)
+		self.assertEqual(small, large)
+
+
+class KeysetPaginationTests(APITestCase):
+	def setUp(self):
+		self.user = User.objects.create(username='lecturer_page_test', is_staff=True)
+		lecturer = Lecturer.objects.create(user=self.user, staff_id='L2009', name='Lecturer Page')
+		self.course = Course.objects.create(name='Pages', course_code='CSC209', lecturer=lecturer)
+		today = timezone.now().date()
+		# Several sessions share a date so pages have to break ties on id.
+		self.sessions = [
+			Attendance.objects.create(course=self.course, date=today - timezone.timedelta(days=i // 3), is_active=False)
+			for i in range(8)
+		]
+		self.client.force_authenticate(self.user)
+
+	def walk(self, url):
+		ids = []
+		while url:
+			data = self.client.get(url).json()
+			ids.extend(row['id'] for row in data['results'])
+			url = data['next']
+		return ids
+
+	def test_pages_follow_date_and_id(self):
+		expected = [a.id for a in sorted(self.sessions, key=lambda a: (a.date, a.id), reverse=True)]
+		self.assertEqual(self.walk('/api/attendances/?page_size=3'), expected)
+
+	def test_previous_link_and_stable_cursor(self):
+		first = self.client.get('/api/attendances/?page_size=3').json()
+		second = self.client.get(first['next']).json()
+		Attendance.objects.create(course=self.course, date=timezone.now().date(), is_active=False)
+		self.assertEqual(self.client.get(first['next']).json()['results'], second['results'])
+		back = self.client.get(second['previous']).json()
+		self.assertEqual([row['id'] for row in back['results']], [row['id'] for row in first['results']])
+
+	def test_page_size_is_capped_and_bad_cursor_rejected(self):
+		with self.settings(API_MAX_PAGE_SIZE=2):
+			self.assertEqual(len(self.client.get('/api/attendances/?page_size=100').json()['results']), 2)
+		self.assertEqual(self.client.get('/api/attendances/?cursor=garbage').status_code, 404)
+
+	def test_pending_records_are_paginated(self):
+		now = timezone.now()
+		PendingAttendance.objects.bulk_create([
+			PendingAttendance(student_id=f'S9{i:03d}', course_id=self.course.id, token='PAGE01', timestamp=now)
+			for i in range(5)
+		])
+		data = self.client.get('/api/sync/pending/?page_size=2').json()
+		self.assertEqual(data['count'], 5)
+		self.assertEqual(len(data['pending_records']), 2)
+		rest = self.client.get(data['next']).json()
+		self.assertEqual(len(rest['pending_records']), 2)
+		self.assertIsNotNone(rest['previous'])
+
+
+
+def _session_fixture(prefix, students):
+	lecturer = Lecturer.objects.create(
+		user=User.objects.create(username=f'{prefix}_lecturer'), staff_id=f'{prefix}L', name='Lecturer Session',
+	)
+	course = Course.objects.create(name='Sessions', course_code=f'{prefix}C', lecturer=lecturer)
+	students = [
+		Student.objects.create(user=User.objects.create(username=f'{prefix}_{i}'), student_id=f'{prefix}{i}', name=f'S{i}')
+		for i in range(students)
+	]
+	for student in students:
+		CourseEnrollment.objects.create(course=course, student=student)
+	return course, students
+
+
+class SessionUpsertTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		self.course, self.students = _session_fixture('UPS', 2)
+
+	def test_open_session_is_unique_per_course(self):
+		check_in(self.course.pk, self.students[0].pk)
+		session = Attendance.objects.get()
+		self.assertEqual((session.present_count, session.enrolled_count), (1, 2))
+		self.course.refresh_from_db()
+		self.assertTrue(self.course.is_active)
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			Attendance.objects.create(course=self.course, date=session.date)
+
+	def test_second_open_session_is_refused_with_400(self):
+		self.client.force_authenticate(self.course.lecturer.user)
+		today = timezone.now().date().isoformat()
+		response = self.client.post('/api/attendances/', {'course': self.course.pk, 'date': today}, format='json')
+		self.assertEqual(response.status_code, 201)
+		response = self.client.post('/api/attendances/', {'course': self.course.pk, 'date': today}, format='json')
+		self.assertEqual(response.status_code, 400)
+		self.assertIn('course', response.json())
+
+		# The same answer when the other session is opened after validation.
+		Attendance.objects.update(is_active=False)
+		with mock.patch('attendance.serializers.AttendanceSerializer.validate', side_effect=lambda attrs: attrs):
+			Attendance.objects.create(course=self.course, date=timezone.now().date())
+			response = self.client.post('/api/attendances/', {'course': self.course.pk, 'date': today}, format='json')
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(Attendance.objects.filter(is_active=True).count(), 1)
+
+	def test_session_left_open_is_ended_on_the_next_day(self):
+		yesterday = timezone.now() - timezone.timedelta(days=1)
+		with mock.patch('django.utils.timezone.now', return_value=yesterday):
+			check_in(self.course.pk, self.students[0].pk)
+		check_in(self.course.pk, self.students[1].pk)
+
+		old, new = Attendance.objects.order_by('date')
+		self.assertEqual((old.date, new.date), (yesterday.date(), timezone.now().date()))
+		self.assertFalse(old.is_active)
+		self.assertIsNotNone(old.ended_at)
+		self.assertTrue(new.is_active)
+		self.assertEqual(list(old.present_students.all()), [self.students[0]])
+		self.assertEqual(list(new.present_students.all()), [self.students[1]])
+		self.assertEqual(((old.present_count, old.enrolled_count), (new.present_count, new.enrolled_count)), ((1, 2), (1, 2)))
+
+	def test_writer_that_lost_the_race_joins_the_winners_session(self):
+		winner = Attendance.objects.create(course=self.course, date=timezone.now().date())
+		# The read ran before the other writer's session was committed.
+		with mock.patch('attendance.checkins._open_sessions', return_value={}):
+			check_in(self.course.pk, self.students[0].pk)
+		self.assertEqual(list(Attendance.objects.values_list('pk', 'present_count')), [(winner.pk, 1)])
+
+
+class ConcurrentCheckInTests(APITransactionTestCase):
+	def test_concurrent_first_check_ins_open_one_session(self):
+		course, students = _session_fixture('CON', 50)
+		barrier = threading.Barrier(len(students))
+		# SQLite test databases fail concurrent writers with "table is locked",
+		# so there the threads take turns; CI also runs this on PostgreSQL.
+		turn = threading.Lock() if connection.vendor == 'sqlite' else contextlib.nullcontext()
+		errors = []
+
+		def take(student):
+			try:
+				barrier.wait()
+				with turn:
+					check_in(course.pk, student.pk)
+			except Exception as exc:
+				errors.append(exc)
+			finally:
+				connection.close()
+
+		threads = [threading.Thread(target=take, args=(student,)) for student in students]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(errors, [])
+		session = Attendance.objects.get(course=course)
+		self.assertEqual(session.present_students.count(), len(students))
+		self.assertEqual(session.present_count, len(students))
+
+
+@override_settings(ATTENDANCE_WRITE_BEHIND=True)
+class WriteBehindCheckInTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		self.lecturer_user = User.objects.create(username='lecturer_checkin_test', is_staff=True)
+		lecturer = Lecturer.objects.create(user=self.lecturer_user, staff_id='L2010', name='Lecturer Check-in')
+		self.course = Course.objects.create(name='Check-ins', course_code='CSC210', lecturer=lecturer)
+		AttendanceToken.objects.create(course=self.course, token='CHK010')
+		self.students = []
+		for i in range(3):
+			user = User.objects.create(username=f'checkin_student_{i}')
+			self.students.append(Student.objects.create(user=user, student_id=f'S10{i:02d}', name=f'Check-in {i}'))
+		self.course.students.add(*self.students)
+
+	def take(self, student):
+		self.client.force_authenticate(student.user)
+		return self.client.post('/api/courses/take_attendance/', {'token': 'CHK010', 'device_id': 'phone-1'}, format='json')
+
+	def test_check_ins_are_logged_then_flushed_in_bulk(self):
+		for student in self.students:
+			self.assertEqual(self.take(student).status_code, 200)
+		self.assertEqual(CheckIn.objects.filter(flushed_at__isnull=True, device_id='phone-1').count(), 3)
+		self.assertFalse(Attendance.objects.exists())
+
+		call_command('flush_checkins', stdout=io.StringIO())
+		attendance = Attendance.objects.get(course=self.course)
+		self.assertEqual(attendance.present_students.count(), 3)
+		self.assertEqual(attendance.present_count, 3)
+		self.assertFalse(CheckIn.objects.filter(flushed_at__isnull=True).exists())
+
+	def test_flush_puts_check_ins_in_their_days_session(self):
+		yesterday = timezone.now().date() - timezone.timedelta(days=1)
+		CheckIn.objects.create(course=self.course, student=self.students[0], date=yesterday)
+		self.take(self.students[1])
+		call_command('flush_checkins', stdout=io.StringIO())
+
+		old, new = Attendance.objects.order_by('date')
+		self.assertEqual((old.date, old.is_active, new.is_active), (yesterday, False, True))
+		self.assertEqual(list(old.present_students.all()), [self.students[0]])
+		self.assertEqual(list(new.present_students.all()), [self.students[1]])
+
+	def test_reads_see_unflushed_check_ins(self):
+		self.take(self.students[0])
+		self.client.force_authenticate(self.lecturer_user)
+		data = self.client.get('/api/attendances/').json()
+		self.assertEqual(data['results'][0]['present_students'], [self.students[0].id])
+
+		self.take(self.students[1])
+		self.client.force_authenticate(self.lecturer_user)
+		self.client.post('/api/attendance/end_attendance/', {'course_id': self.course.id}, format='json')
+		self.assertEqual(Attendance.objects.get().present_count, 2)
+
+	def test_check_in_only_appends_to_the_log(self):
+		Attendance.objects.create(course=self.course, date=timezone.now().date())
+		self.course.refresh_from_db()
+		self.assertTrue(self.course.is_active)
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(self.take(self.students[0]).status_code, 200)
+		writes = [q['sql'] for q in queries if not q['sql'].startswith('SELECT')]
+		self.assertEqual(len(writes), 1)
+		self.assertTrue(writes[0].startswith(f'INSERT INTO "{CheckIn._meta.db_table}"'))
+
+
+class LoadTestHarnessTests(APITestCase):
+	def test_surge_reports_each_endpoint_and_cleans_up(self):
+		cache.clear()
+		out = io.StringIO()
+		with mock.patch.dict(os.environ, {'ALLOW_LOAD_TEST': 'true'}):
+			call_command('loadtest_surge', students=4, concurrency=1, scenario='take_attendance', stdout=out)
+		report = out.getvalue()
+		self.assertRegex(report, r'login\s+4\s')
+		self.assertRegex(report, r'take_attendance\s+4\s+[\d.]+\s+0\s')
+		self.assertIn('p99 ms', report)
+		self.assertFalse(User.objects.exists())
+		self.assertFalse(Course.objects.exists())
+
+
+class QueryPlanTests(APITestCase):
+	def test_hot_queries_use_indexes(self):
+		out = io.StringIO()
+		call_command('check_query_plans', rows=500, stdout=out)
+		self.assertIn('hot queries use indexes', out.getvalue())
+		self.assertFalse(Course.objects.exists())
+
+	def testsequential_scans_are_reported(self):
+		plan = PendingAttendance.objects.filter(device_id='phone').explain()
+		self.assertEqual(sequential_scans(plan, {PendingAttendance._meta.db_table}), [PendingAttendance._meta.db_table])
+
+
+class MetricsTests(APITestCase):
+	def sample(self, name, **labels):
+		return REGISTRY.get_sample_value(name, labels) or 0
+
+	def test_requests_are_counted_per_url_name(self):
+		before = self.sample('http_requests_total', view='mobile_login', method='POST', status='400')
+		queries_before = self.sample('db_queries_per_request_count', view='mobile_login')
+		self.client.post('/api/auth/login/', {'username': 'nobody', 'password': 'wrong'}, format='json')
+		self.assertEqual(self.sample('http_requests_total', view='mobile_login', method='POST', status='400'), before + 1)
+		self.assertEqual(self.sample('db_queries_per_request_count', view='mobile_login'), queries_before + 1)
+
+		with self.settings(DEBUG=True):
+			body = self.client.get('/metrics').content.decode()
+		self.assertIn('http_request_duration_seconds_bucket{', body)
+		self.assertIn('http_requests_in_flight', body)
+
+	def test_cache_hits_and_misses(self):
+		cache.clear()
+		misses = self.sample('cache_requests_total', cache='attendance-token', result='miss')
+		hits = self.sample('cache_requests_total', cache='attendance-token', result='hit')
+		user = User.objects.create(username='lecturer_metrics_test')
+		course = Course.objects.create(
+			name='Metrics', course_code='CSC212',
+			lecturer=Lecturer.objects.create(user=user, staff_id='L2012', name='Lecturer Metrics'),
+		)
+		AttendanceToken.objects.create(course=course, token='MET012')
+		resolve_active_token('MET012')
+		resolve_active_token('MET012')
+		self.assertEqual(self.sample('cache_requests_total', cache='attendance-token', result='miss'), misses + 1)
+		self.assertEqual(self.sample('cache_requests_total', cache='attendance-token', result='hit'), hits + 1)
+
+	def test_metrics_token(self):
+		with self.settings(METRICS_TOKEN='secret'):
+			self.assertEqual(self.client.get('/metrics').status_code, 401)
+			self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+		# Unset outside DEBUG: not served at all
+		self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		self.user = User.objects.create(username='student_token_test')
+		self.student = Student.objects.create(user=self.user, student_id='S1401', name='Student Token')
+		self.token = Token.objects.create(user=self.user)
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+	def test_cached_token_needs_no_queries(self):
+		self.assertEqual(self.client.get('/api/me/profile/').status_code, 200)
+		request = mock.Mock(META={'HTTP_AUTHORIZATION': f'Token {self.token.key}'.encode()})
+		with self.assertNumQueries(0):
+			user, _ = HeaderSchemeAuthentication().authenticate(request)
+		self.assertEqual(user.pk, self.user.pk)
+		self.assertEqual(student_pk(user), self.student.pk)
+
+	def test_cached_user_has_profile_and_admin_fields(self):
+		self.user.email = 'token@example.com'
+		self.user.first_name = 'Student'
+		self.user.save()
+		request = mock.Mock(META={'HTTP_AUTHORIZATION': f'Token {self.token.key}'.encode()})
+		HeaderSchemeAuthentication().authenticate(request)
+		with self.assertNumQueries(0):
+			user, _ = HeaderSchemeAuthentication().authenticate(request)
+			self.assertEqual((user.email, user.first_name, user.last_name), ('token@example.com', 'Student', ''))
+			self.assertFalse(user.is_staff or user.is_superuser)
+
+	def test_logout_and_deactivation_revoke_immediately(self):
+		self.assertEqual(self.client.get('/api/me/profile/').status_code, 200)
+		self.assertEqual(self.client.post('/api/auth/logout/').status_code, 200)
+		self.assertEqual(self.client.get('/api/me/profile/').status_code, 401)
+
+		token = Token.objects.create(user=self.user)
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+		self.assertEqual(self.client.get('/api/me/profile/').status_code, 200)
+		self.user.is_active = False
+		self.user.save()
+		self.assertEqual(self.client.get('/api/me/profile/').status_code, 401)
+
+	def test_bearer_requests_skip_token_lookup(self):
+		self.client.credentials(HTTP_AUTHORIZATION='Bearer not-a-jwt')
+		with mock.patch.object(CachedTokenAuthentication, 'authenticate_credentials') as lookup:
+			self.assertEqual(self.client.get('/api/me/profile/').status_code, 401)
+		lookup.assert_not_called()
+
+
+class ClaimsJWTAuthenticationTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		lecturer_user = User.objects.create(username='lecturer_jwt_test')
+		lecturer = Lecturer.objects.create(user=lecturer_user, staff_id='L1501', name='Lecturer JWT')
+		self.course = Course.objects.create(
+			name='Claims', course_code='CSC150', lecturer=lecturer,
+			latitude=5.6037, longitude=-0.1870, radius_meters=100,
+		)
+		AttendanceToken.objects.create(course=self.course, token='JWT150')
+		self.user = User.objects.create_user(username='student_jwt_test', password='ChangeMe123!')
+		self.student = Student.objects.create(user=self.user, student_id='S1501', name='Student JWT')
+		CourseEnrollment.objects.create(course=self.course, student=self.student)
+
+	def login(self):
+		self.client.credentials()
+		response = self.client.post('/api/auth/token/', {
+			'username': 'student_jwt_test', 'password': 'ChangeMe123!',
+		}, format='json')
+		self.assertEqual(response.status_code, 200)
+		self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+		return response.json()
+
+	def test_claims_carry_role_and_profile_ids(self):
+		self.login()
+		request = mock.Mock(META={'HTTP_AUTHORIZATION': self.client._credentials['HTTP_AUTHORIZATION'].encode()})
+		resolve_active_token('JWT150')
+		HeaderSchemeAuthentication().authenticate(request)
+		with self.assertNumQueries(0):
+			user, token = HeaderSchemeAuthentication().authenticate(request)
+			self.assertEqual(user.pk, self.user.pk)
+			self.assertEqual(user_role(user), 'student')
+			self.assertEqual(student_pk(user), self.student.pk)
+		self.assertEqual(token['student_id'], 'S1501')
+		self.assertIsNone(token['lecturer_pk'])
+
+	def test_take_attendance_skips_auth_and_profile_queries(self):
+		self.login()
+		sql = []
+
+		def capture(execute, query, params, many, context):
+			sql.append(query)
+			return execute(query, params, many, context)
+
+		with connection.execute_wrapper(capture):
+			response = self.client.post('/api/courses/take_attendance/', {
+				'token': 'JWT150', 'latitude': 5.6037, 'longitude': -0.1870,
+			}, format='json')
+		self.assertEqual(response.status_code, 200)
+		self.assertFalse([query for query in sql if 'auth_user' in query or 'attendance_student"' in query])
+		self.assertTrue(Attendance.objects.filter(course=self.course, present_students=self.student).exists())
+
+	def test_logout_and_password_change_revoke(self):
+		tokens = self.login()
+		self.assertEqual(self.client.get('/api/me/profile/').status_code, 200)
+		self.assertEqual(self.client.post('/api/auth/logout/').status_code, 200)
+		self.assertEqual(self.client.get('/api/me/profile/').status_code, 401)
+		refresh = self.client.post('/api/auth/token/refresh/', {'refresh': tokens['refresh']}, format='json')
+		self.assertEqual(refresh.status_code, 401)
+
+		self.login()
+		self.assertEqual(self.client.get('/api/me/profile/').status_code, 200)
+		self.user.set_password('Changed456!')
+		self.user.save()
+		self.assertEqual(self.client.get('/api/me/profile/').status_code, 401)
+
+
+class StudentAttendanceHistoryTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		lecturer_user = User.objects.create(username='lecturer_history_test')
+		lecturer = Lecturer.objects.create(user=lecturer_user, staff_id='L1601', name='Lecturer History')
+		self.algebra = Course.objects.create(name='Algebra', course_code='MTH101', lecturer=lecturer)
+		self.biology = Course.objects.create(name='Biology', course_code='BIO101', lecturer=lecturer)
+		self.user = User.objects.create(username='student_history_test')
+		self.student = Student.objects.create(user=self.user, student_id='S1601', name='Student History')
+		CourseEnrollment.objects.create(course=self.algebra, student=self.student)
+		CourseEnrollment.objects.create(course=self.biology, student=self.student)
+
+		today = timezone.now().date()
+		attended = Attendance.objects.create(course=self.algebra, date=today, is_active=False)
+		attended.present_students.add(self.student)
+		self.missed = Attendance.objects.create(course=self.algebra, date=today, is_active=False)
+		biology = Attendance.objects.create(course=self.biology, date=today, is_active=False)
+		biology.present_students.add(self.student)
+		self.open_session = Attendance.objects.create(course=self.biology, date=today)
+		# Written long before the history is first read
+		Attendance.objects.update(updated_at=timezone.now() - timezone.timedelta(days=1))
+		CourseEnrollment.objects.update(enrolled_at=timezone.now() - timezone.timedelta(days=1))
+		self.client.force_authenticate(self.user)
+
+	def test_absences_and_rates_per_course(self):
+		response = self.client.get('/api/student/attendance/history/')
+		self.assertEqual(response.status_code, 200)
+		courses = {course['course_code']: course for course in response.json()}
+		self.assertEqual(courses['MTH101']['session_count'], 2)
+		self.assertEqual(courses['MTH101']['present_count'], 1)
+		self.assertEqual(courses['MTH101']['attendance_rate'], 50.0)
+		self.assertEqual([entry['id'] for entry in courses['MTH101']['absences']], [self.missed.pk])
+		# The open session is not an absence yet
+		self.assertEqual(courses['BIO101']['attendance_rate'], 100.0)
+		self.assertEqual(courses['BIO101']['absences'], [])
+
+	def test_etag_answers_304_without_queries_until_a_check_in(self):
+		first = self.client.get('/api/student/attendance/history/')
+		with self.assertNumQueries(0):
+			again = self.client.get('/api/student/attendance/history/', HTTP_IF_NONE_MATCH=first['ETag'])
+		self.assertEqual(again.status_code, 304)
+
+		self.open_session.present_students.add(self.student)
+		changed = self.client.get('/api/student/attendance/history/', HTTP_IF_NONE_MATCH=first['ETag'])
+		self.assertEqual(changed.status_code, 200)
+		self.assertNotEqual(changed['ETag'], first['ETag'])
+
+	def test_since_returns_only_changed_entries(self):
+		cursor = self.client.get('/api/student/attendance/history/')['X-History-Cursor']
+		self.open_session.present_students.add(self.student)
+		response = self.client.get('/api/student/attendance/history/', {'since': cursor})
+		courses = {course['course_code']: course for course in response.json()}
+		self.assertEqual(courses['MTH101']['attendances'] + courses['MTH101']['absences'], [])
+		self.assertEqual([entry['id'] for entry in courses['BIO101']['attendances']], [self.open_session.pk])
+		self.assertEqual(courses['BIO101']['session_count'], 2)
+		self.assertEqual(self.client.get('/api/student/attendance/history/', {'since': 'yesterday'}).status_code, 400)
+
+
+class LecturerDashboardTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		self.user = User.objects.create(username='lecturer_dashboard_test')
+		self.lecturer = Lecturer.objects.create(user=self.user, staff_id='L1701', name='Lecturer Dashboard')
+		self.course = Course.objects.create(name='Dashboards', course_code='CSC170', lecturer=self.lecturer)
+		self.students = [
+			Student.objects.create(user=User.objects.create(username=f'dashboard_student_{i}'), student_id=f'S170{i}', name=f'S{i}')
+			for i in range(4)
+		]
+		for student in self.students:
+			CourseEnrollment.objects.create(course=self.course, student=student)
+		self.token = AttendanceToken.objects.create(course=self.course, token='DSH170')
+		self.client.force_authenticate(self.user)
+
+	def session(self, days_ago, present, is_active=False):
+		attendance = Attendance.objects.create(
+			course=self.course, date=timezone.localdate() - timezone.timedelta(days=days_ago),
+		)
+		attendance.present_students.add(*self.students[:present])
+		if not is_active:
+			attendance.ended_at = timezone.now()
+			attendance.save()
+			snapshot_counts(attendance)
+		return attendance
+
+	def test_counts_rates_and_token_status(self):
+		self.session(1, 4)
+		today = self.session(0, 1, is_active=True)
+		response = self.client.get('/api/lecturer/dashboard/')
+		self.assertEqual(response.status_code, 200)
+		[course] = response.json()
+		self.assertEqual(course['session_count'], 2)
+		self.assertEqual((course['present_total'], course['enrolled_total']), (5, 8))
+		self.assertEqual(course['attendance_rate'], 62.5)
+		self.assertEqual(course['token']['status'], 'active')
+		self.assertEqual(course['sessions'][0]['id'], today.pk)
+		self.assertEqual(course['sessions'][0]['attendance_rate'], 25.0)
+
+		today.present_students.add(self.students[1])
+		[course] = self.client.get('/api/lecturer/dashboard/').json()
+		self.assertEqual(course['sessions'][0]['present_count'], 2)
+
+	def test_opening_a_session_bumps_the_lecturer_version(self):
+		version = get_version(LECTURER_NAMESPACE, self.lecturer.pk)
+		self.session(0, 0, is_active=True)
+		self.course.refresh_from_db()
+		self.assertTrue(self.course.is_active)
+		self.assertGreater(get_version(LECTURER_NAMESPACE, self.lecturer.pk), version)
+
+		other = Course.objects.create(name='Dashboards 2', course_code='CSC171', lecturer=self.lecturer)
+		version = get_version(LECTURER_NAMESPACE, self.lecturer.pk)
+		check_in(other.pk, self.students[0].pk)
+		self.assertGreater(get_version(LECTURER_NAMESPACE, self.lecturer.pk), version)
+
+	def test_query_count_does_not_grow_with_sessions(self):
+		self.session(1, 2)
+		with QueryCounter() as few:
+			self.client.get('/api/lecturer/dashboard/', {'course': self.course.pk})
+		for days_ago in range(2, 20):
+			self.session(days_ago, 3)
+		cache.clear()
+		with QueryCounter() as many:
+			response = self.client.get('/api/lecturer/dashboard/', {'course': self.course.pk})
+		self.assertEqual(len(response.json()[0]['sessions']), 19)
+		self.assertEqual(many.count, few.count)
+
+	def test_range_filter_and_etag(self):
+		self.session(40, 2)
+		recent = self.session(3, 2)
+		[course] = self.client.get('/api/lecturer/dashboard/').json()
+		self.assertEqual([session['id'] for session in course['sessions']], [recent.pk])
+		since = (timezone.localdate() - timezone.timedelta(days=45)).isoformat()
+		[course] = self.client.get('/api/lecturer/dashboard/', {'from': since}).json()
+		self.assertEqual(course['session_count'], 2)
+
+		first = self.client.get('/api/lecturer/dashboard/')
+		self.assertEqual(self.client.get('/api/lecturer/dashboard/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+		self.assertEqual(self.client.get('/api/lecturer/dashboard/', {'from': 'soon'}).status_code, 400)
+
+
+class ConditionalGetTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		self.lecturer_user = User.objects.create(username='lecturer_etag_test')
+		self.lecturer = Lecturer.objects.create(user=self.lecturer_user, staff_id='L1801', name='Lecturer ETag')
+		self.course = Course.objects.create(name='ETags', course_code='CSC180', lecturer=self.lecturer)
+		self.user = User.objects.create(username='student_etag_test')
+		self.student = Student.objects.create(user=self.user, student_id='S1801', name='Student ETag')
+		CourseEnrollment.objects.create(course=self.course, student=self.student)
+
+	def assertRevalidates(self, path, change, **extra):
+		first = self.client.get(path, **extra)
+		self.assertEqual(first.status_code, 200)
+		with self.assertNumQueries(0):
+			unchanged = self.client.get(path, HTTP_IF_NONE_MATCH=first['ETag'], **extra)
+		self.assertEqual(unchanged.status_code, 304)
+		change()
+		changed = self.client.get(path, HTTP_IF_NONE_MATCH=first['ETag'], **extra)
+		self.assertEqual(changed.status_code, 200)
+		self.assertNotEqual(changed['ETag'], first['ETag'])
+		return changed
+
+	def test_enrolled_courses_follow_course_and_enrollment_writes(self):
+		self.client.force_authenticate(self.user)
+		path = '/api/student/enrolled_courses/'
+
+		def rename():
+			self.course.name = 'Entity tags'
+			self.course.save()
+		self.assertEqual(self.assertRevalidates(path, rename).json()['results'][0]['name'], 'Entity tags')
+
+		other = Course.objects.create(name='Other', course_code='CSC181', lecturer=self.lecturer)
+		response = self.assertRevalidates(path, lambda: CourseEnrollment.objects.create(course=other, student=self.student))
+		self.assertEqual(len(response.json()['results']), 2)
+
+	def test_profile_and_my_courses(self):
+		self.client.force_authenticate(self.user)
+
+		def rename_student():
+			self.student.name = 'Renamed'
+			self.student.save()
+		self.assertEqual(self.assertRevalidates('/api/me/profile/', rename_student).json()['name'], 'Renamed')
+
+		self.client.force_authenticate(self.lecturer_user)
+		new_course = lambda: Course.objects.create(name='New', course_code='CSC182', lecturer=self.lecturer)
+		self.assertEqual(len(self.assertRevalidates('/api/lecturers/my-courses/', new_course).json()), 2)
+
+	def test_query_string_is_part_of_the_etag(self):
+		self.client.force_authenticate(self.user)
+		plain = self.client.get('/api/student/enrolled_courses/')
+		expanded = self.client.get(
+			'/api/student/enrolled_courses/', {'expand': 'lecturer'}, HTTP_IF_NONE_MATCH=plain['ETag'],
+		)
+		self.assertEqual(expanded.status_code, 200)
+
+
+class NotificationDispatchTests(APITestCase):
+	def setUp(self):
+		self.users = [User.objects.create(username=f'notify_user_{i}') for i in range(4)]
+		for user, token in zip(self.users, ['device-a', 'device-b', 'invalid-c', 'flaky-d']):
+			DeviceToken.objects.create(user=user, token=token)
+			CourseSubscription.objects.create(user=user, course_id=1)
+		# Subscribed twice, still notified once
+		CourseSubscription.objects.create(user=self.users[0], course_id=2)
+		DeviceToken.objects.create(user=User.objects.create(username='notify_unsubscribed'), token='device-z')
+
+	def test_batches_retries_and_prunes_against_stub(self):
+		with StubFCMServer(fail_requests=1) as stub:
+			dispatcher = FCMDispatcher(url=stub.url, server_key=stub.server_key, batch_size=2, concurrency=2, backoff=0)
+			result = dispatch_notification('Hello', 'World', dispatcher=dispatcher)
+		self.assertEqual((result.sent, result.failed, result.pruned), (3, 1, 1))
+		self.assertEqual(sorted(stub.delivered), ['device-a', 'device-b', 'flaky-d'])
+		self.assertFalse(DeviceToken.objects.filter(token='invalid-c').exists())
+		self.assertGreater(result.throughput, 0)
+
+	def test_view_queues_and_worker_coalesces_duplicates(self):
+		self.client.force_authenticate(self.users[0])
+		with StubFCMServer() as stub, override_settings(FCM_URL=stub.url, FCM_SERVER_KEY=stub.server_key):
+			for _ in range(2):
+				response = self.client.post('/api/notifications/send/', {'title': 'Hi', 'body': 'There', 'course_id': 2}, format='json')
+				self.assertEqual(response.status_code, 202)
+			self.assertEqual(stub.requests, 0)
+			self.assertEqual(drain_outbox(), 2)
+			self.assertEqual(drain_outbox(), 0)
+		self.assertEqual(stub.delivered, ['device-a'])
+		queued = NotificationOutbox.objects.order_by('id')
+		self.assertEqual([row.status for row in queued], [NotificationOutbox.STATUS_SENT] * 2)
+		self.assertEqual((queued[0].result['sent'], queued[0].result['coalesced']), (1, 2))
+		with override_settings(FCM_SERVER_KEY=''):
+			response = self.client.post('/api/notifications/send/', {'title': 'Hi', 'body': 'There'}, format='json')
+		self.assertEqual(response.status_code, 503)
+
+	def test_total_delivery_failure_is_retried_then_failed(self):
+		row = NotificationOutbox.objects.create(title='Hi', body='There', course_id=2)
+		with StubFCMServer(fail_requests=100) as stub:
+			dispatcher = FCMDispatcher(url=stub.url, server_key=stub.server_key, max_retries=0, backoff=0)
+			self.assertEqual(drain_outbox(dispatcher=dispatcher), 1)
+			row.refresh_from_db()
+			self.assertEqual((row.status, row.claimed_at, row.result['failed']), (NotificationOutbox.STATUS_QUEUED, None, 1))
+			while drain_outbox(dispatcher=dispatcher):
+				pass
+		row.refresh_from_db()
+		self.assertEqual((row.status, row.attempts), (NotificationOutbox.STATUS_FAILED, MAX_ATTEMPTS))
+		self.assertEqual(stub.delivered, [])
+
+	def test_worker_idles_without_fcm(self):
+		out = io.StringIO()
+		with override_settings(FCM_SERVER_KEY=''):
+			call_command('run_notification_worker', stdout=out)
+		self.assertIn('notifications are disabled', out.getvalue())
+
+	def test_session_events_are_queued_with_the_change(self):
+		lecturer = Lecturer.objects.create(user=self.users[1], staff_id='NTF1', name='Notifier')
+		course = Course.objects.create(name='Outbox', course_code='OUT101', lecturer=lecturer)
+		self.client.force_authenticate(self.users[1])
+		with override_settings(FCM_SERVER_KEY='key'):
+			self.client.post(
+				f'/api/courses/{course.id}/generate_attendance_token/',
+				{'token': 'OUT001', 'latitude': '5.6', 'longitude': '-0.1'},
+				format='json',
+			)
+			Attendance.objects.create(course=course, date=timezone.localdate())
+			self.client.post('/api/attendance/end_attendance/', {'course_id': course.id}, format='json')
+		events = [row.data['event'] for row in NotificationOutbox.objects.filter(course_id=course.id).order_by('id')]
+		self.assertEqual(events, ['attendance_started', 'attendance_ended'])
+
+
+class AsyncCheckInViewTests(APITestCase):
+	def setUp(self):
+		cache.clear()
+		lecturer = Lecturer.objects.create(
+			user=User.objects.create(username='async_lecturer'), staff_id='L7001', name='Async Lecturer',
+			latitude=5.6037, longitude=-0.1870,
+		)
+		self.course = Course.objects.create(
+			name='Async', course_code='ASY101', lecturer=lecturer, latitude=5.6037, longitude=-0.1870, radius_meters=100,
+		)
+		AttendanceToken.objects.create(course=self.course, token='ASY001')
+		self.student = Student.objects.create(
+			user=User.objects.create(username='async_student'), student_id='S7001', name='Async Student',
+		)
+		CourseEnrollment.objects.create(course=self.course, student=self.student)
+		self.key = Token.objects.create(user=self.student.user).key
+		self.factory = AsyncRequestFactory()
+
+	def post(self, path, data, key=None):
+		headers = {'Authorization': f'Token {key}'} if key else {}
+		return self.factory.post(path, data, content_type='application/json', headers=headers)
+
+	async def test_take_attendance_matches_sync_view(self):
+		payload = {'token': 'ASY001', 'latitude': 5.6037, 'longitude': -0.1870}
+		response = await async_views.take_attendance(self.post('/api/courses/take_attendance/', payload, self.key))
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(json.loads(response.content)['message'], 'Attendance recorded successfully.')
+		attendance = await Attendance.objects.aget(course=self.course)
+		self.assertTrue(await attendance.present_students.filter(pk=self.student.pk).aexists())
+
+		response = await async_views.take_attendance(self.post('/api/courses/take_attendance/', payload))
+		self.assertEqual(response.status_code, 401)
+		self.assertEqual(response['WWW-Authenticate'], 'Token')
+		response = await async_views.take_attendance(self.post('/api/courses/take_attendance/', {'token': 'NOPE00'}, self.key))
+		self.assertEqual((response.status_code, json.loads(response.content)), (400, {'error': 'Invalid or expired token.'}))
+
+	async def test_submit_location_checks_in_like_take_attendance(self):
+		stale = await Attendance.objects.acreate(course=self.course, date=timezone.localdate() - timezone.timedelta(days=1))
+		payload = {'attendance_token': 'ASY001', 'latitude': 5.6037, 'longitude': -0.1870}
+		response = await async_views.submit_location(self.post('/api/submit-location/', payload, self.key))
+		self.assertEqual(json.loads(response.content), {'status': 'Attendance marked successfully'})
+
+		await stale.arefresh_from_db()
+		self.assertFalse(stale.is_active)
+		today = await Attendance.objects.aget(course=self.course, is_active=True)
+		self.assertEqual((today.date, today.present_count, today.enrolled_count), (timezone.localdate(), 1, 1))
+
+	def test_sync_submit_location_checks_in_like_take_attendance(self):
+		self.client.force_authenticate(self.student.user)
+		payload = {'attendance_token': 'ASY001', 'latitude': 5.6037, 'longitude': -0.1870}
+		response = self.client.post('/api/submit-location/', payload, format='json')
+		self.assertEqual(response.status_code, 200)
+		today = Attendance.objects.get(course=self.course)
+		self.assertEqual((today.is_active, today.present_count, today.enrolled_count), (True, 1, 1))
+
+	async def test_lecturer_location_and_sync(self):
+		response = await async_views.lecturer_location(self.post('/api/lecturer-location/', {'token': 'ASY001'}, self.key))
+		self.assertEqual(json.loads(response.content), {'longitude': -0.187, 'latitude': 5.6037, 'token': 'ASY001'})
+
+		await Attendance.objects.acreate(course=self.course, date=timezone.localdate())
+		record = {'student_id': 'S7001', 'course_id': self.course.pk, 'token': 'ASY001', 'timestamp': timezone.now().isoformat()}
+		response = await async_views.sync_attendance(self.post('/api/sync/attendance/', {'records': [record]}, self.key))
+		self.assertEqual(json.loads(response.content), {'synced': 1, 'pending': 0, 'duplicates': 0, 'total': 1, 'errors': None})
@@ -0,0 +1,152 @@
+"""
+Cached lookup of active attendance tokens for the check-in hot path.
+
+Entries live until the token expires and are dropped whenever the token, its
+course or its lecturer changes.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .geofence import validate_geofence
+from .metrics import record_cache
+
+TOKEN_CACHE_PREFIX = 'attendance-token'
+TOKEN_MAX_LENGTH = 6
+
+
+@dataclass(frozen=True)
+class ResolvedToken:
+    """Snapshot of an active token and the course data a check-in needs"""
+    token: str
+    token_id: int
+    course_id: int
+    lecturer_id: int
+    expires_at: datetime
+    latitude: Optional[Decimal]
+    longitude: Optional[Decimal]
+    radius_meters: Decimal
+    lecturer_latitude: Optional[Decimal]
+    lecturer_longitude: Optional[Decimal]
+
+    def has_geofence(self):
+        return self.latitude is not None and self.longitude is not None
+
+    def validate_location(self, student_latitude, student_longitude):
+        """Same contract as Course.validate_location"""
+        return validate_geofence(
+            self.latitude,
+            self.longitude,
+            self.radius_meters,
+            student_latitude,
+            student_longitude,
+        )
+
+
+def _cache_key(token_value):
+    return f"{TOKEN_CACHE_PREFIX}:{token_value}"
+
+
+def _from_instance(attendance_token):
+    course = attendance_token.course
+    lecturer = course.lecturer
+    return ResolvedToken(
+        token=attendance_token.token,
+        token_id=attendance_token.pk,
+        course_id=course.pk,
+        lecturer_id=lecturer.pk,
+        expires_at=attendance_token.expires_at,
+        latitude=course.latitude,
+        longitude=course.longitude,
+        radius_meters=course.radius_meters,
+        lecturer_latitude=lecturer.latitude,
+        lecturer_longitude=lecturer.longitude,
+    )
+
+
+def _valid_value(token_value):
+    return bool(token_value) and isinstance(token_value, str) and len(token_value) <= TOKEN_MAX_LENGTH
+
+
+def _active_tokens():
+    from .models import AttendanceToken
+    # Tokens past expires_at stay is_active until sweep_expired_tokens runs.
+    return AttendanceToken.objects.select_related('course__lecturer').filter(
+        is_active=True, expires_at__gt=timezone.now(),
+    )
+
+
+def _timeout(resolved):
+    return (resolved.expires_at - timezone.now()).total_seconds()
+
+
+def resolve_active_token(token_value):
+    """
+    Return a ResolvedToken for an active token value, or None.
+    A cache hit costs no database queries.
+    """
+    if not _valid_value(token_value):
+        return None
+
+    key = _cache_key(token_value)
+    resolved = cache.get(key)
+    record_cache(TOKEN_CACHE_PREFIX, resolved is not None)
+    if resolved is not None:
+        return resolved
+
+    attendance_token = _active_tokens().filter(token=token_value).first()
+    if attendance_token is None:
+        return None
+
+    resolved = _from_instance(attendance_token)
+    timeout = _timeout(resolved)
+    if timeout > 0:
+        cache.set(key, resolved, timeout=timeout)
+    return resolved
+
+
+async def aresolve_active_token(token_value):
+    """resolve_active_token() for async views"""
+    if not _valid_value(token_value):
+        return None
+
+    key = _cache_key(token_value)
+    resolved = await cache.aget(key)
+    record_cache(TOKEN_CACHE_PREFIX, resolved is not None)
+    if resolved is not None:
+        return resolved
+
+    attendance_token = await _active_tokens().filter(token=token_value).afirst()
+    if attendance_token is None:
+        return None
+
+    resolved = _from_instance(attendance_token)
+    timeout = _timeout(resolved)
+    if timeout > 0:
+        await cache.aset(key, resolved, timeout=timeout)
+    return resolved
+
+
+def invalidate_token(token_value):
+    cache.delete(_cache_key(token_value))
+
+
+def invalidate_tokens(token_values):
+    keys = [_cache_key(value) for value in token_values]
+    if keys:
+        cache.delete_many(keys)
+
+
+def invalidate_course_tokens(course_id=None, lecturer_id=None):
+    """Drop cached entries for the active tokens of a course or of all a lecturer's courses"""
+    from .models import AttendanceToken
+    tokens = AttendanceToken.objects.filter(is_active=True)
+    if course_id is not None:
+        tokens = tokens.filter(course_id=course_id)
+    if lecturer_id is not None:
+        tokens = tokens.filter(course__lecturer_id=lecturer_id)
+    invalidate_tokens(tokens.values_list('token', flat=True))
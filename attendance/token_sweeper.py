@@ -0,0 +1,89 @@
+"""
+Deactivation of expired attendance tokens.
+
+Lookups already ignore tokens past expires_at, so sweeping is housekeeping:
+it keeps the set of active tokens (and the partial indexes over it) small and
+frees expired codes for reuse. sweep_expired_tokens() flips is_active in
+chunks with one UPDATE each, skipping rows another sweeper holds, so it can
+run from the sweep_expired_tokens command, from every web process (see
+start_periodic_sweep) or both. The periodic sweep also deletes expired sync
+upload responses, see sync.sweep_sync_batches.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .conditional import COURSE_NAMESPACE, invalidate
+from .models import AttendanceToken
+from .sync import sweep_sync_batches
+from .token_cache import invalidate_tokens
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def expired_tokens(now=None):
+    """Tokens still marked active although they have expired"""
+    now = now or timezone.now()
+    return AttendanceToken.objects.filter(is_active=True).filter(
+        Q(expires_at__lte=now) | Q(expires_at__isnull=True)
+    )
+
+
+def sweep_chunk(chunk_size=DEFAULT_CHUNK_SIZE, now=None):
+    """Deactivate up to chunk_size expired tokens; returns how many it deactivated"""
+    with transaction.atomic():
+        rows = list(
+            expired_tokens(now)
+            .select_for_update(skip_locked=True)
+            .order_by('expires_at', 'id')
+            .values_list('id', 'token', 'course_id')[:chunk_size]
+        )
+        if not rows:
+            return 0
+        AttendanceToken.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(is_active=False)
+    # A bulk update sends no post_save, so invalidate what the signals would.
+    invalidate_tokens(token for _, token, _ in rows)
+    invalidate(COURSE_NAMESPACE, {course_id for _, _, course_id in rows})
+    return len(rows)
+
+
+def sweep_expired_tokens(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Deactivate every token that has expired by now, chunk by chunk"""
+    now = timezone.now()
+    total = 0
+    while True:
+        swept = sweep_chunk(chunk_size, now)
+        total += swept
+        if swept < chunk_size:
+            return total
+
+
+def start_periodic_sweep(interval=None, chunk_size=None):
+    """
+    Sweep every TOKEN_SWEEP_INTERVAL_SECONDS from a daemon thread of this
+    process. Does nothing when the interval is 0, the default.
+    """
+    interval = settings.TOKEN_SWEEP_INTERVAL_SECONDS if interval is None else interval
+    chunk_size = chunk_size or settings.TOKEN_SWEEP_CHUNK_SIZE
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                sweep_expired_tokens(chunk_size)
+                sweep_sync_batches(chunk_size)
+            except Exception:
+                # Database unavailable or similar; the next pass catches up.
+                pass
+            finally:
+                connection.close()
+
+    thread = threading.Thread(target=run, name='token-sweeper', daemon=True)
+    thread.start()
+    return thread
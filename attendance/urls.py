@@ -1,7 +1,8 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 from rest_framework.authtoken.views import obtain_auth_token
-from . import views, admin_views
+from . import views, admin_views, async_views
 
 router = DefaultRouter()
 router.register(r'lecturers', views.LecturerViewSet, basename='lecturer')
@@ -10,7 +11,19 @@ router.register(r'courses', views.CourseViewSet, basename='course')
 router.register(r'attendances', views.AttendanceViewSet, basename='attendance')
 router.register(r'attendance-tokens', views.AttendanceTokenViewSet, basename='attendance-token')
 
-urlpatterns = [
+# Under DEPLOYMENT_MODE=asgi the check-in endpoints are served by async views,
+# listed ahead of the router so they also take courses/take_attendance/.
+if settings.ASYNC_CHECKIN_VIEWS:
+    checkin_urlpatterns = [
+        path('courses/take_attendance/', async_views.take_attendance, name='take_attendance'),
+        path('submit-location/', async_views.submit_location, name='submit_location'),
+        path('lecturer-location/', async_views.lecturer_location, name='lecturer_location'),
+        path('sync/attendance/', async_views.sync_attendance, name='sync_attendance'),
+    ]
+else:
+    checkin_urlpatterns = []
+
+urlpatterns = checkin_urlpatterns + [
     path('', include(router.urls)),
     
     # Authentication endpoints (primary)
@@ -34,6 +47,7 @@ urlpatterns = [
     # Lecturer endpoints
     path('lecturers/my-courses/', views.LecturerViewSet.as_view({'get': 'my_courses'}), name='lecturer_my_courses'),
     path('lecturer/attendance/history/', views.LecturerAttendanceHistoryView.as_view(), name='lecturer_attendance_history'),
+    path('lecturer/dashboard/', views.LecturerDashboardView.as_view(), name='lecturer_dashboard'),
     
     # Attendance endpoints
     path('courses/take_attendance/', views.CourseViewSet.as_view({'post': 'take_attendance'}), name='take_attendance'),
@@ -0,0 +1,73 @@
+"""
+Version counters kept in the shared cache.
+
+Cached data derived from the database is stored under a key that includes the
+current version of whatever it was built from. Writers bump the version
+instead of hunting down every derived key, so stale entries are simply never
+read again and expire on their own.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+
+VERSION_PREFIX = 'version'
+
+
+def _key(namespace, pk):
+    return f"{VERSION_PREFIX}:{namespace}:{pk}"
+
+
+def _initial_version():
+    # Seed from the clock so a counter that was evicted from the cache never
+    # restarts at a value that older derived keys were built with.
+    return time.time_ns()
+
+
+def get_version(namespace, pk):
+    key = _key(namespace, pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(namespace, pk):
+    """get_version() for async views"""
+    key = _key(namespace, pk)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, _initial_version(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def get_versions(pairs):
+    """Return {(namespace, pk): version} for several counters in one cache round trip"""
+    keys = {_key(namespace, pk): (namespace, pk) for namespace, pk in pairs}
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, pair in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = get_version(*pair)
+        versions[pair] = version
+    return versions
+
+
+def version_tag(pairs, *parts):
+    """Hex digest of the current versions of several counters plus extra parts, for cache keys and ETags"""
+    pairs = list(pairs)
+    versions = get_versions(pairs)
+    parts = list(parts) + [versions[pair] for pair in pairs]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def bump_version(namespace, pk):
+    key = _key(namespace, pk)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), timeout=None)
+        return cache.get(key)
@@ -1,24 +1,51 @@
+from django.db import IntegrityError, transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets, generics, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, SAFE_METHODS
+from rest_framework.exceptions import ValidationError
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from django.contrib.auth import authenticate, logout
 from django.utils import timezone
-from django.http import HttpResponse
 from rest_framework.views import APIView
 from django.utils.decorators import method_decorator
 from django_ratelimit.decorators import ratelimit
-import csv
-from openpyxl import Workbook
-from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_date, parse_datetime
 from collections import defaultdict
 
-from .models import Lecturer, Student, Course, Attendance, AttendanceToken, PendingAttendance, DeviceToken, CourseSubscription
+from .models import Lecturer, Student, Course, Attendance, AttendanceToken, PendingAttendance, PendingAttendanceRun, DeviceToken, CourseSubscription
+from .checkins import check_in, ensure_flushed
+from .conditional import (
+    COURSE_NAMESPACE,
+    LECTURER_NAMESPACE,
+    STUDENT_NAMESPACE,
+    USER_NAMESPACE,
+    conditional_get,
+    course_pairs,
+    etag_matches,
+    invalidate,
+    lecturer_course_ids,
+    student_course_ids,
+)
+from .counters import snapshot_counts
+from .dashboard import dashboard_range, lecturer_dashboard
+from .enrollment import is_enrolled
+from .expansion import ExpandableViewSetMixin, requested_shape
+from .exports import EXPORT_FORMATS
+from .authentication import revoke_user_jwts
+from .history import student_history
+from .notifications import notifications_enabled
+from .outbox import enqueue_notification, notify_attendance_ended, notify_attendance_started
+from .pagination import KeysetPagination
+from .roles import ROLE_LECTURER, ROLE_STUDENT, auth_token_for, lecturer_pk, lecturer_profile, student_pk, student_profile, user_role
+from .pending import enqueue_run, run_progress
+from .sync import IDEMPOTENCY_KEY_MAX_LENGTH, REPLAYED_HEADER, IdempotencyKeyReused, sync_upload
+from .token_cache import invalidate_course_tokens, resolve_active_token
 from .serializers import (
     LecturerSerializer,
     StudentSerializer,
@@ -40,29 +67,52 @@ from .serializers import (
     EndAttendanceRequestSerializer,
     EndAttendanceResponseSerializer,
     AttendanceHistoryByCourseSerializer,
+    StudentHistoryByCourseSerializer,
+    LecturerDashboardCourseSerializer,
 )
 
+def _user_versions(view, request):
+    return [(USER_NAMESPACE, request.user.pk)]
+
+
+def _student_courses_versions(view, request):
+    student_id = student_pk(request.user)
+    if student_id is None:
+        return None
+    return [(STUDENT_NAMESPACE, student_id)] + course_pairs(student_course_ids(student_id))
+
+
+def _lecturer_courses_versions(view, request):
+    lecturer_id = lecturer_pk(request.user)
+    if lecturer_id is None:
+        return None
+    return [(LECTURER_NAMESPACE, lecturer_id)] + course_pairs(lecturer_course_ids(lecturer_id))
+
+
 # Lecturer ViewSet
-class LecturerViewSet(viewsets.ModelViewSet):
+class LecturerViewSet(ExpandableViewSetMixin, viewsets.ModelViewSet):
     queryset = Lecturer.objects.all()
     serializer_class = LecturerSerializer
     permission_classes = [IsAuthenticated]
 
     @action(detail=False, methods=['get'], url_path='my-courses')
+    @conditional_get(_lecturer_courses_versions)
     def my_courses(self, request):
-        lecturer = get_object_or_404(Lecturer, user=request.user)
-        courses = Course.objects.filter(lecturer=lecturer)
-        serializer = CourseSerializer(courses, many=True)
+        lecturer_id = lecturer_pk(request.user)
+        if lecturer_id is None:
+            raise Http404('No Lecturer matches the given query.')
+        courses = Course.objects.filter(lecturer_id=lecturer_id)
+        serializer = self.expanded(CourseSerializer, courses)
         return Response(serializer.data)
 
 # Student ViewSet
-class StudentViewSet(viewsets.ModelViewSet):
+class StudentViewSet(ExpandableViewSetMixin, viewsets.ModelViewSet):
     queryset = Student.objects.all()
     serializer_class = StudentSerializer
     permission_classes = [IsAuthenticated]
 
 # Course ViewSet
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(ExpandableViewSetMixin, viewsets.ModelViewSet):
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
     permission_classes = [IsAuthenticated]
@@ -83,22 +133,24 @@ class CourseViewSet(viewsets.ModelViewSet):
         if not token_value or not latitude or not longitude:
             return Response({'error': 'Token, latitude, and longitude are required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Create the attendance token
-        token = AttendanceToken.objects.create(
-            course=course,
-            token=token_value,
-            generated_at=timezone.now(),
-            expires_at=timezone.now() + timezone.timedelta(hours=4),
-            is_active=True
-        )
+        with transaction.atomic():
+            # Create the attendance token
+            token = AttendanceToken.objects.create(
+                course=course,
+                token=token_value,
+                generated_at=timezone.now(),
+                expires_at=timezone.now() + timezone.timedelta(hours=4),
+                is_active=True
+            )
 
-        # Optionally update the lecturer's location
-        lecturer = course.lecturer
-        lecturer.latitude = latitude
-        lecturer.longitude = longitude
-        lecturer.save()
+            # Optionally update the lecturer's location
+            lecturer = course.lecturer
+            lecturer.latitude = latitude
+            lecturer.longitude = longitude
+            lecturer.save()
+            notify_attendance_started(token)
 
-        serializer = AttendanceTokenSerializer(token)
+        serializer = AttendanceTokenSerializer(token, context=self.get_serializer_context(), **requested_shape(request))
         return Response(serializer.data)
 
     @action(detail=False, methods=['post'])
@@ -116,83 +168,78 @@ class CourseViewSet(viewsets.ModelViewSet):
         if not token_value:
             return Response({'error': 'Token is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            attendance_token = AttendanceToken.objects.get(token=token_value, is_active=True)
-            course = attendance_token.course
-            student = get_object_or_404(Student, user=request.user)
-
-            if student not in course.students.all():
-                return Response({'error': 'Student is not enrolled in this course.'}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Validate geofencing if course has geofence enabled
-            is_valid, distance = course.validate_location(latitude, longitude)
-            if not is_valid:
-                if distance < 0:
-                    return Response({'error': 'Location data required for this course.'}, status=status.HTTP_400_BAD_REQUEST)
-                else:
-                    return Response({
-                        'error': f'You are outside the allowed radius. You are {distance:.2f}m away from the class location.'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-
-            attendance, created = Attendance.objects.get_or_create(
-                course=course,
-                date=timezone.now().date()
-            )
-            attendance.present_students.add(student)
-            attendance.save()
+        attendance_token = resolve_active_token(token_value)
+        if attendance_token is None:
+            return Response({'error': 'Invalid or expired token.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        student_id = student_pk(request.user)
+        if student_id is None:
+            raise Http404('No Student matches the given query.')
+
+        if not is_enrolled(attendance_token.course_id, student_id):
+            return Response({'error': 'Student is not enrolled in this course.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate geofencing if course has geofence enabled
+        is_valid, distance = attendance_token.validate_location(latitude, longitude)
+        if not is_valid:
+            if distance < 0:
+                return Response({'error': 'Location data required for this course.'}, status=status.HTTP_400_BAD_REQUEST)
+            else:
+                return Response({
+                    'error': f'You are outside the allowed radius. You are {distance:.2f}m away from the class location.'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+        check_in(attendance_token.course_id, student_id, distance=distance, device_id=request.data.get('device_id'))
+
+        return Response({
+            'message': 'Attendance recorded successfully.',
+            'distance': distance
+        }, status=status.HTTP_200_OK)
 
-            return Response({
-                'message': 'Attendance recorded successfully.',
-                'distance': distance
-            }, status=status.HTTP_200_OK)
 
-        except AttendanceToken.DoesNotExist:
-            return Response({'error': 'Invalid or expired token.'}, status=status.HTTP_400_BAD_REQUEST)
-        
 # Attendance ViewSet
-class AttendanceViewSet(viewsets.ModelViewSet):
+class AttendanceViewSet(ExpandableViewSetMixin, viewsets.ModelViewSet):
     queryset = Attendance.objects.all()
     serializer_class = AttendanceSerializer
     permission_classes = [IsAuthenticated]
+    ordering = ('-date', '-id')
+
+    def get_queryset(self):
+        if self.request is not None and self.request.method in SAFE_METHODS:
+            ensure_flushed()
+        return super().get_queryset()
+
+    def _save_session(self, serializer):
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError:
+            # A concurrent request opened the course's session after validation.
+            raise ValidationError({'course': [AttendanceSerializer.OPEN_SESSION_EXISTS]})
+
+    def perform_create(self, serializer):
+        self._save_session(serializer)
+
+    def perform_update(self, serializer):
+        self._save_session(serializer)
 
     @action(detail=False, methods=['get'])
     def generate_excel(self, request):
         attendance_id = request.query_params.get('attendance_id')
+        file_format = request.query_params.get('file_format', 'xlsx')
 
         if not attendance_id:
             return Response({'error': 'attendance_id parameter is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        attendance = get_object_or_404(Attendance, id=attendance_id)
-
-        # Create an Excel workbook and add a worksheet
-        workbook = Workbook()
-        worksheet = workbook.active
-        worksheet.title = "Attendance Report"
-
-        # Add header row
-        worksheet.append(['Student ID', 'Student Name', 'Date of Attendance', 'Status'])
-
-        # Collect present students
-        present_students = [(student.student_id, student.name) for student in attendance.present_students.all()]
-
-        # Collect missed students
-        course_students = list(attendance.course.students.all())
-        missed_students = [(student.student_id, student.name) for student in course_students if student not in attendance.present_students.all()]
-
-        # Write present students
-        for student_id, student_name in sorted(present_students):
-            worksheet.append([student_id, student_name, attendance.date, 'Present'])
-
-        # Write absent students
-        for student_id, student_name in sorted(missed_students):
-            worksheet.append([student_id, student_name, attendance.date, 'Absent'])
-
-        # Create an HTTP response with the Excel file
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="attendance_{attendance_id}.xlsx"'
+        if file_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"file_format must be one of: {', '.join(EXPORT_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        workbook.save(response)
-        return response
+        attendance = get_object_or_404(Attendance.objects.only('id', 'course_id', 'date'), id=attendance_id)
+        ensure_flushed(course_id=attendance.course_id)
+        return EXPORT_FORMATS[file_format](attendance)
 
     @action(detail=False, methods=['post'], url_path='end_attendance')
     @swagger_auto_schema(
@@ -205,34 +252,51 @@ class AttendanceViewSet(viewsets.ModelViewSet):
         course_id = request.data.get('course_id')
         if not course_id:
             return Response({'error': 'course_id is required.'}, status=status.HTTP_400_BAD_REQUEST)
-        
+
+        # Check-ins still in the write-behind log belong to the session being closed
+        ensure_flushed(course_id=course_id)
+
         try:
             # Retrieve the most recent attendance for the course
             attendance = Attendance.objects.filter(course_id=course_id, is_active=True).latest('date')
         except Attendance.DoesNotExist:
             return Response({'error': 'No active attendance found for the course.'}, status=status.HTTP_404_NOT_FOUND)
 
-        attendance.is_active = False
-        attendance.ended_at = timezone.now()
-        attendance.save()
+        with transaction.atomic():
+            attendance.is_active = False
+            attendance.ended_at = timezone.now()
+            # Not the counters: the in-memory ones may be stale by now.
+            attendance.save(update_fields=['is_active', 'ended_at', 'updated_at'])
+            snapshot_counts(attendance)
+            # A check-in with a still active token would open a new session.
+            invalidate_course_tokens(course_id=attendance.course_id)
+            AttendanceToken.objects.filter(course_id=attendance.course_id, is_active=True).update(is_active=False)
+            invalidate(COURSE_NAMESPACE, [attendance.course_id])
+            notify_attendance_ended(attendance)
         return Response({'status': 'Attendance session ended successfully'}, status=status.HTTP_200_OK)
     
 
 # AttendanceToken ViewSet
-class AttendanceTokenViewSet(viewsets.ModelViewSet):
+class AttendanceTokenViewSet(ExpandableViewSetMixin, viewsets.ModelViewSet):
     queryset = AttendanceToken.objects.all()
     serializer_class = AttendanceTokenSerializer
     permission_classes = [IsAuthenticated]
+    ordering = ('-id',)
 
 # Student Enrolled Courses View
-class StudentEnrolledCoursesView(generics.ListAPIView):
+class StudentEnrolledCoursesView(ExpandableViewSetMixin, generics.ListAPIView):
     serializer_class = CourseSerializer
     permission_classes = [IsAuthenticated]
 
+    @conditional_get(_student_courses_versions)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
-        user = self.request.user
-        student = get_object_or_404(Student, user=user)
-        return Course.objects.filter(students=student)
+        student_id = student_pk(self.request.user)
+        if student_id is None:
+            raise Http404('No Student matches the given query.')
+        return Course.objects.filter(students=student_id)
 
 # Custom Login Views
 class StudentLoginView(ObtainAuthToken):
@@ -249,14 +313,14 @@ class StudentLoginView(ObtainAuthToken):
         student_id = request.data.get('student_id')
 
         user = authenticate(request, username=username, password=password)
-        if user and hasattr(user, 'student'):
-            student = user.student
+        student = student_profile(user) if user else None
+        if student is not None:
 
             if student.student_id == student_id:
-                token, created = Token.objects.get_or_create(user=user)
+                token = auth_token_for(user)
                 return Response({
                     'token': token.key,
-                    'user_id': user.student.id,
+                    'user_id': student.id,
                     'username': user.username,
                     'student_id': student.student_id
                 })
@@ -279,14 +343,14 @@ class StaffLoginView(ObtainAuthToken):
         staff_id = request.data.get('staff_id')
 
         user = authenticate(request, username=username, password=password)
-        if user and hasattr(user, 'lecturer'):
-            lecturer = user.lecturer
+        lecturer = lecturer_profile(user) if user else None
+        if lecturer is not None:
             if lecturer.staff_id == staff_id:
-                token, created = Token.objects.get_or_create(user=user)
+                token = auth_token_for(user)
 
                 return Response({
                     'token': token.key,
-                    'user_id': user.lecturer.id,
+                    'user_id': lecturer.id,
                     'username': user.username,
                     'staff_id': lecturer.staff_id
                 })
@@ -322,35 +386,37 @@ class MobileLoginView(APIView):
         if not user:
             return Response({'error': 'Invalid credentials'}, status=status.HTTP_400_BAD_REQUEST)
 
-        token, _ = Token.objects.get_or_create(user=user)
         payload = {
-            'token': token.key,
             'user_id': user.id,
             'username': user.username,
         }
 
-        if hasattr(user, 'student'):
+        # Students first for users with both profiles, as this endpoint always did.
+        role = ROLE_STUDENT if student_pk(user) is not None else user_role(user)
+        if role == ROLE_STUDENT:
+            student = student_profile(user)
             if not student_id:
                 return Response({'error': 'student_id is required for student login.'}, status=status.HTTP_400_BAD_REQUEST)
-            if user.student.student_id != student_id:
+            if student.student_id != student_id:
                 return Response({'error': 'Invalid student ID.'}, status=status.HTTP_400_BAD_REQUEST)
             payload.update({
                 'role': 'student',
-                'student_id': user.student.student_id,
+                'student_id': student.student_id,
             })
-        elif hasattr(user, 'lecturer'):
+        elif role == ROLE_LECTURER:
+            lecturer = lecturer_profile(user)
             if not staff_id:
                 return Response({'error': 'staff_id is required for staff login.'}, status=status.HTTP_400_BAD_REQUEST)
-            if user.lecturer.staff_id != staff_id:
+            if lecturer.staff_id != staff_id:
                 return Response({'error': 'Invalid staff ID.'}, status=status.HTTP_400_BAD_REQUEST)
             payload.update({
                 'role': 'staff',
-                'staff_id': user.lecturer.staff_id,
+                'staff_id': lecturer.staff_id,
             })
         else:
             payload['role'] = 'user'
 
-        return Response(payload)
+        return Response({'token': auth_token_for(user).key, **payload})
 
 # Logout View
 class LogoutView(generics.GenericAPIView):
@@ -358,7 +424,11 @@ class LogoutView(generics.GenericAPIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
-        request.user.auth_token.delete()
+        if isinstance(request.auth, Token):
+            request.user.auth_token.delete()
+        else:
+            # JWTs cannot be deleted; end every session of the user instead.
+            revoke_user_jwts(request.user.pk)
         logout(request)
         return Response(status=status.HTTP_200_OK)
 
@@ -381,21 +451,17 @@ class SubmitLocationView(generics.GenericAPIView):
         longitude = request.data.get('longitude')
         attendance_token = request.data.get('attendance_token')
 
-        try:
-            token = AttendanceToken.objects.get(token=attendance_token, is_active=True)
-        except AttendanceToken.DoesNotExist:
+        token = resolve_active_token(attendance_token)
+        if token is None:
             return Response({'error': 'Invalid or expired token'}, status=status.HTTP_400_BAD_REQUEST)
 
-        attendance = Attendance.objects.filter(course=token.course, date=timezone.now().date()).first()
-
-        if attendance and attendance.is_within_radius(float(latitude), float(longitude)):
-            user = request.user
-            if hasattr(user, 'student'):
-                student = user.student
-                if student in token.course.students.all():
-                    attendance.present_students.add(student)
-                    attendance.save()
-                    return Response({'status': 'Attendance marked successfully'}, status=status.HTTP_200_OK)
+        is_valid, distance = token.validate_location(latitude, longitude)
+        if is_valid:
+            student_id = student_pk(request.user)
+            if student_id is not None and is_enrolled(token.course_id, student_id):
+                # Same write path as take_attendance: today's session, counters, write-behind.
+                check_in(token.course_id, student_id, distance=distance, device_id=request.data.get('device_id'))
+                return Response({'status': 'Attendance marked successfully'}, status=status.HTTP_200_OK)
             return Response({'error': 'Student not enrolled in this course'}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({'error': 'Location is out of range'}, status=status.HTTP_400_BAD_REQUEST)
@@ -408,33 +474,46 @@ class StudentAttendanceHistoryView(generics.GenericAPIView):
     permission_classes = [IsAuthenticated]
 
     @swagger_auto_schema(
-        responses={200: AttendanceHistoryByCourseSerializer(many=True)},
+        manual_parameters=[
+            openapi.Parameter(
+                'since', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                description="X-History-Cursor of an earlier response; only entries changed after it are returned.",
+            ),
+        ],
+        responses={200: StudentHistoryByCourseSerializer(many=True), 304: 'Not modified'},
         operation_summary="Student attendance history",
-        operation_description="Return a student's attendance history grouped by course.",
+        operation_description=(
+            "Return a student's attendances, absences and attendance rate per course. "
+            "Send If-None-Match with the last ETag to get 304 when nothing changed."
+        ),
     )
     def get(self, request, *args, **kwargs):
-        # Fetch the current user and the corresponding student object
-        user = self.request.user
-        student = get_object_or_404(Student, user=user)
-
-        # Retrieve attendance records where the student was present
-        attendance_records = Attendance.objects.filter(
-            present_students=student
-        ).order_by('-date')
-
-        # Categorize records by course code and order by date descending within each course
-        categorized_records = defaultdict(list)
-        for attendance in attendance_records:
-            course_code = attendance.course.course_code
-            categorized_records[course_code].append({
-                'date': attendance.date.strftime('%Y-%m-%d'),
-            })
+        # Fetch the current user's student id
+        student_id = student_pk(self.request.user)
+        if student_id is None:
+            raise Http404('No Student matches the given query.')
+
+        since = request.query_params.get('since') or None
+        if since is not None:
+            since = parse_datetime(since)
+            if since is None:
+                return Response({'error': 'since must be an ISO 8601 timestamp.'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        ensure_flushed()
+
+        courses, cursor, etag = student_history(student_id, since)
+        headers = {'ETag': etag, 'X-History-Cursor': cursor.isoformat().replace('+00:00', 'Z')}
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(courses, headers=headers)
+    
+def _lecturer_history_versions(view, request):
+    # Flushing may open sessions, so it has to happen before the versions are read.
+    ensure_flushed()
+    return _lecturer_courses_versions(view, request)
 
-        # Prepare the response data
-        response_data = [{'course_code': course, 'attendances': records} for course, records in categorized_records.items()]
 
-        return Response(response_data)
-    
 #Lecturer Attendance History View
 class LecturerAttendanceHistoryView(generics.GenericAPIView):
     serializer_class = AttendanceSerializer
@@ -445,28 +524,78 @@ class LecturerAttendanceHistoryView(generics.GenericAPIView):
         operation_summary="Lecturer attendance history",
         operation_description="Return attendance history for courses taught by the lecturer.",
     )
+    @conditional_get(_lecturer_history_versions)
     def get(self, request, *args, **kwargs):
-        # Fetch the current user and the corresponding lecturer object
-        user = self.request.user
-        lecturer = get_object_or_404(Lecturer, user=user)
+        # Fetch the current user's lecturer id
+        lecturer_id = lecturer_pk(self.request.user)
+        if lecturer_id is None:
+            raise Http404('No Lecturer matches the given query.')
 
         # Retrieve attendance records for courses taught by the lecturer
         attendance_records = Attendance.objects.filter(
-            course__lecturer=lecturer
-        ).order_by('-date')
+            course__lecturer_id=lecturer_id
+        ).order_by('-date').values_list('course__course_code', 'date')
 
         # Categorize records by course code and order by date descending within each course
         categorized_records = defaultdict(list)
-        for attendance in attendance_records:
-            course_code = attendance.course.course_code
+        for course_code, date in attendance_records:
             categorized_records[course_code].append({
-                'date': attendance.date.strftime('%Y-%m-%d'),
+                'date': date.strftime('%Y-%m-%d'),
             })
 
         # Prepare the response data
         response_data = [{'course_code': course, 'attendances': records} for course, records in categorized_records.items()]
 
         return Response(response_data)
+
+
+# Lecturer Dashboard View
+class LecturerDashboardView(generics.GenericAPIView):
+    serializer_class = LecturerDashboardCourseSerializer
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('from', openapi.IN_QUERY, type=openapi.TYPE_STRING, description="First date (YYYY-MM-DD), default 30 days before `to`."),
+            openapi.Parameter('to', openapi.IN_QUERY, type=openapi.TYPE_STRING, description="Last date (YYYY-MM-DD), default today."),
+            openapi.Parameter('course', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description="Only this course."),
+        ],
+        responses={200: LecturerDashboardCourseSerializer(many=True), 304: 'Not modified'},
+        operation_summary="Lecturer dashboard",
+        operation_description=(
+            "Counts, rates, start/end times and token status of the lecturer's sessions per course. "
+            "Send If-None-Match with the last ETag to get 304 when nothing changed."
+        ),
+    )
+    def get(self, request, *args, **kwargs):
+        lecturer_id = lecturer_pk(request.user)
+        if lecturer_id is None:
+            raise Http404('No Lecturer matches the given query.')
+
+        params = request.query_params
+        course_id = params.get('course')
+        if course_id is not None and not course_id.isdigit():
+            return Response({'error': 'course must be a course id.'}, status=status.HTTP_400_BAD_REQUEST)
+        dates = {}
+        for name in ('from', 'to'):
+            value = params.get(name)
+            dates[name] = parse_date(value) if value else None
+            if value and dates[name] is None:
+                return Response({'error': f'{name} must be a date (YYYY-MM-DD).'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            date_from, date_to = dashboard_range(dates['from'], dates['to'])
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        ensure_flushed()
+
+        courses, etag = lecturer_dashboard(
+            lecturer_id, date_from, date_to, int(course_id) if course_id is not None else None,
+        )
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(courses, headers={'ETag': etag})
+
+
 # Lecturer Location View
 class LecturerLocationView(APIView):
     permission_classes = [IsAuthenticated]
@@ -474,27 +603,25 @@ class LecturerLocationView(APIView):
     def post(self, request, *args, **kwargs):
         token_value = request.data.get('token')
 
-        try:
-            token = AttendanceToken.objects.get(token=token_value, is_active=True)
-            lecturer = token.course.lecturer
-
-            if lecturer.latitude is None or lecturer.longitude is None:
-                return Response({'error': 'Lecturer coordinates not set.'}, status=status.HTTP_400_BAD_REQUEST)
+        token = resolve_active_token(token_value)
+        if token is None:
+            return Response({'error': 'Invalid or expired token.'}, status=status.HTTP_400_BAD_REQUEST)
 
-            return Response({
-                'longitude': lecturer.longitude,
-                'latitude': lecturer.latitude,
-                'token': token.token
-            }, status=status.HTTP_200_OK)
+        if token.lecturer_latitude is None or token.lecturer_longitude is None:
+            return Response({'error': 'Lecturer coordinates not set.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        except AttendanceToken.DoesNotExist:
-            return Response({'error': 'Invalid or expired token.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'longitude': token.lecturer_longitude,
+            'latitude': token.lecturer_latitude,
+            'token': token.token
+        }, status=status.HTTP_200_OK)
 
 
 # User Profile View
 class UserProfileView(generics.GenericAPIView):
     permission_classes = [IsAuthenticated]
 
+    @conditional_get(_user_versions)
     def get(self, request, *args, **kwargs):
         """Get the current user's profile information"""
         user = request.user
@@ -507,9 +634,10 @@ class UserProfileView(generics.GenericAPIView):
             'last_name': user.last_name,
         }
         
-        # Add role-specific data
-        if hasattr(user, 'student'):
-            student = user.student
+        # Add role-specific data; students first, as this endpoint always did
+        role = ROLE_STUDENT if student_pk(user) is not None else user_role(user)
+        if role == ROLE_STUDENT:
+            student = student_profile(user)
             profile_data.update({
                 'role': 'student',
                 'student_id': student.student_id,
@@ -518,8 +646,8 @@ class UserProfileView(generics.GenericAPIView):
                 'year': student.year,
                 'phone_number': student.phone_number,
             })
-        elif hasattr(user, 'lecturer'):
-            lecturer = user.lecturer
+        elif role == ROLE_LECTURER:
+            lecturer = lecturer_profile(user)
             profile_data.update({
                 'role': 'staff',
                 'staff_id': lecturer.staff_id,
@@ -558,15 +686,40 @@ class SyncAttendanceView(APIView):
                             'longitude': openapi.Schema(type=openapi.TYPE_NUMBER),
                             'timestamp': openapi.Schema(type=openapi.TYPE_STRING, description='ISO 8601 datetime'),
                             'device_id': openapi.Schema(type=openapi.TYPE_STRING),
+                            'record_id': openapi.Schema(
+                                type=openapi.TYPE_STRING,
+                                description='Client id of the record, unique per device; retries skip known ids',
+                            ),
                         }
                     ),
                     description='List of attendance records to sync'
                 )
             }
         ),
+        manual_parameters=[
+            openapi.Parameter(
+                'Idempotency-Key',
+                openapi.IN_HEADER,
+                type=openapi.TYPE_STRING,
+                required=False,
+                description='Retries with the same key get the first response back without reprocessing',
+            ),
+        ],
         responses={
-            200: openapi.Schema(type=openapi.TYPE_OBJECT),
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'synced': openapi.Schema(type=openapi.TYPE_INTEGER, description='Records marked present'),
+                    'pending': openapi.Schema(type=openapi.TYPE_INTEGER, description='Records stored for later'),
+                    'duplicates': openapi.Schema(
+                        type=openapi.TYPE_INTEGER, description='Records skipped as already stored or repeated',
+                    ),
+                    'total': openapi.Schema(type=openapi.TYPE_INTEGER, description='synced + pending + duplicates + errors'),
+                    'errors': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                },
+            ),
             400: openapi.Schema(type=openapi.TYPE_OBJECT),
+            422: openapi.Schema(type=openapi.TYPE_OBJECT),
         },
         operation_summary="Sync offline attendance records",
         operation_description="Submit batch of attendance records recorded while offline"
@@ -577,74 +730,18 @@ class SyncAttendanceView(APIView):
         if not records:
             return Response({'error': 'No records provided'}, status=status.HTTP_400_BAD_REQUEST)
         
-        synced_count = 0
-        pending_count = 0
-        errors = []
-        
-        for record in records:
-            try:
-                student_id = record.get('student_id')
-                course_id = record.get('course_id')
-                token_value = record.get('token')
-                latitude = record.get('latitude')
-                longitude = record.get('longitude')
-                timestamp = record.get('timestamp')
-                device_id = record.get('device_id')
-                
-                # Check if this is a duplicate
-                existing = PendingAttendance.objects.filter(
-                    student_id=student_id,
-                    course_id=course_id,
-                    token=token_value,
-                    timestamp__minute__range=[
-                        timezone.now().replace(second=0, microsecond=0).minute - 1,
-                        timezone.now().replace(second=0, microsecond=0).minute + 1
-                    ]
-                ).exists()
-                
-                if existing:
-                    continue
-                
-                # Try to process immediately if token is valid
-                try:
-                    attendance_token = AttendanceToken.objects.get(
-                        token=token_value,
-                        course_id=course_id,
-                        is_active=True
-                    )
-                    
-                    student = Student.objects.get(student_id=student_id)
-                    attendance = Attendance.objects.get(
-                        course_id=course_id,
-                        is_active=True
-                    )
-                    
-                    attendance.present_students.add(student)
-                    synced_count += 1
-                    
-                except (AttendanceToken.DoesNotExist, Student.DoesNotExist, Attendance.DoesNotExist):
-                    # Store as pending for later processing
-                    PendingAttendance.objects.create(
-                        student_id=student_id,
-                        course_id=course_id,
-                        token=token_value,
-                        latitude=latitude,
-                        longitude=longitude,
-                        timestamp=timestamp,
-                        device_id=device_id,
-                        synced=False
-                    )
-                    pending_count += 1
-                    
-            except Exception as e:
-                errors.append({'record': record, 'error': str(e)})
-        
-        return Response({
-            'synced': synced_count,
-            'pending': pending_count,
-            'total': len(records),
-            'errors': errors if errors else None
-        })
+        key = request.headers.get('Idempotency-Key')
+        if key and len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return Response({'error': 'Idempotency-Key is too long.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            data, replayed = sync_upload(request.user.pk, records, key)
+        except IdempotencyKeyReused as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        response = Response(data)
+        if replayed:
+            response[REPLAYED_HEADER] = 'true'
+        return response
 
 
 class ProcessPendingAttendanceView(APIView):
@@ -653,11 +750,18 @@ class ProcessPendingAttendanceView(APIView):
     Admin endpoint to process records stored when device was offline.
     """
     permission_classes = [IsAuthenticated]
-    
+    ordering = ('-timestamp', '-id')
+
     def get(self, request):
-        """Get pending attendance records"""
-        pending = PendingAttendance.objects.filter(synced=False).order_by('-timestamp')
-        
+        """Get a page of pending attendance records and the progress of the latest processing run"""
+        unsynced = PendingAttendance.objects.filter(synced=False)
+        paginator = KeysetPagination()
+        pending = paginator.paginate_queryset(
+            unsynced.only('id', 'student_id', 'course_id', 'token', 'timestamp', 'created_at'),
+            request,
+            view=self,
+        )
+
         data = [{
             'id': p.id,
             'student_id': p.student_id,
@@ -666,44 +770,20 @@ class ProcessPendingAttendanceView(APIView):
             'timestamp': p.timestamp,
             'created_at': p.created_at
         } for p in pending]
-        
-        return Response({'pending_records': data, 'count': len(data)})
-    
-    def post(self, request):
-        """Process all pending records"""
-        pending = PendingAttendance.objects.filter(synced=False)
-        
-        processed = 0
-        failed = 0
-        
-        for record in pending:
-            try:
-                attendance_token = AttendanceToken.objects.get(
-                    token=record.token,
-                    course_id=record.course_id,
-                    is_active=True
-                )
-                
-                student = Student.objects.get(student_id=record.student_id)
-                attendance = Attendance.objects.get(
-                    course_id=record.course_id,
-                    is_active=True
-                )
-                
-                attendance.present_students.add(student)
-                record.synced = True
-                record.synced_at = timezone.now()
-                record.save()
-                processed += 1
-                
-            except Exception as e:
-                failed += 1
-        
+
+        latest_run = PendingAttendanceRun.objects.order_by('-created_at').first()
         return Response({
-            'processed': processed,
-            'failed': failed,
-            'total': processed + failed
+            'pending_records': data,
+            'count': unsynced.count(),
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'run': run_progress(latest_run) if latest_run else None,
         })
+    
+    def post(self, request):
+        """Queue processing of all pending records; the process_pending_attendance worker does the work"""
+        run = enqueue_run(requested_by=request.user)
+        return Response(run_progress(run), status=status.HTTP_202_ACCEPTED)
 
 
 # Push Notification Views
@@ -756,22 +836,12 @@ class SendNotificationView(APIView):
         if not title or not body:
             return Response({'error': 'Title and body are required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Get subscribed users
-        if course_id:
-            subscriptions = CourseSubscription.objects.filter(course_id=course_id)
-        else:
-            subscriptions = CourseSubscription.objects.all()
-        
-        # Get device tokens for subscribed users
-        user_ids = subscriptions.values_list('user_id', flat=True)
-        tokens = DeviceToken.objects.filter(user_id__in=user_ids).values_list('token', flat=True)
-        
-        # Send notifications (using Firebase HTTP API - requires server key)
-        # For demo purposes, we'll just log this
-        print(f'Would send notification to {len(tokens)} devices')
-        print(f'Title: {title}, Body: {body}')
-        
-        return Response({
-            'message': 'Notifications queued',
-            'recipients': len(tokens)
-        })
+        if not notifications_enabled():
+            return Response({'error': 'Push notifications are not configured'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        # Sent by run_notification_worker, so the response time does not depend on the audience.
+        notification = enqueue_notification(title, body, course_id=course_id or None)
+        return Response(
+            {'message': 'Notification queued', 'id': notification.pk, 'status': notification.status},
+            status=status.HTTP_202_ACCEPTED,
+        )
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'attendance_system.settings')
+# Serve the check-in endpoints with async views (see attendance/async_views.py).
+os.environ.setdefault('DEPLOYMENT_MODE', 'asgi')
 
 application = get_asgi_application()
+
+# Deactivate expired attendance tokens in the background, if configured.
+from attendance.token_sweeper import start_periodic_sweep  # noqa: E402
+
+start_periodic_sweep()
@@ -69,6 +69,27 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# 'asgi' serves the check-in endpoints with async views (attendance/async_views.py)
+# and keeps the middleware chain async; attendance_system/asgi.py defaults to it.
+DEPLOYMENT_MODE = os.getenv('DEPLOYMENT_MODE', 'wsgi').lower()
+ASYNC_CHECKIN_VIEWS = DEPLOYMENT_MODE == 'asgi'
+if ASYNC_CHECKIN_VIEWS:
+    MIDDLEWARE[MIDDLEWARE.index('whitenoise.middleware.WhiteNoiseMiddleware')] = (
+        'attendance.async_views.AsyncWhiteNoiseMiddleware'
+    )
+
+# Request metrics served at /metrics to scrapers sending METRICS_TOKEN;
+# without a token only with DEBUG on.
+MIDDLEWARE.insert(0, 'attendance.metrics.MetricsMiddleware')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Adds an X-Query-Count header to every response; used by loadtest_surge --url.
+if os.getenv('QUERY_COUNT_HEADER', 'False').lower() == 'true':
+    MIDDLEWARE.insert(0, 'attendance.loadtest.QueryCountMiddleware')
+# Delays every query by this many milliseconds, standing in for a database
+# across the network; set by loadtest_surge --serve --db-latency-ms only.
+LOADTEST_DB_LATENCY_MS = float(os.getenv('LOADTEST_DB_LATENCY_MS', '0'))
+
 ROOT_URLCONF = 'attendance_system.urls'
 
 TEMPLATES = [
@@ -94,7 +115,13 @@ WSGI_APPLICATION = 'attendance_system.wsgi.application'
 database_url = os.getenv('DATABASE_URL')
 if database_url:
     DATABASES = {
-        'default': dj_database_url.config(conn_max_age=600, ssl_require=True),
+        # DATABASE_SSL_REQUIRE=False allows a local PostgreSQL without TLS.
+        # Under ASGI every request runs its queries in a thread of its own, so
+        # persistent connections would never be reused.
+        'default': dj_database_url.config(
+            conn_max_age=0 if ASYNC_CHECKIN_VIEWS else 600,
+            ssl_require=os.getenv('DATABASE_SSL_REQUIRE', 'True').lower() == 'true',
+        ),
     }
 else:
     DATABASES = {
@@ -105,6 +132,41 @@ else:
     }
 
 
+# Cache
+# Active tokens, enrollment, API tokens and the version counters behind ETags
+# are cached here and invalidated by the process that handles a change. Use
+# Redis in production so every gunicorn worker and Procfile process shares
+# the same entries. Without it each process has its own cache, whose entries
+# are kept for LOCAL_CACHE_MAX_TIMEOUT seconds at most, so another process's
+# change is seen that late instead of hours later.
+redis_url = os.getenv('REDIS_URL')
+if redis_url:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': redis_url,
+        },
+        'ratelimit': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': redis_url,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'attendance.local_cache.ProcessLocalCache',
+            'LOCATION': 'attendance-system',
+            'MAX_TIMEOUT': int(os.getenv('LOCAL_CACHE_MAX_TIMEOUT', '5')),
+        },
+        # Login rate limits count per minute; the cap above would reset them.
+        'ratelimit': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'attendance-ratelimit',
+        },
+    }
+RATELIMIT_USE_CACHE = 'ratelimit'
+
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -134,13 +196,31 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'attendance.authentication.HeaderSchemeAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'attendance.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', '50')),
+}
+
+# Login views are rate limited per IP. A load test driving a local server
+# from one machine disables the limit with RATELIMIT_ENABLE=False.
+RATELIMIT_ENABLE = os.getenv('RATELIMIT_ENABLE', 'True').lower() == 'true'
+
+# API authenticators by Authorization header scheme; the first one also
+# names the scheme in 401 responses.
+AUTHENTICATION_SCHEMES = {
+    'Token': 'attendance.authentication.CachedTokenAuthentication',
+    'Bearer': 'attendance.authentication.ClaimsJWTAuthentication',
 }
+# Seconds a DRF token stays resolved in the cache, and a user's JWT version
+# is remembered; logout and user changes revoke both earlier.
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', '300'))
+
+# Upper bound for ?page_size= on paginated list endpoints
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', '500'))
 
 # JWT Settings (djangorestframework-simplejwt)
 from datetime import timedelta
@@ -156,15 +236,44 @@ SIMPLE_JWT = {
     'AUTH_HEADER_NAME': 'HTTP_AUTHORIZATION',
     'USER_ID_FIELD': 'id',
     'USER_ID_CLAIM': 'user_id',
+    'TOKEN_REFRESH_SERIALIZER': 'attendance.authentication.VersionedTokenRefreshSerializer',
 }
 
 # GIS and other settings
 GDAL_LIBRARY_PATH = os.getenv('GDAL_LIBRARY_PATH')
+GEOFENCE_ENGINE = os.getenv('GEOFENCE_ENGINE', 'attendance.geofence.FastGeofenceEngine')
+
+# Write-behind check-ins: take_attendance appends to a log that the
+# flush_checkins worker merges into sessions every N ms or M records.
+ATTENDANCE_WRITE_BEHIND = os.getenv('ATTENDANCE_WRITE_BEHIND', 'False').lower() == 'true'
+CHECKIN_FLUSH_INTERVAL_MS = int(os.getenv('CHECKIN_FLUSH_INTERVAL_MS', '200'))
+CHECKIN_FLUSH_BATCH_SIZE = int(os.getenv('CHECKIN_FLUSH_BATCH_SIZE', '500'))
+
+# Push notifications (FCM multicast HTTP API). Without a server key nothing
+# is sent. FCM_URL can point at a local stub, see send_notification --stub.
+FCM_URL = os.getenv('FCM_URL', 'https://fcm.googleapis.com/fcm/send')
+FCM_SERVER_KEY = os.getenv('FCM_SERVER_KEY', '')
+FCM_BATCH_SIZE = int(os.getenv('FCM_BATCH_SIZE', '1000'))
+FCM_CONCURRENCY = int(os.getenv('FCM_CONCURRENCY', '8'))
+FCM_MAX_RETRIES = int(os.getenv('FCM_MAX_RETRIES', '3'))
+FCM_BACKOFF_SECONDS = float(os.getenv('FCM_BACKOFF_SECONDS', '0.5'))
+# Notifications are queued in an outbox and sent by run_notification_worker.
+NOTIFICATION_OUTBOX_BATCH_SIZE = int(os.getenv('NOTIFICATION_OUTBOX_BATCH_SIZE', '100'))
+NOTIFICATION_WORKER_INTERVAL_MS = int(os.getenv('NOTIFICATION_WORKER_INTERVAL_MS', '1000'))
+
+# Expired attendance tokens are deactivated by sweep_expired_tokens and, when
+# the interval is above 0, by a background thread in each web process.
+TOKEN_SWEEP_INTERVAL_SECONDS = float(os.getenv('TOKEN_SWEEP_INTERVAL_SECONDS', '0'))
+TOKEN_SWEEP_CHUNK_SIZE = int(os.getenv('TOKEN_SWEEP_CHUNK_SIZE', '1000'))
+# Responses stored for sync uploads sent with an Idempotency-Key are deleted
+# after this many seconds (0 keeps them) by sweep_sync_batches and the same
+# background thread.
+SYNC_BATCH_TTL_SECONDS = int(os.getenv('SYNC_BATCH_TTL_SECONDS', str(7 * 24 * 3600)))
 
 AUTHENTICATION_BACKENDS = (
-    'attendance.authentication_backends.StudentBackend',
-    'attendance.authentication_backends.StaffBackend',
-    'django.contrib.auth.backends.ModelBackend',  # Default backend
+    # Username/password with the user's student/lecturer profile and API token
+    # loaded in the same query; also serves admin logins.
+    'attendance.authentication_backends.RoleAwareBackend',
 )
 
 # Swagger settings for API documentation
@@ -193,3 +302,6 @@ else:
         "http://127.0.0.1:3000",  # Localhost IP for development (adjust port as needed)
         "http://localhost:8000",  # If using another local environment
     ]
+
+# Let browser clients read the student history's cache validator and cursor
+CORS_EXPOSE_HEADERS = ['ETag', 'X-History-Cursor']
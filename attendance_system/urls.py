@@ -7,11 +7,14 @@ from rest_framework import permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenRefreshView
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from attendance.authentication import issue_jwt
+from attendance.metrics import metrics_view
+from attendance.roles import ROLE_LECTURER, ROLE_STUDENT, lecturer_profile, student_profile, user_role
+
 
 def _db_ok():
     try:
@@ -48,22 +51,18 @@ class CustomTokenObtainView(APIView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
         
-        # Generate tokens
-        refresh = RefreshToken.for_user(user)
+        # Generate tokens; they carry the role and profile ids as claims
+        refresh = issue_jwt(user)
         
         # Determine user role
-        if hasattr(user, 'lecturer'):
-            role = 'lecturer'
-            user_id = user.lecturer.id
-            staff_id = user.lecturer.staff_id
-        elif hasattr(user, 'student'):
-            role = 'student'
-            user_id = user.student.id
-            student_id = user.student.student_id
+        role = user_role(user)
+        if role == ROLE_LECTURER:
+            user_id = lecturer_profile(user).id
+        elif role == ROLE_STUDENT:
+            user_id = student_profile(user).id
         else:
             role = 'admin'
             user_id = user.id
-            staff_id = None
         
         return Response({
             'access': str(refresh.access_token),
@@ -94,6 +93,7 @@ urlpatterns = [
     path('health/', health_view),
     path('api/health/', health_view),
     path('version/', version_view),
+    path('metrics', metrics_view),
     path('api/', include('attendance.urls')),
     path('admin/', admin.site.urls),
     path('', lambda request: HttpResponseRedirect('/api/')),  # Redirect root URL to /api/
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'attendance_system.settings')
 
 application = get_wsgi_application()
+
+# Deactivate expired attendance tokens in the background, if configured.
+from attendance.token_sweeper import start_periodic_sweep  # noqa: E402
+
+start_periodic_sweep()
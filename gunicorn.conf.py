@@ -0,0 +1,24 @@
+"""
+Gunicorn settings, loaded automatically from the working directory.
+
+Prometheus metrics are shared between workers through files in
+PROMETHEUS_MULTIPROC_DIR. The directory is emptied when the master starts and
+the files of a worker that exits are marked dead so its gauges stop counting.
+"""
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'attendance-metrics'))
+
+
+def on_starting(server):
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)